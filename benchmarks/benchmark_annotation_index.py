@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.annotation_index import AnnotationIndex
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Benchmark of the queries of the annotation index on synthetic face "
+        "tracks."
+    )
+    parser.add_argument(
+        "--tracks",
+        "-n",
+        type=int,
+        default=1_000_000,
+        help="Number of face tracks in the index. Default: 1000000.",
+    )
+    parser.add_argument(
+        "--tracks-per-file",
+        type=int,
+        default=10,
+        help="Number of face tracks of each annotation file. Default: 10.",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="Number of runs of each query. Default: 5.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+QUERIES = {
+    "frames>300,prob>0.9": {"min_frames": 300, "min_prob": 0.9},
+    "frames>1000": {"min_frames": 1000},
+    "box_size<32": {"max_box_size": 32.0},
+    "top100 by quality": {"sort": "quality", "limit": 100},
+    "prob>0.99,box_size>200": {"min_prob": 0.99, "min_box_size": 200.0},
+}
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+    rng = np.random.default_rng(0)
+    num_tracks = args.tracks
+    num_files = -(-num_tracks // args.tracks_per_file)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = AnnotationIndex(os.path.join(tmp_dir, "index.sqlite"))
+        start = time.perf_counter()
+        with index.conn:
+            index.conn.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, 0, 0, ?)",
+                (
+                    (i, f"/data/{i % 100}/{i}.json", f"/data/{i}.mp4", 10)
+                    for i in range(num_files)
+                ),
+            )
+            num_frames = rng.geometric(1 / 150, num_tracks)
+            first_frame = rng.integers(0, 5000, num_tracks)
+            mean_prob = 1 - rng.beta(1, 10, num_tracks)
+            box_size = rng.lognormal(4, 0.8, num_tracks)
+            quality = rng.random(num_tracks)
+            index.conn.executemany(
+                "INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        i // args.tracks_per_file,
+                        str(i % args.tracks_per_file),
+                        int(num_frames[i]),
+                        int(first_frame[i]),
+                        int(first_frame[i] + num_frames[i] - 1),
+                        float(mean_prob[i]),
+                        float(mean_prob[i]) - 0.1,
+                        float(box_size[i]),
+                        float(quality[i]),
+                    )
+                    for i in range(num_tracks)
+                ),
+            )
+        insert_time = time.perf_counter() - start
+        print(f"Inserted {num_tracks} tracks in {insert_time:.1f} s")
+
+        print("query\tresults\tmin_ms\tmedian_ms")
+        for name, query in QUERIES.items():
+            times = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                tracks = index.query(**query)
+                times.append(time.perf_counter() - start)
+            print(
+                f"{name}\t{len(tracks)}\t{min(times) * 1000:.1f}\t"
+                f"{np.median(times) * 1000:.1f}"
+            )
+        index.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from src.similarity_index import INDEX_TYPES, create_index
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Benchmark of the re-identification similarity indices."
+    )
+    parser.add_argument(
+        "--sizes",
+        "-n",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 50000],
+        help="Number of identities stored in the index. Default: 1000 10000 "
+        "50000.",
+    )
+    parser.add_argument(
+        "--index",
+        "-i",
+        type=str,
+        nargs="+",
+        choices=INDEX_TYPES,
+        default=list(INDEX_TYPES),
+        help="Index types to benchmark. Default: all.",
+    )
+    parser.add_argument(
+        "--dim",
+        type=int,
+        default=512,
+        help="Embedding size. Default: 512.",
+    )
+    parser.add_argument(
+        "--queries",
+        type=int,
+        default=1000,
+        help="Number of queries for each index. Default: 1000.",
+    )
+    parser.add_argument(
+        "--noise",
+        type=float,
+        default=0.5,
+        help="Standard deviation of the noise added to the queries, relative "
+        "to the norm of the embeddings. Default: 0.5.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+    rng = np.random.default_rng(0)
+
+    print("index\tsize\tinsert_ms\tquery_ms\trecall@1")
+    for size in args.sizes:
+        embs = rng.standard_normal((size, args.dim)).astype(np.float32)
+        query_ids = rng.integers(0, size, args.queries)
+        noise = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+        queries = embs[query_ids] + args.noise * noise
+
+        ground_truth = None
+        for index_type in ["brute_force"] + [
+            x for x in args.index if x != "brute_force"
+        ]:
+            index = create_index(index_type)
+            start = time.perf_counter()
+            for face_id, emb in enumerate(embs):
+                index.add(str(face_id), emb)
+            insert_time = (time.perf_counter() - start) / size
+
+            results = []
+            start = time.perf_counter()
+            for query in queries:
+                face_ids, _ = index.search(query, k=1)
+                results.append(face_ids[0])
+            query_time = (time.perf_counter() - start) / args.queries
+
+            if ground_truth is None:
+                ground_truth = results
+            if index_type not in args.index:
+                continue
+            recall = np.mean(
+                [x == y for x, y in zip(results, ground_truth)]
+            )
+            print(
+                f"{index_type}\t{size}\t{insert_time * 1000:.4f}\t"
+                f"{query_time * 1000:.4f}\t{recall:.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
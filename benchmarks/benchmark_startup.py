@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from src.cli import SUBCOMMANDS
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Benchmark of the startup time of each vft subcommand: time to import "
+        "its script, and time to run it with --help in a new interpreter."
+    )
+    parser.add_argument(
+        "commands",
+        type=str,
+        nargs="*",
+        default=list(SUBCOMMANDS),
+        help="Subcommands to measure. Default: all of them.",
+    )
+    parser.add_argument(
+        "--runs",
+        "-n",
+        type=int,
+        default=5,
+        help="Number of runs of each subcommand. Default: 5.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def run(code: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, *code],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+
+    # Baseline: start-up of the interpreter alone
+    baseline = min(run(["-c", "pass"]) for _ in range(args.runs))
+    print(f"python\t{baseline * 1000:.0f} ms")
+    print("command\timport_ms\thelp_ms\thelp_median_ms")
+    for command in args.commands:
+        import_times = [
+            run(["-c", f"import {SUBCOMMANDS[command]}"])
+            for _ in range(args.runs)
+        ]
+        help_times = [
+            run(["-m", "src.cli", command, "--help"]) for _ in range(args.runs)
+        ]
+        print(
+            f"{command}\t{(min(import_times) - baseline) * 1000:.0f}\t"
+            f"{min(help_times) * 1000:.0f}\t"
+            f"{statistics.median(help_times) * 1000:.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import argparse
+import multiprocessing as mp
+import sys
+import time
+
+import numpy as np
+
+from src.video import SharedFramePool
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Benchmark of the transport of frames between processes: pickled "
+        "frames through a multiprocessing queue vs shared memory slots."
+    )
+    parser.add_argument(
+        "--resolutions",
+        "-s",
+        type=str,
+        nargs="+",
+        default=["1280x720", "1920x1080", "3840x2160"],
+        help="Frame resolutions (WxH). Default: 1280x720 1920x1080 3840x2160.",
+    )
+    parser.add_argument(
+        "--frames",
+        "-n",
+        type=int,
+        default=300,
+        help="Number of frames sent for each resolution. Default: 300.",
+    )
+    parser.add_argument(
+        "--consumers",
+        "-c",
+        type=int,
+        default=2,
+        help="Number of consumer processes. Default: 2.",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=8,
+        help="Max number of frames in flight. Default: 8.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def consume_queue(in_queue: mp.Queue, out_queue: mp.Queue) -> None:
+    checksum = 0
+    while (frame := in_queue.get()) is not None:
+        checksum += int(frame[0, 0, 0])
+    out_queue.put(checksum)
+
+
+def consume_pool(
+    pool: SharedFramePool, in_queue: mp.Queue, out_queue: mp.Queue
+) -> None:
+    checksum = 0
+    while (ref := in_queue.get()) is not None:
+        checksum += int(pool.get(ref)[0, 0, 0])
+        pool.release(ref)
+    out_queue.put(checksum)
+    pool.close()
+
+
+def run(
+    transport: str,
+    frame: np.ndarray,
+    num_frames: int,
+    num_consumers: int,
+    queue_size: int,
+) -> float:
+    ctx = mp.get_context("spawn")
+    in_queue = ctx.Queue(maxsize=queue_size)
+    out_queue = ctx.Queue()
+    pool = None
+    if transport == "shared_memory":
+        pool = SharedFramePool(queue_size + num_consumers, frame.shape, ctx=ctx)
+        target, args = consume_pool, (pool, in_queue, out_queue)
+    else:
+        target, args = consume_queue, (in_queue, out_queue)
+    consumers = [
+        ctx.Process(target=target, args=args) for _ in range(num_consumers)
+    ]
+    for consumer in consumers:
+        consumer.start()
+    # Wait until a consumer is ready, so that start-up is not measured
+    in_queue.put(pool.put(frame) if pool is not None else frame)
+    while not in_queue.empty():
+        time.sleep(0.001)
+
+    start = time.perf_counter()
+    for _ in range(num_frames):
+        in_queue.put(pool.put(frame) if pool is not None else frame)
+    for _ in consumers:
+        in_queue.put(None)
+    checksum = sum(out_queue.get() for _ in consumers)
+    elapsed = time.perf_counter() - start
+    for consumer in consumers:
+        consumer.join()
+    if pool is not None:
+        pool.close()
+    assert checksum == int(frame[0, 0, 0]) * (num_frames + 1)
+    return elapsed
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+
+    print("transport\tresolution\tframes_per_s\tMB_per_s")
+    for resolution in args.resolutions:
+        width, height = (int(x) for x in resolution.split("x"))
+        frame = np.full((height, width, 3), 7, dtype=np.uint8)
+        for transport in ("pickle", "shared_memory"):
+            elapsed = run(
+                transport,
+                frame,
+                args.frames,
+                args.consumers,
+                args.queue_size,
+            )
+            fps = args.frames / elapsed
+            print(
+                f"{transport}\t{resolution}\t{fps:.1f}\t"
+                f"{fps * frame.nbytes / 1e6:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
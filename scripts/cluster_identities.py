@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+from pathlib import Path
+import sys
+
+from tqdm import tqdm
+
+from src.clustering import (
+    CLUSTER_METHODS,
+    EMBEDDINGS_SUFFIX,
+    cluster_embeddings,
+    gather_embeddings,
+)
+from src.path import iter_files
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Tool to cluster face identities across all the videos of a dataset."
+    )
+    parser.add_argument(
+        "filenames",
+        type=str,
+        nargs="+",
+        help=f"Path(s) to a '{EMBEDDINGS_SUFFIX}' file saved by "
+        "detect_faces.py --save-embeddings, or a directory.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default="identities.json",
+        help="Path to the JSON file mapping the face IDs of each annotation "
+        "file to global identity IDs. Default: identities.json.",
+    )
+    parser.add_argument(
+        "--dist-thresh",
+        type=float,
+        default=0.5,
+        help="Maximum cosine distance to link two faces. Default: 0.5.",
+    )
+    parser.add_argument(
+        "--method",
+        "-m",
+        type=str,
+        choices=CLUSTER_METHODS,
+        default="exact",
+        help="Method to find the nearest neighbours of each face: 'exact' "
+        "compares all pairs in blocks, 'ann' uses an approximate HNSW index "
+        "that scales to millions of faces and requires the 'ann' extra "
+        "dependencies. Default: exact.",
+    )
+    parser.add_argument(
+        "--neighbors",
+        "-k",
+        type=int,
+        default=10,
+        help="Number of nearest neighbours linked to each face. Default: 10.",
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=4096,
+        help="Number of embeddings loaded in memory at once. Default: 4096.",
+    )
+    parser.add_argument(
+        "--memmap-path",
+        type=str,
+        help="Path to the temporary file that stores all the embeddings. By "
+        "default, it is saved next to the output file.",
+    )
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="When the input filename is a directory, also process recursively "
+        "all subdirectories inside.",
+    )
+    parser.add_argument(
+        "--quiet",
+        "--silent",
+        "-q",
+        action="store_true",
+        help="Hide progress bars.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+
+    filenames = args.filenames
+    out_path = Path(args.output)
+    dist_thresh = args.dist_thresh
+    method = args.method
+    neighbors = args.neighbors
+    block_size = args.block_size
+    memmap_path = args.memmap_path
+    recursive = args.recursive
+    quiet = args.quiet
+
+    if memmap_path is None:
+        memmap_path = out_path.with_suffix(".embeddings.npy")
+    memmap_path = Path(memmap_path)
+
+    emb_files = []
+    for filename in filenames:
+        filename = Path(filename)
+        if filename.is_file():
+            emb_files.append(filename)
+        elif filename.is_dir():
+            emb_files.extend(
+                path
+                for path in iter_files(filename, ".npz", recursive)
+                if path.name.endswith(EMBEDDINGS_SUFFIX)
+            )
+        else:
+            tqdm.write(
+                f"cluster_identities.py: WARNING: file {filename} does not exist."
+            )
+
+    embs, tracks = gather_embeddings(emb_files, memmap_path, quiet)
+    labels = cluster_embeddings(
+        embs,
+        dist_thresh=dist_thresh,
+        k=neighbors,
+        method=method,
+        block_size=block_size,
+        quiet=quiet,
+    )
+    del embs
+    memmap_path.unlink()
+
+    identities = {}
+    for (emb_path, face_id), label in zip(tracks, labels):
+        ann_path = emb_path.with_name(
+            emb_path.name[: -len(EMBEDDINGS_SUFFIX)] + ".json"
+        )
+        identities.setdefault(str(ann_path), {})[face_id] = str(label)
+
+    with open(out_path, "w") as out_file:
+        json.dump(identities, out_file)
+    tqdm.write(
+        f"Found {labels.max() + 1} identities in {len(tracks)} faces from "
+        f"{len(emb_files)} files. Saved identities to {out_path}",
+        file=sys.stdout,
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
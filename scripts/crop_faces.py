@@ -2,16 +2,21 @@
 
 import argparse
 import json
+import os
 from pathlib import Path
 import sys
+from typing import Collection, Iterable, Iterator
 
-import cv2
 import numpy as np
 from tqdm import tqdm
 
-from src.image import align_bbox, crop_image, expand_bbox, resize_image
-from src.path import find
-from src.video import VIDEO_FORMATS, Video
+from src.annotation_index import load_selection
+from src.crop import CropSink
+from src.path import iter_files
+from src.quality import select_frames
+from src.scheduler import MemoryScheduler, default_budget, parse_size
+from src.sharding import WorkDir, distribute, item_key, parse_shard
+from src.video import VIDEO_FORMATS, Video, grab_frames
 
 
 def parse_args(argv: list[str]) -> argparse.Namespace:
@@ -21,7 +26,7 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     parser.add_argument(
         "filenames",
         type=str,
-        nargs="+",
+        nargs="*",
         help="Path(s) to a video file or a directory. If it is a directory, "
         "all videos inside the directory are proccessed. If the "
         "--recursive flag is provided, all subdirectories are recursively "
@@ -44,6 +49,15 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         "the script searches for annotation files with the same name as the "
         "video files.",
     )
+    parser.add_argument(
+        "--selection",
+        type=str,
+        help="Path to a selection file written by index_annotations.py query "
+        "--selection. The videos of the selection are processed, in addition "
+        "to the input filenames, and only the selected faces are cropped. "
+        "With --prefix, crops are saved inside it with the directory layout "
+        "of the selected videos below their common parent directory.",
+    )
     parser.add_argument(
         "--crop-size",
         "-c",
@@ -65,6 +79,97 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         help="Align faces to match the center of the bounding box to the "
         "position of the nose landmark.",
     )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        help="Only save the K crops of each face with the best quality, "
+        "scored from the detector probability, the size of the face, the "
+        "pose and the sharpness of the crop. By default, all crops are saved.",
+    )
+    parser.add_argument(
+        "--every-n",
+        type=int,
+        help="Only save the crop with the best quality in every N frames of "
+        "each face, which avoids near-duplicate crops of consecutive frames. "
+        "Can be combined with --top-k.",
+    )
+    parser.add_argument(
+        "--save-quality",
+        action="store_true",
+        help="Save the quality score of each face in the annotation files. "
+        "When all the faces of a file have a score, later runs with --top-k "
+        "or --every-n only decode the selected frames.",
+    )
+    parser.add_argument(
+        "--include",
+        type=str,
+        nargs="+",
+        help="Only process the videos whose name or path relative to the "
+        "input directory matches one of these glob patterns "
+        "(e.g., '*_front.mp4' or 'day1/*').",
+    )
+    parser.add_argument(
+        "--exclude",
+        type=str,
+        nargs="+",
+        help="Skip the files and subdirectories whose name or relative path "
+        "matches one of these glob patterns.",
+    )
+    parser.add_argument(
+        "--scan-workers",
+        type=int,
+        default=1,
+        help="Number of threads that list subdirectories in parallel, which "
+        "speeds up the discovery of files on network file systems. Default: "
+        "1.",
+    )
+    parser.add_argument(
+        "--file-list-cache",
+        type=str,
+        help="Path to a file that stores the listing of the input "
+        "directories, so later runs only list the directories that changed.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only process the videos of this shard, given as 'i/N' (e.g., "
+        "'0/4' to '3/4' on four nodes). Files are assigned to shards by a hash "
+        "of their path relative to the input directory, so every node gets "
+        "the same split.",
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=str,
+        help="Shared directory where nodes claim videos with lock files, so "
+        "that each file is processed by a single node and faster nodes take "
+        "more work. With --shard, each node first processes its shard and "
+        "then the unclaimed files of the other shards. Finished files are "
+        "skipped on later runs; delete the directory to process them again.",
+    )
+    parser.add_argument(
+        "--claim-timeout",
+        type=float,
+        help="Seconds after which the claim of a node that stopped (e.g., it "
+        "was killed) can be taken by another node. Live nodes keep their "
+        "claims however long a file takes. By default, claims never expire.",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of videos processed at once, in threads. Videos are only "
+        "started while their estimated memory fits in --memory-budget. "
+        "Default: 1.",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=parse_size,
+        help="Max resident memory of the process with --jobs, e.g., '16G'. "
+        "The memory of each video is estimated from its resolution and "
+        "number of frames, and the decode queue of high-resolution videos is "
+        "shortened to fit. Default: 80 percent of the available memory.",
+    )
     parser.add_argument(
         "--recursive",
         "-r",
@@ -80,6 +185,8 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         help="Hide progress bars.",
     )
     args = parser.parse_args(argv)
+    if len(args.filenames) == 0 and args.selection is None:
+        parser.error("no input filenames or --selection given")
     return args
 
 
@@ -90,8 +197,13 @@ def process_file(
     crop_size: int | None,
     bbox_scale: float,
     align: bool,
+    top_k: int | None = None,
+    every_n: int | None = None,
+    save_quality: bool = False,
+    face_ids: Collection[str] | None = None,
+    queue_size: int = 128,
 ) -> None:
-    if video_path.suffix not in VIDEO_FORMATS:
+    if video_path.suffix.lower() not in VIDEO_FORMATS:
         raise ValueError(
             "Input file must be a valid video file: "
             f"{video_path} ({VIDEO_FORMATS})"
@@ -104,34 +216,81 @@ def process_file(
 
     if out_dir is None:
         out_dir = video_path.with_suffix("")
-    out_dir.mkdir(parents=True, exist_ok=True)
 
     with open(ann_path, "r") as ann_file:
         anns = json.load(ann_file)
 
-    with Video(str(video_path)) as video_file:
-        for frame_idx in range(video_file.num_frames):
-            frame = video_file.read()
-            frame_idx_str = str(frame_idx)
-            for face_idx, face_anns in anns.items():
-                if frame_idx_str in face_anns:
-                    frame_anns = face_anns[frame_idx_str]
-                    bbox = np.array(frame_anns["bbox"])
-                    if align:
-                        new_center = (
-                            frame_anns["landmarks"][4],
-                            frame_anns["landmarks"][5],
-                        )
-                        bbox = align_bbox(bbox, new_center)
-                    bbox = expand_bbox(bbox, bbox_scale)
-                    crop = crop_image(frame, bbox)
-                    if crop_size is not None:
-                        crop = resize_image(crop, crop_size)
-
-                    face_dir = out_dir / face_idx
-                    face_dir.mkdir(exist_ok=True)
-                    crop_path = face_dir / f"{frame_idx:06d}.png"
-                    cv2.imwrite(str(crop_path), crop)
+    # Faces annotated in each frame
+    frames = dict()
+    for face_idx, face_anns in anns.items():
+        if face_ids is not None and face_idx not in face_ids:
+            continue
+        for frame_idx, frame_anns in face_anns.items():
+            frames.setdefault(int(frame_idx), []).append((face_idx, frame_anns))
+
+    selecting = top_k is not None or every_n is not None
+    cached = all(
+        "quality" in frame_anns
+        for face_anns in anns.values()
+        for frame_anns in face_anns.values()
+    )
+    score_faces = not cached and (selecting or save_quality)
+    if selecting and cached:
+        # Only decode the selected frames
+        selected = set()
+        for face_idx, face_anns in anns.items():
+            if face_ids is not None and face_idx not in face_ids:
+                continue
+            frame_idxs = np.array([int(x) for x in face_anns], dtype=np.int64)
+            scores = np.array([x["quality"] for x in face_anns.values()])
+            selected.update(
+                (face_idx, int(frame_idx))
+                for frame_idx in select_frames(frame_idxs, scores, top_k, every_n)
+            )
+        frames = {
+            frame_idx: [x for x in faces if (x[0], frame_idx) in selected]
+            for frame_idx, faces in frames.items()
+        }
+        frames = {k: v for k, v in frames.items() if len(v) > 0}
+        sink = CropSink(out_dir, crop_size, bbox_scale, align)
+    else:
+        # Scores are computed while cropping the frames
+        sink = CropSink(
+            out_dir,
+            crop_size,
+            bbox_scale,
+            align,
+            top_k,
+            every_n,
+            score=score_faces,
+        )
+
+    if selecting and cached:
+        video_frames = grab_frames(str(video_path), frames.keys())
+    else:
+        num_frames = max(frames, default=-1) + 1
+        video_file = Video(
+            str(video_path), max_frames=num_frames, queue_size=queue_size
+        ).start()
+        video_frames = (
+            (frame_idx, video_file.read())
+            for frame_idx in range(video_file.num_frames)
+        )
+
+    try:
+        for frame_idx, frame in video_frames:
+            faces = frames.get(frame_idx)
+            if faces is None:
+                continue
+            sink(frame_idx, frame, dict(faces))
+    finally:
+        if not (selecting and cached):
+            video_file.stop()
+    sink.close()
+
+    if save_quality and score_faces:
+        with open(ann_path, "w") as ann_file:
+            json.dump(anns, ann_file)
 
     tqdm.write(f"Saved cropped images to {out_dir}", file=sys.stdout)
 
@@ -143,50 +302,149 @@ def process_dir(
     crop_size: int | None,
     bbox_scale: float,
     align: bool,
+    top_k: int | None,
+    every_n: int | None,
+    save_quality: bool,
     recursive: bool,
     quiet: bool,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    scan_workers: int = 1,
+    file_list_cache: str | None = None,
+    shard: tuple[int, int] | None = None,
+    work_dir: WorkDir | None = None,
+    scheduler: MemoryScheduler | None = None,
 ) -> None:
-    video_files = find(input_path, VIDEO_FORMATS, recursive)
-    for video_path in tqdm(
-        video_files,
-        desc="Processing directory",
-        leave=False,
-        disable=quiet,
-        dynamic_ncols=True,
-    ):
+    """Crops the faces of the videos of a directory. With ``scheduler``,
+    several videos are processed at once."""
+    video_files = iter_files(
+        input_path,
+        VIDEO_FORMATS,
+        recursive,
+        include=include,
+        exclude=exclude,
+        workers=scan_workers,
+        cache_path=file_list_cache,
+    )
+    video_files = distribute(
+        video_files, input_path, shard, work_dir, complete=scheduler is None
+    )
+
+    def get_paths(video_path: Path) -> tuple[Path, Path | None]:
         crop_ann_path = video_path.with_suffix(".json")
         if ann_path is not None:
             rel_path = crop_ann_path.relative_to(input_path)
             crop_ann_path = ann_path / rel_path
-        if not crop_ann_path.exists():
-            continue
-
         crop_out_dir = None
         if out_dir is not None:
             rel_path = video_path.with_suffix("").relative_to(input_path)
             crop_out_dir = out_dir / rel_path
+        return crop_ann_path, crop_out_dir
 
-        process_file(
-            video_path=video_path,
-            ann_path=crop_ann_path,
-            out_dir=crop_out_dir,
-            crop_size=crop_size,
-            bbox_scale=bbox_scale,
-            align=align,
-        )
+    def run(video_path: Path, queue_size: int = 128) -> None:
+        crop_ann_path, crop_out_dir = get_paths(video_path)
+        if crop_ann_path.exists():
+            process_file(
+                video_path=video_path,
+                ann_path=crop_ann_path,
+                out_dir=crop_out_dir,
+                crop_size=crop_size,
+                bbox_scale=bbox_scale,
+                align=align,
+                top_k=top_k,
+                every_n=every_n,
+                save_quality=save_quality,
+                queue_size=queue_size,
+            )
+
+    if scheduler is None:
+        for video_path in tqdm(
+            video_files,
+            desc="Processing directory",
+            leave=False,
+            disable=quiet,
+            dynamic_ncols=True,
+        ):
+            run(video_path)
+        return
+
+    # Videos claimed in the work directory and not finished yet
+    claimed = set()
+
+    def claim(video_paths: Iterable[Path]) -> Iterator[Path]:
+        for video_path in video_paths:
+            if not get_paths(video_path)[0].exists():
+                # Nothing to crop, no need to schedule it
+                if work_dir is not None:
+                    work_dir.complete(item_key(video_path, input_path))
+                continue
+            claimed.add(video_path)
+            yield video_path
+
+    def run_claimed(video_path: Path, queue_size: int) -> None:
+        run(video_path, queue_size)
+        if work_dir is not None:
+            work_dir.complete(item_key(video_path, input_path))
+        claimed.discard(video_path)
+
+    try:
+        for _ in tqdm(
+            scheduler.map(run_claimed, claim(video_files)),
+            desc="Processing directory",
+            leave=False,
+            disable=quiet,
+            dynamic_ncols=True,
+        ):
+            pass
+    finally:
+        if work_dir is not None:
+            for video_path in claimed:
+                work_dir.release(item_key(video_path, input_path))
 
 
 def main(argv: list[str]) -> None:
     args = parse_args(argv)
 
     filenames = args.filenames
+    selection = {}
+    selection_root = None
+    if args.selection is not None:
+        selection = {
+            Path(os.path.abspath(video_path)): entry
+            for video_path, entry in load_selection(args.selection).items()
+        }
+    if len(selection) > 0:
+        # Videos with the same name in different directories must not share
+        # their output directory
+        selection_root = Path(
+            os.path.commonpath([video_path.parent for video_path in selection])
+        )
     prefix = None if args.prefix is None else Path(args.prefix)
     ann_path = None if args.ann_path is None else Path(args.ann_path)
     crop_size = args.crop_size
     bbox_scale = args.bbox_scale
     align = args.align
+    top_k = args.top_k
+    every_n = args.every_n
+    save_quality = args.save_quality
+    include = args.include
+    exclude = args.exclude
+    scan_workers = args.scan_workers
+    file_list_cache = args.file_list_cache
+    shard = args.shard
+    work_dir = None
+    if args.work_dir is not None:
+        work_dir = WorkDir(
+            Path(args.work_dir) / "crop_faces", claim_timeout=args.claim_timeout
+        )
     recursive = args.recursive
     quiet = args.quiet
+    scheduler = None
+    if args.jobs > 1:
+        memory_budget = args.memory_budget
+        if memory_budget is None:
+            memory_budget = default_budget()
+        scheduler = MemoryScheduler(memory_budget, args.jobs)
 
     disable = quiet or len(filenames) == 1
     for filename in tqdm(
@@ -205,6 +463,9 @@ def main(argv: list[str]) -> None:
                 crop_size=crop_size,
                 bbox_scale=bbox_scale,
                 align=align,
+                top_k=top_k,
+                every_n=every_n,
+                save_quality=save_quality,
             )
         elif filename.is_dir():
             process_dir(
@@ -214,14 +475,87 @@ def main(argv: list[str]) -> None:
                 crop_size=crop_size,
                 bbox_scale=bbox_scale,
                 align=align,
+                top_k=top_k,
+                every_n=every_n,
+                save_quality=save_quality,
                 recursive=recursive,
                 quiet=quiet,
+                include=include,
+                exclude=exclude,
+                scan_workers=scan_workers,
+                file_list_cache=file_list_cache,
+                shard=shard,
+                work_dir=work_dir,
+                scheduler=scheduler,
             )
         else:
             tqdm.write(
                 f"crop_faces.py: WARNING: file {filename} does not exist."
             )
 
+    def crop_selected(video_path: Path, queue_size: int = 128) -> None:
+        video_ann_path, face_ids = selection[video_path]
+        crop_out_dir = None
+        if prefix is not None:
+            rel_path = video_path.with_suffix("").relative_to(selection_root)
+            crop_out_dir = prefix / rel_path
+        process_file(
+            video_path=video_path,
+            ann_path=video_ann_path,
+            out_dir=crop_out_dir,
+            crop_size=crop_size,
+            bbox_scale=bbox_scale,
+            align=align,
+            top_k=top_k,
+            every_n=every_n,
+            save_quality=save_quality,
+            face_ids=set(face_ids),
+            queue_size=queue_size,
+        )
+
+    selected_videos = []
+    for video_path in selection:
+        if video_path.is_file():
+            selected_videos.append(video_path)
+        else:
+            tqdm.write(
+                f"crop_faces.py: WARNING: file {video_path} does not exist."
+            )
+    if scheduler is None:
+        for video_path in tqdm(
+            selected_videos,
+            desc="Processing selection",
+            leave=False,
+            disable=quiet,
+            dynamic_ncols=True,
+        ):
+            crop_selected(video_path)
+    else:
+        for _ in tqdm(
+            scheduler.map(crop_selected, selected_videos),
+            total=len(selected_videos),
+            desc="Processing selection",
+            leave=False,
+            disable=quiet,
+            dynamic_ncols=True,
+        ):
+            pass
+
+    if scheduler is not None and None not in (
+        scheduler.peak_rss,
+        scheduler.budget,
+    ):
+        tqdm.write(
+            f"Peak memory: {scheduler.peak_rss / 2**30:.2f} GiB, budget: "
+            f"{scheduler.budget / 2**30:.2f} GiB",
+            file=sys.stdout,
+        )
+    if scheduler is not None and scheduler.num_oversized > 0:
+        tqdm.write(
+            f"crop_faces.py: WARNING: {scheduler.num_oversized} videos did not "
+            "fit in the memory budget, and ran alone."
+        )
+
 
 if __name__ == "__main__":
     main(sys.argv[1:])
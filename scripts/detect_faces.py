@@ -4,14 +4,45 @@ import argparse
 import json
 from pathlib import Path
 import sys
+from typing import Any, Iterable, Iterator
 
 from tqdm import tqdm
 
+from src.clustering import EMBEDDINGS_SUFFIX, save_track_embeddings
+from src.crop import CropSink
 from src.face_tracker import FaceTracker
-from src.path import find
+from src.path import iter_files
+from src.pipeline import PIPELINE_MODES, FacePipeline
+from src.probe import VideoProber
+from src.scheduler import MemoryScheduler, default_budget, parse_size
+from src.server import DEFAULT_SOCKET
+from src.sharding import (
+    WorkDir,
+    distribute,
+    item_key,
+    parse_shard,
+    split_shard,
+)
+from src.similarity_index import INDEX_TYPES
 from src.video import VIDEO_FORMATS
 
 
+def det_size_type(value: str) -> tuple[int, int] | str:
+    if value == "auto":
+        return value
+    size = int(value)
+    return size, size
+
+
+def stage_workers_type(value: str) -> tuple[str, int]:
+    name, _, workers = value.partition("=")
+    if name not in FacePipeline.STAGES:
+        raise argparse.ArgumentTypeError(
+            f"unknown stage: {name} ({FacePipeline.STAGES})"
+        )
+    return name, int(workers)
+
+
 def parse_args(argv: list[str]) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         "Video face tracking tool to annotate video datasets."
@@ -60,6 +91,279 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         default=0.5,
         help="Maximum cosine similarity score to match two faces. Default: 0.5.",
     )
+    parser.add_argument(
+        "--min-hits",
+        type=int,
+        default=1,
+        help="Number of detections after which a new face is confirmed. "
+        "Unconfirmed faces are no longer matched when they are lost (see "
+        "--max-box-age) or at a scene cut. Default: 1 (all faces are "
+        "confirmed).",
+    )
+    parser.add_argument(
+        "--max-box-age",
+        type=int,
+        help="Number of frames after which a face that is not detected is no "
+        "longer matched by the position of its bounding box (e.g., 30). By "
+        "default, faces are always matched by position.",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=int,
+        help="Number of frames after which a face that is not detected is "
+        "archived (e.g., 300). Archived faces can only be matched by their "
+        "embeddings, which bounds the cost per frame on long videos. By "
+        "default, faces are never archived.",
+    )
+    parser.add_argument(
+        "--reid-index",
+        type=str,
+        choices=INDEX_TYPES,
+        default="brute_force",
+        help="Similarity index used to re-identify archived faces. 'hnsw' "
+        "performs an approximate search that scales to very long videos with "
+        "thousands of faces, and requires the 'ann' extra dependencies. "
+        "Default: brute_force.",
+    )
+    parser.add_argument(
+        "--det-size",
+        type=det_size_type,
+        default=(640, 640),
+        help="Input size of the face detector, in pixels, or 'auto' to choose "
+        "it for each video from the size of the faces found in a few sampled "
+        "frames. Default: 640.",
+    )
+    parser.add_argument(
+        "--frame-stride",
+        type=int,
+        default=1,
+        help="Only run the face detector and tracker on one of every N frames. "
+        "Use smooth_tracks.py afterwards to fill the skipped frames by "
+        "interpolation. Default: 1 (all frames).",
+    )
+    parser.add_argument(
+        "--cut-thresh",
+        type=float,
+        help="Detect scene cuts as frames whose intensity histogram differs "
+        "from the previous one by more than this value (0 to 1, e.g., 0.4). "
+        "Boxes are not matched across cuts, only embeddings. By default, "
+        "cuts are not detected.",
+    )
+    parser.add_argument(
+        "--static-thresh",
+        type=float,
+        help="Reuse the detections of the last processed frame for frames "
+        "whose mean absolute difference with the last changed frame is below "
+        "this fraction of the intensity range (e.g., 0.01). By default, all "
+        "frames run the models.",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        help="Also run the face detector on overlapping tiles of this size "
+        "(a multiple of 32), at the native resolution of the frame, and merge "
+        "them with the full-frame detections. Finds small faces in "
+        "high-resolution frames. By default, frames are not tiled.",
+    )
+    parser.add_argument(
+        "--tile-overlap",
+        type=float,
+        default=0.2,
+        help="Minimum overlap between tiles, relative to the tile size. Faces "
+        "larger than the overlap are only found by the full-frame pass. "
+        "Default: 0.2.",
+    )
+    parser.add_argument(
+        "--tile-flagged",
+        action="store_true",
+        help="Only run the tiles that overlap a face found by the full-frame "
+        "pass, e.g., for crowds.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Directory to store the raw detections of each video. When the "
+        "detections of a video are already cached, only the tracking step is "
+        "run, without decoding the video or running the models.",
+    )
+    parser.add_argument(
+        "--pipeline",
+        type=str,
+        choices=PIPELINE_MODES,
+        help="Overlap decoding, detection, recognition and tracking of "
+        "consecutive frames, running each stage in its own threads or "
+        "processes. By default, frames are processed one at a time.",
+    )
+    parser.add_argument(
+        "--stage-workers",
+        type=stage_workers_type,
+        nargs="+",
+        default=[],
+        metavar="STAGE=N",
+        help="Number of workers of each pipeline stage (preprocess, detect, "
+        "recognize), e.g., 'detect=2'. Default: 1 worker per stage.",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of videos of a directory processed at once, in threads "
+        "that share the models. Videos are only started while their "
+        "estimated memory fits in --memory-budget. Default: 1.",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=parse_size,
+        help="Max resident memory of the process with --jobs, e.g., '16G'. "
+        "The memory of each video is estimated from its resolution and "
+        "number of frames, and the decode queue of high-resolution videos is "
+        "shortened to fit. Default: 80 percent of the available memory.",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        nargs="?",
+        const=DEFAULT_SOCKET,
+        metavar="SOCKET",
+        help="Send frames to the inference server started with serve.py at "
+        f"this socket (default: {DEFAULT_SOCKET}) instead of loading the "
+        "models. The detector options of the server are used. If no server "
+        "is running, the models are loaded as usual.",
+    )
+    parser.add_argument(
+        "--save-embeddings",
+        action="store_true",
+        help="Also save the mean embedding of each face in a "
+        f"'<VIDEO_NAME>{EMBEDDINGS_SUFFIX}' file next to the annotations, to "
+        "cluster identities across videos with cluster_identities.py.",
+    )
+    parser.add_argument(
+        "--crop",
+        action="store_true",
+        help="Also crop the faces while each frame is in memory, as "
+        "crop_faces.py does, so videos are decoded only once. Crops are "
+        "saved in a '<VIDEO_NAME>' directory next to the annotations. Not "
+        "supported with --pipeline.",
+    )
+    parser.add_argument(
+        "--crop-size",
+        type=int,
+        help="With --crop, size of the saved image crops, in pixels. By "
+        "default, crops are saved with their original size.",
+    )
+    parser.add_argument(
+        "--bbox-scale",
+        type=float,
+        default=1.3,
+        help="With --crop, factor to increase the bounding box size. "
+        "Default: 1.3.",
+    )
+    parser.add_argument(
+        "--align",
+        action="store_true",
+        help="With --crop, align the center of each crop to the nose "
+        "landmark.",
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        help="With --crop, only save the K crops of each face with the best "
+        "quality. The quality scores are saved in the annotations.",
+    )
+    parser.add_argument(
+        "--every-n",
+        type=int,
+        help="With --crop, only save the crop with the best quality in every "
+        "N frames of each face.",
+    )
+    parser.add_argument(
+        "--probe",
+        action="store_true",
+        help="Before the full pass, run the face detector on a few frames of "
+        "each video to estimate its face density. Videos without faces are "
+        "skipped, and the rest of the videos of a directory are processed "
+        "from the highest to the lowest density.",
+    )
+    parser.add_argument(
+        "--probe-fps",
+        type=float,
+        default=1.0,
+        help="Frames per second of video sampled by --probe. Default: 1.",
+    )
+    parser.add_argument(
+        "--probe-frames",
+        type=int,
+        help="Sample this number of evenly spaced frames with --probe, "
+        "instead of --probe-fps.",
+    )
+    parser.add_argument(
+        "--min-face-density",
+        type=float,
+        default=0.0,
+        help="Skip the videos whose mean number of faces per probed frame is "
+        "not above this value. Default: 0 (only skip videos without faces).",
+    )
+    parser.add_argument(
+        "--probe-index",
+        type=str,
+        help="Path to a JSON file that stores the probe results, so videos "
+        "are never probed twice while they do not change. It can be shared "
+        "by several nodes.",
+    )
+    parser.add_argument(
+        "--include",
+        type=str,
+        nargs="+",
+        help="Only process the videos whose name or path relative to the "
+        "input directory matches one of these glob patterns "
+        "(e.g., '*_front.mp4' or 'day1/*').",
+    )
+    parser.add_argument(
+        "--exclude",
+        type=str,
+        nargs="+",
+        help="Skip the files and subdirectories whose name or relative path "
+        "matches one of these glob patterns.",
+    )
+    parser.add_argument(
+        "--scan-workers",
+        type=int,
+        default=1,
+        help="Number of threads that list subdirectories in parallel, which "
+        "speeds up the discovery of files on network file systems. Default: "
+        "1.",
+    )
+    parser.add_argument(
+        "--file-list-cache",
+        type=str,
+        help="Path to a file that stores the listing of the input "
+        "directories, so later runs only list the directories that changed.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only process the videos of this shard, given as 'i/N' (e.g., "
+        "'0/4' to '3/4' on four nodes). Files are assigned to shards by a hash "
+        "of their path relative to the input directory, so every node gets "
+        "the same split.",
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=str,
+        help="Shared directory where nodes claim videos with lock files, so "
+        "that each file is processed by a single node and faster nodes take "
+        "more work. With --shard, each node first processes its shard and "
+        "then the unclaimed files of the other shards. Finished files are "
+        "skipped on later runs; delete the directory to process them again.",
+    )
+    parser.add_argument(
+        "--claim-timeout",
+        type=float,
+        help="Seconds after which the claim of a node that stopped (e.g., it "
+        "was killed) can be taken by another node. Live nodes keep their "
+        "claims however long a file takes. By default, claims never expire.",
+    )
     parser.add_argument(
         "--recursive",
         "-r",
@@ -75,28 +379,82 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         help="Hide progress bars.",
     )
     args = parser.parse_args(argv)
+    if args.crop and args.pipeline is not None:
+        parser.error("--crop is not supported with --pipeline")
+    if args.server is not None and args.pipeline is not None:
+        parser.error("--server is not supported with --pipeline")
+    if args.jobs > 1 and args.pipeline is not None:
+        parser.error("--jobs is not supported with --pipeline")
+    if args.jobs > 1 and args.det_size == "auto":
+        parser.error("--jobs is not supported with --det-size auto")
     return args
 
 
 def process_file(
     video_path: Path,
     out_dir: Path | None,
-    face_tracker: FaceTracker
+    face_tracker: FaceTracker,
+    save_embeddings: bool = False,
+    pipeline: FacePipeline | None = None,
+    crop_options: dict[str, Any] | None = None,
+    prober: VideoProber | None = None,
+    quiet: bool = False,
 ) -> None:
-    if video_path.suffix not in VIDEO_FORMATS:
+    """Annotates a video. With ``crop_options`` (keyword arguments of
+    ``CropSink``), faces are also cropped in the same pass."""
+    if video_path.suffix.lower() not in VIDEO_FORMATS:
         raise ValueError(
             f"video file must be a valid video file: {video_path} ({VIDEO_FORMATS})"
         )
+    if prober is not None and not prober.has_faces(video_path):
+        tqdm.write(
+            f"Skipped {video_path}: no faces found by the probe",
+            file=sys.stdout,
+        )
+        return
 
     if out_dir is None:
         out_dir = video_path.parent
 
-    faces = face_tracker(str(video_path))
+    crop_dir = out_dir / video_path.stem
+    if crop_options is not None:
+        sink = CropSink(crop_dir, **crop_options)
+        faces = face_tracker(str(video_path), sink=sink)
+        sink.close()
+    elif pipeline is None:
+        faces = face_tracker(str(video_path))
+    else:
+        faces = pipeline(str(video_path))
 
     out_path = out_dir / f"{video_path.stem}.json"
     with open(out_path, "w") as out_file:
         json.dump(faces, out_file)
     tqdm.write(f"Saved annotations file to {out_path}", file=sys.stdout)
+    if crop_options is not None:
+        tqdm.write(f"Saved cropped images to {crop_dir}", file=sys.stdout)
+    if face_tracker.create_scene_detector() is not None:
+        tqdm.write(
+            f"{video_path.name}: {len(face_tracker.last_cuts) + 1} shots, "
+            f"{face_tracker.last_num_reused} static frames reused detections",
+            file=sys.stdout,
+        )
+    if pipeline is not None and not quiet:
+        stats = pipeline.stats
+        busy_times = ", ".join(
+            f"{name} {busy_time:.2f}s"
+            for name, busy_time in stats["stages"].items()
+        )
+        tqdm.write(
+            f"{video_path.name}: pipeline "
+            f"{stats['frames'] / max(stats['elapsed'], 1e-9):.2f} fps, "
+            f"busy time: {busy_times}",
+            file=sys.stdout,
+        )
+
+    if save_embeddings:
+        face_ids, embs, counts = face_tracker.last_face_emb.get_centroids()
+        emb_path = out_dir / f"{video_path.stem}{EMBEDDINGS_SUFFIX}"
+        save_track_embeddings(emb_path, face_ids, embs, counts)
 
 
 def process_dir(
@@ -105,20 +463,105 @@ def process_dir(
     face_tracker: FaceTracker,
     recursive: bool,
     quiet: bool,
+    save_embeddings: bool = False,
+    pipeline: FacePipeline | None = None,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    scan_workers: int = 1,
+    file_list_cache: str | None = None,
+    shard: tuple[int, int] | None = None,
+    work_dir: WorkDir | None = None,
+    crop_options: dict[str, Any] | None = None,
+    prober: VideoProber | None = None,
+    scheduler: MemoryScheduler | None = None,
 ) -> None:
-    video_files = find(input_path, VIDEO_FORMATS, recursive)
-    for video_path in tqdm(
-        video_files,
-        desc="Processing directory",
-        leave=False,
-        disable=quiet,
-        dynamic_ncols=True,
-    ):
-        ann_out_dir = None
-        if out_dir is not None:
-            rel_path = video_path.parent.relative_to(input_path)
-            ann_out_dir = out_dir / rel_path
-        process_file(video_path, ann_out_dir, face_tracker)
+    """Annotates the videos of a directory. With ``scheduler``, several
+    videos are processed at once."""
+    video_files = iter_files(
+        input_path,
+        VIDEO_FORMATS,
+        recursive,
+        include=include,
+        exclude=exclude,
+        workers=scan_workers,
+        cache_path=file_list_cache,
+    )
+    if prober is not None and shard is not None:
+        # Only probe the videos of this node's shard, and start with the
+        # densest ones. The other shards are only processed with a work
+        # directory, and probed once claimed (see process_file).
+        video_files, others = split_shard(video_files, input_path, shard)
+        video_files = prober.prioritize(video_files, quiet)
+        if work_dir is not None:
+            video_files += others
+    elif prober is not None and work_dir is None:
+        # Skip the videos without faces, and start with the densest ones
+        video_files = prober.prioritize(video_files, quiet)
+    video_files = distribute(
+        video_files, input_path, shard, work_dir, complete=scheduler is None
+    )
+
+    def get_out_dir(video_path: Path) -> Path | None:
+        if out_dir is None:
+            return None
+        return out_dir / video_path.parent.relative_to(input_path)
+
+    if scheduler is None:
+        for video_path in tqdm(
+            video_files,
+            desc="Processing directory",
+            leave=False,
+            disable=quiet,
+            dynamic_ncols=True,
+        ):
+            process_file(
+                video_path,
+                get_out_dir(video_path),
+                face_tracker,
+                save_embeddings,
+                pipeline,
+                crop_options,
+                prober,
+                quiet,
+            )
+        return
+
+    # Videos claimed in the work directory and not finished yet
+    claimed = set()
+
+    def claim(video_paths: Iterable[Path]) -> Iterator[Path]:
+        for video_path in video_paths:
+            claimed.add(video_path)
+            yield video_path
+
+    def run(video_path: Path, queue_size: int) -> None:
+        video_tracker = face_tracker.fork()
+        video_tracker.queue_size = queue_size
+        process_file(
+            video_path,
+            get_out_dir(video_path),
+            video_tracker,
+            save_embeddings,
+            crop_options=crop_options,
+            prober=prober,
+        )
+        if work_dir is not None:
+            work_dir.complete(item_key(video_path, input_path))
+        claimed.discard(video_path)
+
+    try:
+        for _ in tqdm(
+            scheduler.map(run, claim(video_files)),
+            desc="Processing directory",
+            leave=False,
+            disable=quiet,
+            dynamic_ncols=True,
+        ):
+            pass
+    finally:
+        if work_dir is not None:
+            for video_path in claimed:
+                work_dir.release(item_key(video_path, input_path))
 
 
 def main(argv: list[str]) -> None:
@@ -130,6 +573,43 @@ def main(argv: list[str]) -> None:
     det_thresh = args.det_thresh
     box_disp_thresh = args.box_disp_thresh
     cos_sim_thresh = args.cos_sim_thresh
+    min_hits = args.min_hits
+    max_box_age = args.max_box_age
+    max_age = args.max_age
+    reid_index = args.reid_index
+    det_size = args.det_size
+    frame_stride = args.frame_stride
+    cut_thresh = args.cut_thresh
+    static_thresh = args.static_thresh
+    tile_size = args.tile_size
+    tile_overlap = args.tile_overlap
+    tile_flagged = args.tile_flagged
+    cache_dir = args.cache_dir
+    jobs = args.jobs
+    memory_budget = args.memory_budget
+    server = args.server
+    save_embeddings = args.save_embeddings
+    crop_options = None
+    if args.crop:
+        crop_options = {
+            "crop_size": args.crop_size,
+            "bbox_scale": args.bbox_scale,
+            "align": args.align,
+            "top_k": args.top_k,
+            "every_n": args.every_n,
+        }
+    pipeline_mode = args.pipeline
+    stage_workers = dict(args.stage_workers)
+    include = args.include
+    exclude = args.exclude
+    scan_workers = args.scan_workers
+    file_list_cache = args.file_list_cache
+    shard = args.shard
+    work_dir = None
+    if args.work_dir is not None:
+        work_dir = WorkDir(
+            Path(args.work_dir) / "detect_faces", claim_timeout=args.claim_timeout
+        )
     recursive = args.recursive
     quiet = args.quiet
 
@@ -139,7 +619,47 @@ def main(argv: list[str]) -> None:
         cos_sim_thresh=cos_sim_thresh,
         max_frames=max_frames,
         quiet=quiet,
+        det_size=det_size,
+        cache_dir=cache_dir,
+        min_hits=min_hits,
+        max_box_age=max_box_age,
+        max_age=max_age,
+        reid_index=reid_index,
+        frame_stride=frame_stride,
+        cut_thresh=cut_thresh,
+        static_thresh=static_thresh,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
+        tile_flagged=tile_flagged,
+        server=server,
     )
+    if server is not None and face_tracker.client is None:
+        tqdm.write(
+            f"detect_faces.py: WARNING: no inference server at {server}, "
+            "running the models locally."
+        )
+    prober = None
+    if args.probe:
+        prober = VideoProber(
+            face_tracker,
+            probe_fps=args.probe_fps,
+            num_samples=args.probe_frames,
+            min_density=args.min_face_density,
+            index_path=args.probe_index,
+        )
+    pipeline = None
+    if pipeline_mode is not None:
+        pipeline = FacePipeline(
+            face_tracker, mode=pipeline_mode, workers=stage_workers
+        )
+    scheduler = None
+    if jobs > 1:
+        if face_tracker.client is None:
+            # Load the models once, so that the threads share them
+            face_tracker.app
+        if memory_budget is None:
+            memory_budget = default_budget()
+        scheduler = MemoryScheduler(memory_budget, jobs)
     disable = quiet or len(filenames) == 1
     for filename in tqdm(
         filenames,
@@ -151,7 +671,14 @@ def main(argv: list[str]) -> None:
         filename = Path(filename)
         if filename.is_file():
             process_file(
-                video_path=filename, out_dir=prefix, face_tracker=face_tracker
+                video_path=filename,
+                out_dir=prefix,
+                face_tracker=face_tracker,
+                save_embeddings=save_embeddings,
+                pipeline=pipeline,
+                crop_options=crop_options,
+                prober=prober,
+                quiet=quiet,
             )
         elif filename.is_dir():
             process_dir(
@@ -160,11 +687,38 @@ def main(argv: list[str]) -> None:
                 face_tracker=face_tracker,
                 recursive=recursive,
                 quiet=quiet,
+                save_embeddings=save_embeddings,
+                pipeline=pipeline,
+                include=include,
+                exclude=exclude,
+                scan_workers=scan_workers,
+                file_list_cache=file_list_cache,
+                shard=shard,
+                work_dir=work_dir,
+                crop_options=crop_options,
+                prober=prober,
+                scheduler=scheduler,
             )
         else:
             tqdm.write(
                 f"detect_faces.py: WARNING: file {filename} does not exist."
             )
+    if prober is not None:
+        prober.index.save()
+    if scheduler is not None and None not in (
+        scheduler.peak_rss,
+        scheduler.budget,
+    ):
+        tqdm.write(
+            f"Peak memory: {scheduler.peak_rss / 2**30:.2f} GiB, budget: "
+            f"{scheduler.budget / 2**30:.2f} GiB",
+            file=sys.stdout,
+        )
+    if scheduler is not None and scheduler.num_oversized > 0:
+        tqdm.write(
+            f"detect_faces.py: WARNING: {scheduler.num_oversized} videos did "
+            "not fit in the memory budget, and ran alone."
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import itertools
+import json
+from pathlib import Path
+import sys
+
+from tqdm import tqdm
+
+from src.evaluation import DETECT_PARAMS, TRACK_PARAMS, pareto_front, sweep
+from src.face_tracker import FaceTracker
+from src.path import iter_files
+from src.similarity_index import INDEX_TYPES
+from src.video import VIDEO_FORMATS
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Tool to evaluate the tracking quality and speed against ground truth "
+        "annotations."
+    )
+    parser.add_argument(
+        "filenames",
+        type=str,
+        nargs="+",
+        help="Path(s) to a video file or a directory. If it is a directory, "
+        "all videos inside the directory are proccessed. If the "
+        "--recursive flag is provided, all subdirectories are recursively "
+        "traversed and proccessed too. Ground truth annotations must have the "
+        "same filename as the video (e.g., mydir/video.mp4 and "
+        "mydir/video.json) unless --gt-path is set.",
+    )
+    parser.add_argument(
+        "--gt-path",
+        "-g",
+        type=str,
+        help="Path to a JSON ground truth file or root directory. By default, "
+        "the script searches for annotation files with the same name as the "
+        "video files.",
+    )
+    parser.add_argument(
+        "--max-frames",
+        "-f",
+        type=int,
+        help="Max number of frames to process for each video. By default, all "
+        "frames are proccessed.",
+    )
+    parser.add_argument(
+        "--det-thresh",
+        type=float,
+        nargs="+",
+        default=[0.7],
+        help="One or more minimum detector confidence scores to evaluate. "
+        "Default: 0.7.",
+    )
+    parser.add_argument(
+        "--box-disp-thresh",
+        type=float,
+        nargs="+",
+        default=[0.3],
+        help="One or more maximum bounding box displacements to evaluate. "
+        "Default: 0.3.",
+    )
+    parser.add_argument(
+        "--cos-sim-thresh",
+        type=float,
+        nargs="+",
+        default=[0.5],
+        help="One or more maximum cosine similarity scores to evaluate. "
+        "Default: 0.5.",
+    )
+    parser.add_argument(
+        "--min-hits",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="One or more numbers of detections after which a new face is "
+        "confirmed. Default: 1.",
+    )
+    parser.add_argument(
+        "--max-box-age",
+        type=int,
+        nargs="+",
+        default=[None],
+        help="One or more numbers of frames after which an unseen face is no "
+        "longer matched by position. By default, faces are always matched by "
+        "position.",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=int,
+        nargs="+",
+        default=[None],
+        help="One or more numbers of frames after which an unseen face is "
+        "archived. By default, faces are never archived.",
+    )
+    parser.add_argument(
+        "--reid-index",
+        type=str,
+        choices=INDEX_TYPES,
+        default="brute_force",
+        help="Similarity index used to re-identify archived faces. Default: "
+        "brute_force.",
+    )
+    parser.add_argument(
+        "--frame-stride",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="One or more strides to evaluate: only run the face detector and "
+        "tracker on one of every N frames, as detect_faces.py --frame-stride. "
+        "Default: 1 (all frames).",
+    )
+    parser.add_argument(
+        "--cut-thresh",
+        type=float,
+        help="Detect scene cuts as detect_faces.py --cut-thresh, so boxes are "
+        "not matched across them. By default, cuts are not detected.",
+    )
+    parser.add_argument(
+        "--static-thresh",
+        type=float,
+        nargs="+",
+        default=[None],
+        help="One or more thresholds to evaluate: reuse the detections of "
+        "static frames as detect_faces.py --static-thresh. By default, all "
+        "frames run the models.",
+    )
+    parser.add_argument(
+        "--iou-thresh",
+        type=float,
+        default=0.5,
+        help="Minimum IoU to match a predicted box with a ground truth box. "
+        "Default: 0.5.",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        help="Number of worker processes used to evaluate the parameter grid. "
+        "By default, one per CPU.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        help="Path to a CSV file to save the results of every configuration.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Directory to store the raw detections of each video. When the "
+        "detections of a video are already cached, they are reused instead of "
+        "running the models again.",
+    )
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="When the input filename is a directory, also process recursively "
+        "all subdirectories inside.",
+    )
+    parser.add_argument(
+        "--quiet",
+        "--silent",
+        "-q",
+        action="store_true",
+        help="Hide progress bars.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def find_videos(
+    filenames: list[str], gt_path: Path | None, recursive: bool
+) -> list[tuple[Path, Path]]:
+    videos = []
+    for filename in filenames:
+        filename = Path(filename)
+        if filename.is_file():
+            video_gt_path = filename.with_suffix(".json")
+            if gt_path is not None:
+                video_gt_path = gt_path
+            videos.append((filename, video_gt_path))
+        elif filename.is_dir():
+            for video_path in iter_files(filename, VIDEO_FORMATS, recursive):
+                video_gt_path = video_path.with_suffix(".json")
+                if gt_path is not None:
+                    rel_path = video_gt_path.relative_to(filename)
+                    video_gt_path = gt_path / rel_path
+                videos.append((video_path, video_gt_path))
+        else:
+            tqdm.write(
+                f"evaluate_tracking.py: WARNING: file {filename} does not exist."
+            )
+    return [
+        (video_path, video_gt_path)
+        for video_path, video_gt_path in videos
+        if video_gt_path.exists()
+    ]
+
+
+def format_table(results: list[dict[str, float]]) -> str:
+    header = [
+        *DETECT_PARAMS,
+        *TRACK_PARAMS,
+        "mota",
+        "idf1",
+        "id_switches",
+        "fps",
+    ]
+    lines = ["\t".join(header)]
+    for result in results:
+        lines.append(
+            "\t".join(
+                str(result[key])
+                if result[key] is None or isinstance(result[key], int)
+                else f"{result[key]:.3f}"
+                for key in header
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+
+    gt_path = None if args.gt_path is None else Path(args.gt_path)
+    grid = {
+        "frame_stride": args.frame_stride,
+        "static_thresh": args.static_thresh,
+        "det_thresh": args.det_thresh,
+        "box_disp_thresh": args.box_disp_thresh,
+        "cos_sim_thresh": args.cos_sim_thresh,
+        "min_hits": args.min_hits,
+        "max_box_age": args.max_box_age,
+        "max_age": args.max_age,
+    }
+
+    video_files = find_videos(args.filenames, gt_path, args.recursive)
+    if len(video_files) == 0:
+        raise FileNotFoundError("No videos with ground truth annotations found")
+
+    # Detections and cuts are those of detect_faces.py with the same options,
+    # and its cache files are reused. They are computed once for each
+    # combination of detection options, whose speed differs
+    videos = {}
+    detect_fps = {}
+    for frame_stride, static_thresh in itertools.product(
+        args.frame_stride, args.static_thresh
+    ):
+        face_tracker = FaceTracker(
+            max_frames=args.max_frames,
+            quiet=args.quiet,
+            cache_dir=args.cache_dir,
+            frame_stride=frame_stride,
+            cut_thresh=args.cut_thresh,
+            static_thresh=static_thresh,
+        )
+        config_videos = []
+        num_frames = 0
+        detect_time = 0.0
+        for video_path, video_gt_path in tqdm(
+            video_files,
+            desc="Detecting faces",
+            leave=False,
+            disable=args.quiet,
+            dynamic_ncols=True,
+        ):
+            detections, video_detect_time = face_tracker.get_detections(
+                str(video_path)
+            )
+            detect_time += video_detect_time
+            num_frames += len(detections)
+            cuts = list(face_tracker.last_cuts)
+            with open(video_gt_path, "r") as gt_file:
+                config_videos.append((detections, cuts, json.load(gt_file)))
+        videos[frame_stride, static_thresh] = config_videos
+        detect_fps[frame_stride, static_thresh] = num_frames / max(
+            detect_time, 1e-9
+        )
+
+    results = sweep(
+        videos,
+        grid,
+        detect_fps=detect_fps,
+        iou_thresh=args.iou_thresh,
+        workers=args.workers,
+        reid_index=args.reid_index,
+    )
+
+    tqdm.write(
+        f"Evaluated {len(results)} configurations on {len(video_files)} "
+        f"videos ({num_frames} frames)",
+        file=sys.stdout,
+    )
+    tqdm.write("Speed/accuracy Pareto front:", file=sys.stdout)
+    tqdm.write(format_table(pareto_front(results)), file=sys.stdout)
+
+    if args.output is not None:
+        with open(args.output, "w", newline="") as out_file:
+            writer = csv.DictWriter(out_file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        tqdm.write(f"Saved results to {args.output}", file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+import argparse
+from pathlib import Path
+import sys
+import time
+
+from tqdm import tqdm
+
+from src.annotation_index import SORT_KEYS, AnnotationIndex, save_selection
+from src.path import iter_files
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Tool to index the face tracks of all the JSON annotation files of a "
+        "dataset in a SQLite database, and to query them."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser(
+        "build",
+        help="Add annotation files to the index, or update the ones that "
+        "changed since the last build.",
+    )
+    build.add_argument("db", type=str, help="Path to the index database.")
+    build.add_argument(
+        "filenames",
+        type=str,
+        nargs="+",
+        help="Path(s) to a JSON annotation file or a directory.",
+    )
+    build.add_argument(
+        "--video-dir",
+        type=str,
+        help="Root directory of the videos, if annotations were saved with "
+        "--prefix. By default, videos are searched next to the annotations.",
+    )
+    build.add_argument(
+        "--prune",
+        action="store_true",
+        help="Remove the files of the input directories that no longer exist "
+        "from the index.",
+    )
+    build.add_argument(
+        "--include",
+        type=str,
+        nargs="+",
+        help="Only index the files whose name or path relative to the input "
+        "directory matches one of these glob patterns.",
+    )
+    build.add_argument(
+        "--exclude",
+        type=str,
+        nargs="+",
+        help="Skip the files and subdirectories whose name or relative path "
+        "matches one of these glob patterns.",
+    )
+    build.add_argument(
+        "--scan-workers",
+        type=int,
+        default=1,
+        help="Number of threads that list subdirectories in parallel. "
+        "Default: 1.",
+    )
+    build.add_argument(
+        "--file-list-cache",
+        type=str,
+        help="Path to a file that stores the listing of the input "
+        "directories, so later builds only list the directories that changed.",
+    )
+    build.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="When the input filename is a directory, also process recursively "
+        "all subdirectories inside.",
+    )
+    build.add_argument(
+        "--quiet",
+        "--silent",
+        "-q",
+        action="store_true",
+        help="Hide progress bars.",
+    )
+
+    query = subparsers.add_parser(
+        "query",
+        help="Print the face tracks that match all the given filters, one "
+        "per line: video (or annotation file if the video was not found), "
+        "face ID, number of frames, first and last frame, mean detector score "
+        "and mean box size.",
+    )
+    query.add_argument("db", type=str, help="Path to the index database.")
+    query.add_argument(
+        "--min-frames",
+        type=int,
+        help="Minimum number of annotated frames.",
+    )
+    query.add_argument(
+        "--max-frames",
+        type=int,
+        help="Maximum number of annotated frames.",
+    )
+    query.add_argument(
+        "--min-span",
+        type=int,
+        help="Minimum number of frames between the first and last frame of "
+        "the face, both included.",
+    )
+    query.add_argument(
+        "--min-prob",
+        type=float,
+        help="Minimum mean detector score.",
+    )
+    query.add_argument(
+        "--min-frame-prob",
+        type=float,
+        help="Minimum detector score of every frame.",
+    )
+    query.add_argument(
+        "--min-box-size",
+        type=float,
+        help="Minimum mean size (max side) of the bounding box, in pixels.",
+    )
+    query.add_argument(
+        "--max-box-size",
+        type=float,
+        help="Maximum mean size (max side) of the bounding box, in pixels.",
+    )
+    query.add_argument(
+        "--min-quality",
+        type=float,
+        help="Minimum mean quality score (see crop_faces.py --save-quality). "
+        "Faces without scores never match.",
+    )
+    query.add_argument(
+        "--path",
+        type=str,
+        help="Glob pattern that the absolute path of the annotation file "
+        "must match (e.g., '*/day1/*').",
+    )
+    query.add_argument(
+        "--sort",
+        type=str,
+        choices=SORT_KEYS,
+        help="Sort tracks by this key, in descending order.",
+    )
+    query.add_argument(
+        "--limit",
+        type=int,
+        help="Max number of tracks to return.",
+    )
+    query.add_argument(
+        "--videos",
+        action="store_true",
+        help="Only print each matching video once, with its number of "
+        "matching tracks.",
+    )
+    query.add_argument(
+        "--selection",
+        type=str,
+        help="Also save the matching tracks to this JSON file, to only crop "
+        "them with crop_faces.py --selection.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def build(args: argparse.Namespace) -> None:
+    filenames = args.filenames
+    video_dir = None if args.video_dir is None else Path(args.video_dir)
+    prune = args.prune
+    recursive = args.recursive
+    quiet = args.quiet
+
+    with AnnotationIndex(args.db) as index:
+        for filename in filenames:
+            filename = Path(filename)
+            if filename.is_file():
+                counts = index.ingest([filename], video_dir)
+            elif filename.is_dir():
+                ann_files = iter_files(
+                    filename,
+                    ".json",
+                    recursive,
+                    include=args.include,
+                    exclude=args.exclude,
+                    workers=args.scan_workers,
+                    cache_path=args.file_list_cache,
+                )
+                counts = index.ingest(
+                    tqdm(
+                        ann_files,
+                        desc="Indexing files",
+                        leave=False,
+                        disable=quiet,
+                        dynamic_ncols=True,
+                    ),
+                    video_dir,
+                    root=filename,
+                    prune=prune,
+                )
+            else:
+                tqdm.write(
+                    f"index_annotations.py: WARNING: file {filename} does not "
+                    "exist."
+                )
+                continue
+            tqdm.write(
+                f"{filename}: {counts['added']} added, {counts['updated']} "
+                f"updated, {counts['unchanged']} unchanged, "
+                f"{counts['removed']} removed",
+                file=sys.stdout,
+            )
+        stats = index.stats()
+    tqdm.write(
+        f"Index {args.db}: {stats['tracks']} tracks in "
+        f"{stats['annotation_files']} annotation files",
+        file=sys.stdout,
+    )
+
+
+def query(args: argparse.Namespace) -> None:
+    with AnnotationIndex(args.db) as index:
+        start = time.perf_counter()
+        tracks = index.query(
+            sort=args.sort,
+            limit=args.limit,
+            min_frames=args.min_frames,
+            max_frames=args.max_frames,
+            min_span=args.min_span,
+            min_prob=args.min_prob,
+            min_min_prob=args.min_frame_prob,
+            min_box_size=args.min_box_size,
+            max_box_size=args.max_box_size,
+            min_quality=args.min_quality,
+            path=args.path,
+        )
+        query_time = time.perf_counter() - start
+
+    if args.videos:
+        num_tracks = {}
+        for track in tracks:
+            video = track.video or track.ann_path
+            num_tracks[video] = num_tracks.get(video, 0) + 1
+        for video, count in num_tracks.items():
+            print(f"{video}\t{count}")
+    else:
+        for track in tracks:
+            print(
+                f"{track.video or track.ann_path}\t{track.face_id}\t"
+                f"{track.num_frames}\t{track.first_frame}\t{track.last_frame}\t"
+                f"{track.mean_prob:.4f}\t{track.mean_box_size:.1f}"
+            )
+    print(
+        f"index_annotations.py: {len(tracks)} tracks in "
+        f"{query_time * 1000:.1f} ms",
+        file=sys.stderr,
+    )
+
+    if args.selection is not None:
+        num_videos, num_selected = save_selection(tracks, args.selection)
+        print(
+            f"Saved {num_selected} tracks of {num_videos} videos to "
+            f"{args.selection}",
+            file=sys.stderr,
+        )
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+    if args.command == "build":
+        build(args)
+    else:
+        query(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
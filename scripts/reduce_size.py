@@ -8,7 +8,8 @@ import sys
 
 from tqdm import tqdm
 
-from src.path import find
+from src.path import iter_files
+from src.sharding import WorkDir, distribute, parse_shard
 
 
 def parse_args(argv: list[str]) -> argparse.Namespace:
@@ -34,6 +35,31 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         nargs="+",
         help="Ignore one or more annotation keys.",
     )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only process the annotation files of this shard, given as 'i/N' (e.g., "
+        "'0/4' to '3/4' on four nodes). Files are assigned to shards by a hash "
+        "of their path relative to the input directory, so every node gets "
+        "the same split.",
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=str,
+        help="Shared directory where nodes claim annotation files with lock "
+        "files, so that each file is processed by a single node and faster "
+        "nodes take more work. With --shard, each node first processes its "
+        "shard and then the unclaimed files of the other shards. Finished "
+        "files are skipped on later runs; delete the directory to process "
+        "them again.",
+    )
+    parser.add_argument(
+        "--claim-timeout",
+        type=float,
+        help="Seconds after which the claim of a node that stopped (e.g., it "
+        "was killed) can be taken by another node. Live nodes keep their "
+        "claims however long a file takes. By default, claims never expire.",
+    )
     parser.add_argument(
         "--recursive", "-r",
         action="store_true",
@@ -90,10 +116,13 @@ def process_dir(
     ignore: list[str] | None,
     recursive: bool,
     quiet: bool,
+    shard: tuple[int, int] | None = None,
+    work_dir: WorkDir | None = None,
 ) -> None:
     total_size = 0
+    files = iter_files(input_path, ".json", recursive)
     for file in tqdm(
-        find(input_path, ".json", recursive),
+        distribute(files, input_path, shard, work_dir),
         desc="Processing directory",
         leave=False,
         disable=quiet,
@@ -109,6 +138,12 @@ def main(argv: list[str]) -> None:
     filenames = args.filenames
     precision = args.precision
     ignore = args.ignore
+    shard = args.shard
+    work_dir = None
+    if args.work_dir is not None:
+        work_dir = WorkDir(
+            Path(args.work_dir) / "reduce_size", claim_timeout=args.claim_timeout
+        )
     recursive = args.recursive
     quiet = args.quiet
 
@@ -132,6 +167,8 @@ def main(argv: list[str]) -> None:
                 ignore=ignore,
                 recursive=recursive,
                 quiet=quiet,
+                shard=shard,
+                work_dir=work_dir,
             )
         else:
             tqdm.write(
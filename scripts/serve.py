@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import argparse
+import signal
+import sys
+
+from src.face_tracker import FaceTracker
+from src.server import DEFAULT_SOCKET, InferenceServer
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Local inference server that keeps the face detection and recognition "
+        "models loaded, so that detect_faces.py and view_annotations.py "
+        "started with --server do not load them, and batches the frames of "
+        "all its clients."
+    )
+    parser.add_argument(
+        "--socket",
+        "-s",
+        type=str,
+        default=DEFAULT_SOCKET,
+        help="Path of the Unix socket to listen on, in a directory that only "
+        f"the current user can write to. Default: {DEFAULT_SOCKET}.",
+    )
+    parser.add_argument(
+        "--det-size",
+        type=int,
+        default=640,
+        help="Input size of the face detector. Default: 640.",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        help="Also detect faces in overlapping tiles of this size (a multiple "
+        "of 32) at the native resolution of large frames. By default, only "
+        "the full frame is used.",
+    )
+    parser.add_argument(
+        "--tile-overlap",
+        type=float,
+        default=0.2,
+        help="Overlap between tiles, as a fraction of the tile size. "
+        "Default: 0.2.",
+    )
+    parser.add_argument(
+        "--tile-flagged",
+        action="store_true",
+        help="Only run the tiles that overlap a face found by the full-frame "
+        "pass, e.g., for crowds.",
+    )
+    parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=16,
+        help="Max number of frames processed together. Default: 16.",
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=5.0,
+        help="Max time in milliseconds to wait for more frames to fill a "
+        "batch. Default: 5.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+
+    socket_path = args.socket
+    det_size = args.det_size
+    max_batch = args.max_batch
+    max_wait = args.max_wait / 1000
+
+    face_tracker = FaceTracker(
+        det_size=(det_size, det_size),
+        tile_size=args.tile_size,
+        tile_overlap=args.tile_overlap,
+        tile_flagged=args.tile_flagged,
+        quiet=True,
+    )
+    server = InferenceServer(
+        face_tracker, socket_path, max_batch=max_batch, max_wait=max_wait
+    )
+    # Remove the socket on termination too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"serve.py: listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher = server.batcher
+        if batcher.num_batches > 0:
+            print(
+                f"serve.py: {batcher.num_frames} frames in "
+                f"{batcher.num_batches} batches "
+                f"({batcher.num_frames / batcher.num_batches:.1f} per batch)"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
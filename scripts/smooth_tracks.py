@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+from pathlib import Path
+import sys
+
+from tqdm import tqdm
+
+from src.path import iter_files
+from src.postprocess import is_annotation, postprocess_annotations
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Tool to fill short gaps of face tracks and smooth their bounding boxes "
+        "and landmarks."
+    )
+    parser.add_argument(
+        "filenames",
+        type=str,
+        nargs="+",
+        help="Path(s) to a JSON file or directory.",
+    )
+    parser.add_argument(
+        "--max-gap",
+        "-g",
+        type=int,
+        default=5,
+        help="Max number of consecutive missing frames of a face to fill by "
+        "interpolation. Filled frames are flagged as 'interpolated'. When "
+        "annotations were computed with detect_faces.py --frame-stride, use at "
+        "least the stride minus one. Default: 5.",
+    )
+    parser.add_argument(
+        "--window",
+        "-w",
+        type=int,
+        default=7,
+        help="Length, in frames, of the Savitzky-Golay smoothing filter. Use 0 "
+        "to only fill gaps. Default: 7.",
+    )
+    parser.add_argument(
+        "--polyorder",
+        type=int,
+        default=2,
+        help="Order of the polynomial of the smoothing filter. Default: 2.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        help="Directory to save the processed annotation files. By default, "
+        "input files are overwritten.",
+    )
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="When the input filename is a directory, also process recursively "
+        "all subdirectories inside.",
+    )
+    parser.add_argument(
+        "--quiet",
+        "--silent",
+        "-q",
+        action="store_true",
+        help="Hide progress bars.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def process_file(
+    input_path: Path,
+    out_path: Path,
+    max_gap: int,
+    window: int | None,
+    polyorder: int,
+) -> None:
+    with open(input_path, "r") as json_file:
+        data = json.load(json_file)
+    # Other JSON files of the dataset, such as identities, selections or
+    # probe indexes, are left untouched
+    if not is_annotation(data):
+        tqdm.write(
+            f"smooth_tracks.py: WARNING: file {input_path} is not an "
+            "annotation file, skipping."
+        )
+        return
+
+    data = postprocess_annotations(data, max_gap, window, polyorder)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w") as json_file:
+        json.dump(data, json_file)
+
+
+def process_dir(
+    input_path: Path,
+    out_dir: Path | None,
+    max_gap: int,
+    window: int | None,
+    polyorder: int,
+    recursive: bool,
+    quiet: bool,
+) -> None:
+    for file in tqdm(
+        iter_files(input_path, ".json", recursive),
+        desc="Processing directory",
+        leave=False,
+        disable=quiet,
+        dynamic_ncols=True,
+    ):
+        out_path = file
+        if out_dir is not None:
+            out_path = out_dir / file.relative_to(input_path)
+        process_file(file, out_path, max_gap, window, polyorder)
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+
+    filenames = args.filenames
+    max_gap = args.max_gap
+    window = args.window if args.window > 0 else None
+    polyorder = args.polyorder
+    out_dir = None if args.output is None else Path(args.output)
+    recursive = args.recursive
+    quiet = args.quiet
+
+    disable = quiet or len(filenames) == 1
+    for filename in tqdm(
+        filenames,
+        desc="Processing input files",
+        leave=False,
+        disable=disable,
+        dynamic_ncols=True,
+    ):
+        filename = Path(filename)
+        if filename.is_file():
+            out_path = filename
+            if out_dir is not None:
+                out_path = out_dir / filename.name
+            process_file(filename, out_path, max_gap, window, polyorder)
+        elif filename.is_dir():
+            process_dir(
+                input_path=filename,
+                out_dir=out_dir,
+                max_gap=max_gap,
+                window=window,
+                polyorder=polyorder,
+                recursive=recursive,
+                quiet=quiet,
+            )
+        else:
+            tqdm.write(
+                f"smooth_tracks.py: WARNING: file {filename} does not exist."
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
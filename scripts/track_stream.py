@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+from src.face_tracker import FaceTracker
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        "Tool to track faces on live streams, such as webcams, RTSP streams "
+        "or files that are still being written."
+    )
+    parser.add_argument(
+        "source",
+        type=str,
+        help="Camera index (e.g., 0), URL, named pipe or video file.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        help="Path to save the results of each frame as JSON lines. By "
+        "default, they are printed to stdout.",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=4,
+        help="Max number of frames waiting to be processed. Older frames are "
+        "dropped when the queue is full. Default: 4.",
+    )
+    parser.add_argument(
+        "--loop",
+        action="store_true",
+        help="Restart video files when they end, to simulate a live stream.",
+    )
+    parser.add_argument(
+        "--fps",
+        type=float,
+        help="Read frames at this rate. Useful to simulate a live stream from "
+        "a video file. By default, frames are read as fast as the source "
+        "provides them.",
+    )
+    parser.add_argument(
+        "--max-frames",
+        "-f",
+        type=int,
+        help="Max number of frames to read from the source. By default, the "
+        "stream is processed until it ends.",
+    )
+    parser.add_argument(
+        "--det-thresh",
+        type=float,
+        default=0.7,
+        help="Minimum detector confidence score to consider a detection as "
+        "valid. Default: 0.7.",
+    )
+    parser.add_argument(
+        "--box-disp-thresh",
+        type=float,
+        default=0.3,
+        help="Maximum displacement of a bounding box to consider it the same "
+        "as the previous frame. Default: 0.3 (30 percent of the max side "
+        "of the box).",
+    )
+    parser.add_argument(
+        "--cos-sim-thresh",
+        type=float,
+        default=0.5,
+        help="Maximum cosine similarity score to match two faces. Default: 0.5.",
+    )
+    parser.add_argument(
+        "--min-hits",
+        type=int,
+        default=3,
+        help="Number of detections after which a new face is confirmed. "
+        "Faces are only written once confirmed. Default: 3.",
+    )
+    parser.add_argument(
+        "--max-box-age",
+        type=int,
+        default=30,
+        help="Number of frames after which a face that is not detected is no "
+        "longer matched by the position of its bounding box. Default: 30.",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=int,
+        default=300,
+        help="Number of frames after which a face that is not detected is "
+        "archived, which bounds the cost per frame of endless streams. "
+        "Default: 300.",
+    )
+    parser.add_argument(
+        "--quiet",
+        "--silent",
+        "-q",
+        action="store_true",
+        help="Hide progress bars.",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    output = args.output
+    queue_size = args.queue_size
+    loop = args.loop
+    fps = args.fps
+    quiet = args.quiet
+
+    face_tracker = FaceTracker(
+        det_thresh=args.det_thresh,
+        box_disp_thresh=args.box_disp_thresh,
+        cos_sim_thresh=args.cos_sim_thresh,
+        max_frames=args.max_frames,
+        quiet=quiet,
+        min_hits=args.min_hits,
+        max_box_age=args.max_box_age,
+        max_age=args.max_age,
+    )
+
+    out_file = sys.stdout if output is None else open(output, "w")
+    latencies = []
+    dropped = 0
+    progress_bar = tqdm(
+        desc="Processing stream",
+        leave=False,
+        disable=quiet,
+        dynamic_ncols=True,
+    )
+    try:
+        results = face_tracker.stream(
+            source, queue_size=queue_size, loop=loop, fps=fps
+        )
+        for result in results:
+            latencies.append(result["latency"])
+            dropped = result["dropped"]
+            result["latency"] = round(result["latency"] * 1000, 2)
+            out_file.write(json.dumps(result) + "\n")
+            progress_bar.update()
+            progress_bar.set_postfix(
+                latency_ms=result["latency"], dropped=dropped
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        progress_bar.close()
+        if out_file is not sys.stdout:
+            out_file.close()
+
+    if len(latencies) > 0:
+        latencies = np.array(latencies) * 1000
+        tqdm.write(
+            f"Processed {len(latencies)} frames, dropped {dropped}. Latency: "
+            f"mean {latencies.mean():.1f} ms, p95 "
+            f"{np.percentile(latencies, 95):.1f} ms, max "
+            f"{latencies.max():.1f} ms",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -6,7 +6,6 @@ from pathlib import Path
 import sys
 
 from src.draw import draw_face_anns
-from src.face_tracker import FaceTracker
 from src.video import VIDEO_FORMATS, Video, play_video
 
 
@@ -39,6 +38,14 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
         default=0.5,
         help="Maximum cosine similarity score to match two faces. Default: 0.5.",
     )
+    parser.add_argument(
+        "--server",
+        type=str,
+        nargs="?",
+        const="",
+        metavar="SOCKET",
+        help="Compute detections with the inference server started with serve.py at this socket (by default, the one of serve.py) instead of loading the models. If no server is running, the models are loaded as usual.",
+    )
     args = parser.parse_args(argv)
     return args
 
@@ -50,17 +57,25 @@ def main(argv: list[str]) -> None:
     det_thresh = args.det_thresh
     box_disp_thresh = args.box_disp_thresh
     cos_sim_thresh = args.cos_sim_thresh
+    server = args.server
 
-    if Path(filename).suffix not in VIDEO_FORMATS:
+    if Path(filename).suffix.lower() not in VIDEO_FORMATS:
         raise ValueError(
             f"Input file is not a video {filename} ({VIDEO_FORMATS})."
         )
 
     if ann_path is None:
+        from src.face_tracker import FaceTracker
+
+        if server == "":
+            from src.server import DEFAULT_SOCKET
+
+            server = DEFAULT_SOCKET
         face_tracker = FaceTracker(
             det_thresh=det_thresh,
             box_disp_thresh=box_disp_thresh,
             cos_sim_thresh=cos_sim_thresh,
+            server=server,
         )
         faces = face_tracker(filename)
     else:
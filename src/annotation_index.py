@@ -0,0 +1,375 @@
+import json
+import os
+from pathlib import Path
+import sqlite3
+from typing import Any, Iterable, NamedTuple
+
+import numpy as np
+
+from .postprocess import is_annotation
+from .video import VIDEO_FORMATS
+
+__all__ = [
+    "QUERY_FILTERS",
+    "SORT_KEYS",
+    "AnnotationIndex",
+    "TrackSummary",
+    "find_video",
+    "load_selection",
+    "save_selection",
+    "track_summary",
+]
+
+ANNOTATION_INDEX_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    video TEXT,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    num_tracks INTEGER
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    face_id TEXT NOT NULL,
+    num_frames INTEGER NOT NULL,
+    first_frame INTEGER NOT NULL,
+    last_frame INTEGER NOT NULL,
+    mean_prob REAL NOT NULL,
+    min_prob REAL NOT NULL,
+    mean_box_size REAL NOT NULL,
+    mean_quality REAL,
+    PRIMARY KEY (file_id, face_id)
+);
+CREATE INDEX IF NOT EXISTS tracks_num_frames ON tracks (num_frames);
+CREATE INDEX IF NOT EXISTS tracks_mean_prob ON tracks (mean_prob);
+CREATE INDEX IF NOT EXISTS tracks_mean_box_size ON tracks (mean_box_size);
+CREATE INDEX IF NOT EXISTS tracks_mean_quality ON tracks (mean_quality);
+"""
+
+# Query filter -> (SQL expression, operator) on the tracks (t) and files (f)
+# tables
+QUERY_FILTERS = {
+    "min_frames": ("t.num_frames", ">="),
+    "max_frames": ("t.num_frames", "<="),
+    "min_span": ("t.last_frame - t.first_frame + 1", ">="),
+    "min_prob": ("t.mean_prob", ">="),
+    "min_min_prob": ("t.min_prob", ">="),
+    "min_box_size": ("t.mean_box_size", ">="),
+    "max_box_size": ("t.mean_box_size", "<="),
+    "min_quality": ("t.mean_quality", ">="),
+    "path": ("f.path", "GLOB"),
+}
+
+# Indexed expressions of QUERY_FILTERS and SORT_KEYS -> index
+_INDEXES = {
+    "t.num_frames": "tracks_num_frames",
+    "t.mean_prob": "tracks_mean_prob",
+    "t.mean_box_size": "tracks_mean_box_size",
+    "t.mean_quality": "tracks_mean_quality",
+}
+
+# Tracks are read through the index of a filter only if it matches at most
+# this fraction of them, since each match is a random lookup in the table.
+# Otherwise, scanning the whole table is faster.
+INDEX_MAX_FRACTION = 0.05
+
+# Sort key -> SQL expression, sorted in descending order
+SORT_KEYS = {
+    "frames": "t.num_frames",
+    "span": "t.last_frame - t.first_frame",
+    "prob": "t.mean_prob",
+    "box_size": "t.mean_box_size",
+    "quality": "t.mean_quality",
+}
+
+
+class TrackSummary(NamedTuple):
+    """Summary of a face track of an annotation file"""
+
+    ann_path: str
+    video: str | None
+    face_id: str
+    num_frames: int
+    first_frame: int
+    last_frame: int
+    mean_prob: float
+    min_prob: float
+    mean_box_size: float
+    mean_quality: float | None
+
+
+def track_summary(face_anns: dict[str, dict[str, Any]]) -> tuple:
+    """Number of frames, first and last frame, mean and min detector score,
+    mean box size (max side) and mean quality (None if not scored) of the
+    annotations of a face"""
+    frame_idxs = np.fromiter(map(int, face_anns), dtype=np.int64)
+    values = face_anns.values()
+    bbox = np.array([x["bbox"] for x in values], dtype=np.float64)
+    prob = np.array([x["prob"] for x in values], dtype=np.float64)
+    box_size = np.maximum(bbox[:, 2] - bbox[:, 0], bbox[:, 3] - bbox[:, 1])
+    mean_quality = None
+    if all("quality" in x for x in values):
+        mean_quality = float(np.mean([x["quality"] for x in values]))
+    return (
+        len(frame_idxs),
+        int(frame_idxs.min()),
+        int(frame_idxs.max()),
+        float(prob.mean()),
+        float(prob.min()),
+        float(box_size.mean()),
+        mean_quality,
+    )
+
+
+def find_video(ann_path: Path, video_dir: Path | None = None) -> Path | None:
+    """Video of an annotation file: the file with the same name and a video
+    extension, next to it or at the same relative path of ``video_dir``"""
+    base = ann_path if video_dir is None else video_dir / ann_path.name
+    for suffix in VIDEO_FORMATS:
+        for video_suffix in (suffix, suffix.upper()):
+            video_path = base.with_suffix(video_suffix)
+            if video_path.exists():
+                return video_path
+    return None
+
+
+class AnnotationIndex:
+    """SQLite database with a summary of every face track of a dataset.
+
+    ``ingest`` adds annotation files, and only parses again the ones whose
+    size or modification time changed. Tracks are indexed by length, mean
+    detector score, mean box size and mean quality, so ``query`` answers
+    range queries over millions of tracks without reading any annotation
+    file.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        # Readers are not blocked by a running ingest
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != ANNOTATION_INDEX_VERSION:
+            self.conn.executescript(
+                "DROP TABLE IF EXISTS tracks; DROP TABLE IF EXISTS files;"
+            )
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute(f"PRAGMA user_version = {ANNOTATION_INDEX_VERSION}")
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "AnnotationIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def ingest(
+        self,
+        ann_paths: Iterable[Path],
+        video_dir: Path | None = None,
+        root: Path | None = None,
+        prune: bool = False,
+        commit_every: int = 1000,
+    ) -> dict[str, int]:
+        """Adds or updates annotation files. Files that are not face
+        annotations (e.g., other JSON files) are recorded without tracks, so
+        they are not parsed again either. Videos are searched next to the
+        annotations or, if ``video_dir`` is set, at their path relative to
+        ``root`` inside it. With ``prune``, files under ``root`` that were not
+        given are removed. Returns the number of added, updated, unchanged
+        and removed files."""
+        stored = {
+            path: (file_id, size, mtime_ns)
+            for file_id, path, size, mtime_ns in self.conn.execute(
+                "SELECT id, path, size, mtime_ns FROM files"
+            )
+        }
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        seen = set()
+        try:
+            for ann_path in ann_paths:
+                ann_path = Path(ann_path)
+                key = os.path.abspath(ann_path)
+                seen.add(key)
+                stat = os.stat(ann_path)
+                entry = stored.get(key)
+                if entry is not None and entry[1:] == (
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ):
+                    counts["unchanged"] += 1
+                    continue
+                if entry is not None:
+                    # Tracks are deleted in cascade
+                    self.conn.execute(
+                        "DELETE FROM files WHERE id = ?", (entry[0],)
+                    )
+                counts["added" if entry is None else "updated"] += 1
+
+                video_base = None
+                if video_dir is not None:
+                    video_base = Path(video_dir)
+                    if root is not None:
+                        video_base /= ann_path.parent.relative_to(root)
+                video = find_video(ann_path, video_base)
+                try:
+                    with open(ann_path, "r") as ann_file:
+                        anns = json.load(ann_file)
+                except (ValueError, UnicodeDecodeError):
+                    anns = None
+                if not is_annotation(anns):
+                    anns = None
+
+                cursor = self.conn.execute(
+                    "INSERT INTO files (path, video, size, mtime_ns, "
+                    "num_tracks) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        None if video is None else os.path.abspath(video),
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        None if anns is None else len(anns),
+                    ),
+                )
+                if anns:
+                    file_id = cursor.lastrowid
+                    self.conn.executemany(
+                        "INSERT INTO tracks VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            (file_id, face_id, *track_summary(face_anns))
+                            for face_id, face_anns in anns.items()
+                        ),
+                    )
+                num_changed = counts["added"] + counts["updated"]
+                if num_changed % commit_every == 0:
+                    # Interrupted ingests keep the files ingested so far
+                    self.conn.commit()
+
+            if prune and root is not None:
+                prefix = os.path.join(os.path.abspath(root), "")
+                removed = [
+                    (file_id,)
+                    for path, (file_id, _, _) in stored.items()
+                    if path.startswith(prefix) and path not in seen
+                ]
+                self.conn.executemany("DELETE FROM files WHERE id = ?", removed)
+                counts["removed"] = len(removed)
+        finally:
+            self.conn.commit()
+        return counts
+
+    def query(
+        self,
+        sort: str | None = None,
+        limit: int | None = None,
+        **filters: Any,
+    ) -> list[TrackSummary]:
+        """Tracks that match all the given filters (see ``QUERY_FILTERS``;
+        None values are ignored), optionally sorted by descending ``sort``
+        key (see ``SORT_KEYS``)."""
+        active = []
+        for name, value in filters.items():
+            if name not in QUERY_FILTERS:
+                raise ValueError(f"Unknown filter: {name}")
+            if value is not None:
+                active.append((*QUERY_FILTERS[name], value))
+        if sort is not None and sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+
+        # Filter values are bound parameters, so the query planner does not
+        # know how many tracks each one matches, and may read most of the
+        # table through an index. Matches are counted on the (covering) index
+        # of each filter instead, and the table is only read through the index
+        # of the most selective one if it matches few tracks. Otherwise, it
+        # is scanned, or read in the order of the sort key until the limit.
+        (num_tracks,) = self.conn.execute(
+            "SELECT COUNT(*) FROM tracks"
+        ).fetchone()
+        index = None
+        min_count = INDEX_MAX_FRACTION * num_tracks
+        for expr, op, value in active:
+            if expr not in _INDEXES:
+                continue
+            (count,) = self.conn.execute(
+                f"SELECT COUNT(*) FROM tracks t WHERE {expr} {op} ?", (value,)
+            ).fetchone()
+            if count <= min_count:
+                index, min_count = _INDEXES[expr], count
+        if index is None and sort is not None and limit is not None:
+            index = _INDEXES.get(SORT_KEYS[sort])
+
+        access = "NOT INDEXED" if index is None else f"INDEXED BY {index}"
+        # CROSS JOIN keeps the tracks as the outer loop
+        sql = (
+            "SELECT f.path, f.video, t.face_id, t.num_frames, t.first_frame, "
+            "t.last_frame, t.mean_prob, t.min_prob, t.mean_box_size, "
+            f"t.mean_quality FROM tracks t {access} "
+            "CROSS JOIN files f ON f.id = t.file_id"
+        )
+        conditions = [f"{expr} {op} ?" for expr, op, _ in active]
+        params = [value for _, _, value in active]
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        if sort is not None:
+            sql += f" ORDER BY {SORT_KEYS[sort]} DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [
+            TrackSummary(*row) for row in self.conn.execute(sql, params)
+        ]
+
+    def stats(self) -> dict[str, int]:
+        num_files, num_annotations = self.conn.execute(
+            "SELECT COUNT(*), COUNT(num_tracks) FROM files"
+        ).fetchone()
+        (num_tracks,) = self.conn.execute(
+            "SELECT COUNT(*) FROM tracks"
+        ).fetchone()
+        return {
+            "files": num_files,
+            "annotation_files": num_annotations,
+            "tracks": num_tracks,
+        }
+
+
+def save_selection(
+    tracks: Iterable[TrackSummary], path: str | Path
+) -> tuple[int, int]:
+    """Writes the faces of each video of a list of tracks to a JSON file,
+    which ``crop_faces.py --selection`` reads to only crop those faces.
+    Tracks without a known video are left out. Returns the number of videos
+    and tracks written."""
+    videos = {}
+    num_tracks = 0
+    for track in tracks:
+        if track.video is None:
+            continue
+        video = videos.setdefault(
+            track.video, {"annotations": track.ann_path, "faces": []}
+        )
+        video["faces"].append(track.face_id)
+        num_tracks += 1
+    with open(path, "w") as selection_file:
+        json.dump({"videos": videos}, selection_file, indent=1)
+    return len(videos), num_tracks
+
+
+def load_selection(path: str | Path) -> dict[Path, tuple[Path, list[str]]]:
+    """Reads a file written by ``save_selection`` as {video: (annotation
+    file, face IDs)}"""
+    with open(path, "r") as selection_file:
+        data = json.load(selection_file)
+    return {
+        Path(video): (Path(entry["annotations"]), entry["faces"])
+        for video, entry in data["videos"].items()
+    }
@@ -0,0 +1,45 @@
+import importlib
+import sys
+
+__all__ = ["SUBCOMMANDS", "main"]
+
+# Subcommand -> module of the script that implements it. Scripts are only
+# imported when their subcommand runs, so that light subcommands (e.g., trim)
+# do not pay the import time of the models.
+SUBCOMMANDS = {
+    "cluster": "scripts.cluster_identities",
+    "crop": "scripts.crop_faces",
+    "detect": "scripts.detect_faces",
+    "evaluate": "scripts.evaluate_tracking",
+    "index": "scripts.index_annotations",
+    "reduce": "scripts.reduce_size",
+    "serve": "scripts.serve",
+    "smooth": "scripts.smooth_tracks",
+    "stream": "scripts.track_stream",
+    "trim": "scripts.trim_faces",
+    "view": "scripts.view_annotations",
+}
+
+USAGE = f"""usage: vft <command> [<args>]
+
+Video face tracking tools. Commands:
+  {", ".join(SUBCOMMANDS)}
+
+Run 'vft <command> --help' for the options of each command."""
+
+
+def main(argv: list[str] | None = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 0 or argv[0] in ("-h", "--help"):
+        print(USAGE)
+        return
+    command = argv[0]
+    if command not in SUBCOMMANDS:
+        print(USAGE, file=sys.stderr)
+        sys.exit(f"vft: error: unknown command: {command}")
+    module = importlib.import_module(SUBCOMMANDS[command])
+    module.main(argv[1:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+from tqdm import tqdm
+
+__all__ = [
+    "CLUSTER_METHODS",
+    "EMBEDDINGS_SUFFIX",
+    "cluster_embeddings",
+    "gather_embeddings",
+    "knn_graph",
+    "load_track_embeddings",
+    "save_track_embeddings",
+]
+
+CLUSTER_METHODS = ("exact", "ann")
+EMBEDDINGS_SUFFIX = ".emb.npz"
+
+
+def save_track_embeddings(
+    path: Path, face_ids: list[str], embs: np.ndarray, counts: np.ndarray
+) -> None:
+    np.savez(
+        path,
+        face_ids=np.array(face_ids, dtype=str),
+        embeddings=embs.astype(np.float16),
+        counts=counts.astype(np.int64),
+    )
+
+
+def load_track_embeddings(path: Path) -> tuple[list[str], np.ndarray]:
+    with np.load(path) as data:
+        return data["face_ids"].tolist(), data["embeddings"]
+
+
+def gather_embeddings(
+    paths: Iterable[Path], out_path: Path, quiet: bool = False
+) -> tuple[np.memmap, list[tuple[Path, str]]]:
+    """Concatenates the normalized track embeddings of many videos into a
+    float16 array memory-mapped from ``out_path``."""
+    paths = list(paths)
+    tracks = []
+    dim = None
+    # Videos without faces have no rows, and their embeddings may not have
+    # the size of the others
+    nonempty_paths = []
+    for path in tqdm(
+        paths,
+        desc="Reading track embeddings",
+        leave=False,
+        disable=quiet,
+        dynamic_ncols=True,
+    ):
+        face_ids, embs = load_track_embeddings(path)
+        if len(face_ids) == 0:
+            continue
+        dim = embs.shape[1]
+        nonempty_paths.append(path)
+        tracks.extend((path, face_id) for face_id in face_ids)
+    if dim is None:
+        raise ValueError("No track embeddings found")
+
+    out = np.lib.format.open_memmap(
+        out_path, mode="w+", dtype=np.float16, shape=(len(tracks), dim)
+    )
+    row = 0
+    for path in nonempty_paths:
+        _, embs = load_track_embeddings(path)
+        embs = embs.astype(np.float32)
+        norms = np.linalg.norm(embs, axis=1, keepdims=True)
+        out[row : row + len(embs)] = embs / np.maximum(norms, 1e-12)
+        row += len(embs)
+    out.flush()
+    return out, tracks
+
+
+def _exact_knn(
+    embs: np.ndarray, k: int, block_size: int, quiet: bool
+) -> tuple[np.ndarray, np.ndarray]:
+    num_embs = len(embs)
+    neighbors = np.empty((num_embs, k), dtype=np.int64)
+    distances = np.empty((num_embs, k), dtype=np.float32)
+    for start in tqdm(
+        range(0, num_embs, block_size),
+        desc="Building kNN graph",
+        leave=False,
+        disable=quiet,
+        dynamic_ncols=True,
+    ):
+        rows = np.asarray(embs[start : start + block_size], dtype=np.float32)
+        best_idx = np.empty((len(rows), 0), dtype=np.int64)
+        best_dist = np.empty((len(rows), 0), dtype=np.float32)
+        for col_start in range(0, num_embs, block_size):
+            cols = np.asarray(
+                embs[col_start : col_start + block_size], dtype=np.float32
+            )
+            dist = 1 - rows @ cols.T
+            idx = np.broadcast_to(
+                np.arange(col_start, col_start + len(cols)), dist.shape
+            )
+            # Keep the running top-k of each row
+            cand_dist = np.concatenate([best_dist, dist], axis=1)
+            cand_idx = np.concatenate([best_idx, idx], axis=1)
+            num_best = min(k, cand_dist.shape[1])
+            top = np.argpartition(cand_dist, num_best - 1, axis=1)[:, :num_best]
+            best_dist = np.take_along_axis(cand_dist, top, axis=1)
+            best_idx = np.take_along_axis(cand_idx, top, axis=1)
+        neighbors[start : start + len(rows)] = best_idx
+        distances[start : start + len(rows)] = best_dist
+    return neighbors, distances
+
+
+def _ann_knn(
+    embs: np.ndarray, k: int, block_size: int, quiet: bool
+) -> tuple[np.ndarray, np.ndarray]:
+    try:
+        import hnswlib
+    except ImportError as e:
+        raise ImportError(
+            "hnswlib is required for ANN clustering: "
+            "pip install video-face-tracking[ann]"
+        ) from e
+
+    num_embs, dim = embs.shape
+    index = hnswlib.Index(space="cosine", dim=dim)
+    index.init_index(max_elements=num_embs, ef_construction=200, M=16)
+    index.set_ef(max(2 * k, 64))
+    blocks = range(0, num_embs, block_size)
+    for start in tqdm(
+        blocks,
+        desc="Building ANN index",
+        leave=False,
+        disable=quiet,
+        dynamic_ncols=True,
+    ):
+        block = np.asarray(embs[start : start + block_size], dtype=np.float32)
+        index.add_items(block, np.arange(start, start + len(block)))
+
+    neighbors = np.empty((num_embs, k), dtype=np.int64)
+    distances = np.empty((num_embs, k), dtype=np.float32)
+    for start in tqdm(
+        blocks,
+        desc="Building kNN graph",
+        leave=False,
+        disable=quiet,
+        dynamic_ncols=True,
+    ):
+        block = np.asarray(embs[start : start + block_size], dtype=np.float32)
+        labels, dist = index.knn_query(block, k=k)
+        neighbors[start : start + len(block)] = labels
+        distances[start : start + len(block)] = dist
+    return neighbors, distances
+
+
+def knn_graph(
+    embs: np.ndarray,
+    k: int = 10,
+    method: str = "exact",
+    block_size: int = 4096,
+    quiet: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the indices and cosine distances of the k nearest neighbours of
+    each row of ``embs``, which must be normalized. Rows are read in blocks, so
+    ``embs`` can be a memory-mapped array larger than the available RAM."""
+    k = min(k, len(embs))
+    if method == "exact":
+        return _exact_knn(embs, k, block_size, quiet)
+    if method == "ann":
+        return _ann_knn(embs, k, block_size, quiet)
+    raise ValueError(f"Unknown clustering method: {method} ({CLUSTER_METHODS})")
+
+
+def cluster_embeddings(
+    embs: np.ndarray,
+    dist_thresh: float = 0.5,
+    k: int = 10,
+    method: str = "exact",
+    block_size: int = 4096,
+    quiet: bool = False,
+) -> np.ndarray:
+    """Clusters embeddings as the connected components of their kNN graph,
+    keeping only the edges with a cosine distance below ``dist_thresh``.
+    Cluster labels are sorted by cluster size in descending order."""
+    # scipy.sparse is slow to import and only needed here
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    neighbors, distances = knn_graph(embs, k, method, block_size, quiet)
+    rows, cols = np.nonzero(distances < dist_thresh)
+    num_embs = len(embs)
+    graph = coo_matrix(
+        (
+            np.ones(len(rows), dtype=np.int8),
+            (rows, neighbors[rows, cols]),
+        ),
+        shape=(num_embs, num_embs),
+    )
+    _, labels = connected_components(graph, directed=False)
+
+    sizes = np.bincount(labels)
+    order = np.argsort(-sizes, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[labels]
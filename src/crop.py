@@ -0,0 +1,107 @@
+from pathlib import Path
+from typing import Any
+
+import cv2
+import numpy as np
+
+from .image import align_bbox, crop_image, expand_bbox, resize_image
+from .quality import CropSelector, face_quality
+
+__all__ = ["CropSink", "crop_face", "save_crop"]
+
+
+def crop_face(
+    frame: np.ndarray,
+    frame_anns: dict[str, Any],
+    crop_size: int | None,
+    bbox_scale: float,
+    align: bool,
+) -> np.ndarray:
+    bbox = np.array(frame_anns["bbox"])
+    if align:
+        new_center = (
+            frame_anns["landmarks"][4],
+            frame_anns["landmarks"][5],
+        )
+        bbox = align_bbox(bbox, new_center)
+    bbox = expand_bbox(bbox, bbox_scale)
+    crop = crop_image(frame, bbox)
+    if crop_size is not None:
+        crop = resize_image(crop, crop_size)
+    return crop
+
+
+def save_crop(
+    out_dir: Path, face_idx: str, frame_idx: int, crop: np.ndarray
+) -> Path:
+    face_dir = out_dir / face_idx
+    face_dir.mkdir(exist_ok=True)
+    crop_path = face_dir / f"{frame_idx:06d}.png"
+    cv2.imwrite(str(crop_path), crop)
+    return crop_path
+
+
+class CropSink:
+    """Crops the annotated faces of each frame while it is in memory.
+
+    Called with the index of each frame, the frame and its annotations
+    ({face_id: annotations}). With ``top_k`` or ``every_n``, crops are
+    selected by quality as in ``CropSelector``. If ``score`` is True or crops
+    are selected, the quality of each face is added to its annotations.
+    Remaining crops are saved by ``close``.
+    """
+
+    def __init__(
+        self,
+        out_dir: Path,
+        crop_size: int | None = None,
+        bbox_scale: float = 1.3,
+        align: bool = False,
+        top_k: int | None = None,
+        every_n: int | None = None,
+        score: bool = False,
+    ) -> None:
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.crop_size = crop_size
+        self.bbox_scale = bbox_scale
+        self.align = align
+        self.selector = None
+        if top_k is not None or every_n is not None:
+            self.selector = CropSelector(top_k, every_n)
+        self.score = score or self.selector is not None
+
+    def __call__(
+        self,
+        frame_idx: int,
+        frame: np.ndarray,
+        frame_anns: dict[str, dict[str, Any]],
+    ) -> None:
+        if len(frame_anns) == 0:
+            return
+        if self.score:
+            scores = face_quality(
+                frame,
+                [x["bbox"] for x in frame_anns.values()],
+                [x["prob"] for x in frame_anns.values()],
+                [x["landmarks"] for x in frame_anns.values()],
+            )
+            for x, score in zip(frame_anns.values(), scores):
+                x["quality"] = round(float(score), 4)
+
+        for face_idx, face_anns in frame_anns.items():
+            crop = crop_face(
+                frame, face_anns, self.crop_size, self.bbox_scale, self.align
+            )
+            if self.selector is None:
+                save_crop(self.out_dir, face_idx, frame_idx, crop)
+                continue
+            for ready in self.selector.add(
+                face_idx, frame_idx, face_anns["quality"], crop
+            ):
+                save_crop(self.out_dir, *ready)
+
+    def close(self) -> None:
+        if self.selector is not None:
+            for ready in self.selector.flush():
+                save_crop(self.out_dir, *ready)
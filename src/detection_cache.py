@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Sequence
+
+import numpy as np
+
+from .detections import Detections
+
+__all__ = ["DetectionCache", "video_hash"]
+
+CACHE_VERSION = 1
+
+
+def video_hash(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    """Fingerprint of a video file from its size and its first and last
+    chunks, which avoids reading multi-GB files entirely."""
+    path = Path(path)
+    size = path.stat().st_size
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as video_file:
+        digest.update(video_file.read(chunk_size))
+        if size > chunk_size:
+            video_file.seek(max(chunk_size, size - chunk_size))
+            digest.update(video_file.read(chunk_size))
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """Stores the raw per-frame detections of each video in a npz file.
+
+    Detections of all frames are concatenated into flat arrays and indexed
+    with frame offsets. Embeddings are stored as float16 to halve the size of
+    the cache files. Other ``options`` that change the detections (e.g., the
+    frame stride) are part of the cache key, unless they are None.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | Path,
+        model_name: str,
+        det_size: tuple[int, int] | str,
+        **options: Any,
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.model_name = model_name
+        self.det_size = det_size
+        self.options = {
+            name: value
+            for name, value in sorted(options.items())
+            if value is not None
+        }
+
+    def get_path(self, video_path: str | Path) -> Path:
+        if isinstance(self.det_size, str):
+            det_size = self.det_size
+        else:
+            det_size = "x".join(str(x) for x in self.det_size)
+        key = f"{video_hash(video_path)}_{self.model_name}_{det_size}"
+        for name, value in self.options.items():
+            key = f"{key}_{name}{value}"
+        return self.cache_dir / f"{key}.npz"
+
+    def load(
+        self, video_path: str | Path, max_frames: int | None = None
+    ) -> tuple[list[Detections], dict[str, Any]] | None:
+        cache_path = self.get_path(video_path)
+        if not cache_path.exists():
+            return None
+
+        with np.load(cache_path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["version"] != CACHE_VERSION:
+                return None
+            cached_max_frames = meta["max_frames"]
+            if cached_max_frames is not None and (
+                max_frames is None or max_frames > cached_max_frames
+            ):
+                return None
+
+            offsets = data["frame_offsets"]
+            bbox = data["bbox"]
+            prob = data["prob"]
+            landmarks = data["landmarks"]
+            embedding = data["embedding"].astype(np.float32)
+
+        num_frames = len(offsets) - 1
+        if max_frames is not None:
+            num_frames = min(num_frames, max_frames)
+        detections = [
+            Detections(
+                bbox=bbox[start:end],
+                prob=prob[start:end],
+                landmarks=landmarks[start:end],
+                embedding=embedding[start:end],
+            )
+            for start, end in zip(
+                offsets[:num_frames], offsets[1 : num_frames + 1]
+            )
+        ]
+        return detections, meta
+
+    def save(
+        self,
+        video_path: str | Path,
+        detections: Sequence[Detections],
+        max_frames: int | None = None,
+        **meta: Any,
+    ) -> Path:
+        cache_path = self.get_path(video_path)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        counts = [len(frame_detections.prob) for frame_detections in detections]
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        emb_dim = max(
+            (x.embedding.shape[1] for x in detections if len(x.prob) > 0),
+            default=0,
+        )
+
+        def concat(key: str, shape: tuple[int, ...], dtype: type) -> np.ndarray:
+            arrays = [
+                getattr(x, key) for x in detections if len(x.prob) > 0
+            ]
+            if len(arrays) == 0:
+                return np.empty((0, *shape), dtype=dtype)
+            return np.concatenate(arrays).astype(dtype)
+
+        meta = {
+            "version": CACHE_VERSION,
+            "video": str(video_path),
+            "model": self.model_name,
+            "det_size": self.det_size,
+            "max_frames": max_frames,
+            "options": self.options,
+            **meta,
+        }
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as cache_file:
+            np.savez(
+                cache_file,
+                meta=np.array(json.dumps(meta)),
+                frame_offsets=offsets,
+                bbox=concat("bbox", (4,), np.float32),
+                prob=concat("prob", (), np.float32),
+                landmarks=concat("landmarks", (10,), np.float32),
+                embedding=concat("embedding", (emb_dim,), np.float16),
+            )
+        os.replace(tmp_path, cache_path)
+        return cache_path
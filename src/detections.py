@@ -0,0 +1,23 @@
+from typing import NamedTuple
+
+import numpy as np
+
+__all__ = ["Detections"]
+
+
+class Detections(NamedTuple):
+    """Raw detections of a single frame"""
+
+    bbox: np.ndarray
+    prob: np.ndarray
+    landmarks: np.ndarray
+    embedding: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "Detections":
+        return cls(
+            bbox=np.empty((0, 4), dtype=np.float32),
+            prob=np.empty((0,), dtype=np.float32),
+            landmarks=np.empty((0, 10), dtype=np.float32),
+            embedding=np.empty((0, 0), dtype=np.float32),
+        )
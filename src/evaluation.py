@@ -0,0 +1,324 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import time
+from typing import Any, Sequence
+
+import numpy as np
+
+from .detections import Detections
+from .face_tracker import FaceAnnotation, FaceTracker
+
+__all__ = [
+    "box_iou",
+    "evaluate_tracks",
+    "pareto_front",
+    "sweep",
+    "track_detections",
+]
+
+DETECT_PARAMS = ("frame_stride", "static_thresh")
+
+TRACK_PARAMS = (
+    "det_thresh",
+    "box_disp_thresh",
+    "cos_sim_thresh",
+    "min_hits",
+    "max_box_age",
+    "max_age",
+)
+
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    boxes_a = boxes_a.reshape(-1, 4)
+    boxes_b = boxes_b.reshape(-1, 4)
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def _group_by_frame(
+    face_anns: dict[str, FaceAnnotation], num_frames: int | None
+) -> dict[int, tuple[list[str], np.ndarray]]:
+    frames = {}
+    for face_id, face_ann in face_anns.items():
+        for frame_key, frame_ann in face_ann.items():
+            frame_idx = int(frame_key)
+            if num_frames is not None and frame_idx >= num_frames:
+                continue
+            frames.setdefault(frame_idx, []).append(
+                (face_id, frame_ann["bbox"])
+            )
+    return {
+        frame_idx: (
+            [face_id for face_id, _ in faces],
+            np.array([bbox for _, bbox in faces], dtype=np.float64),
+        )
+        for frame_idx, faces in frames.items()
+    }
+
+
+def evaluate_tracks(
+    pred_anns: dict[str, FaceAnnotation],
+    gt_anns: dict[str, FaceAnnotation],
+    iou_thresh: float = 0.5,
+    num_frames: int | None = None,
+) -> dict[str, float]:
+    """Computes CLEAR MOT (MOTA, ID switches) and IDF1 scores.
+
+    Both inputs follow the annotation format written by detect_faces.py.
+    Ground truth frames beyond ``num_frames`` are ignored, so that runs with
+    ``max_frames`` are not penalized for the unprocessed part of the video.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    pred_frames = _group_by_frame(pred_anns, num_frames)
+    gt_frames = _group_by_frame(gt_anns, num_frames)
+
+    gt_ids = {face_id: idx for idx, face_id in enumerate(gt_anns)}
+    pred_ids = {face_id: idx for idx, face_id in enumerate(pred_anns)}
+    id_overlap = np.zeros((len(gt_ids), len(pred_ids)), dtype=np.int64)
+
+    num_gt = num_pred = num_matches = 0
+    num_fp = num_fn = num_switches = 0
+    last_match = {}
+    empty = ([], np.empty((0, 4)))
+    for frame_idx in sorted(set(pred_frames) | set(gt_frames)):
+        frame_gt_ids, gt_boxes = gt_frames.get(frame_idx, empty)
+        frame_pred_ids, pred_boxes = pred_frames.get(frame_idx, empty)
+        num_gt += len(frame_gt_ids)
+        num_pred += len(frame_pred_ids)
+        if len(frame_gt_ids) == 0 or len(frame_pred_ids) == 0:
+            num_fn += len(frame_gt_ids)
+            num_fp += len(frame_pred_ids)
+            continue
+
+        iou = box_iou(gt_boxes, pred_boxes)
+        valid = iou >= iou_thresh
+        gt_rows, pred_cols = np.nonzero(valid)
+        np.add.at(
+            id_overlap,
+            (
+                [gt_ids[frame_gt_ids[i]] for i in gt_rows],
+                [pred_ids[frame_pred_ids[j]] for j in pred_cols],
+            ),
+            1,
+        )
+
+        # Keep the correspondences of the previous frame whenever they are
+        # still valid, and solve the assignment for the rest
+        cost = 1 - iou
+        for i, gt_id in enumerate(frame_gt_ids):
+            prev_pred = last_match.get(gt_id)
+            if prev_pred in frame_pred_ids:
+                j = frame_pred_ids.index(prev_pred)
+                if valid[i, j]:
+                    cost[i, j] = -1.0
+        cost[~valid] = 2.0
+        rows, cols = linear_sum_assignment(cost)
+        matches = [(i, j) for i, j in zip(rows, cols) if valid[i, j]]
+
+        for i, j in matches:
+            gt_id = frame_gt_ids[i]
+            pred_id = frame_pred_ids[j]
+            if gt_id in last_match and last_match[gt_id] != pred_id:
+                num_switches += 1
+            last_match[gt_id] = pred_id
+        num_matches += len(matches)
+        num_fn += len(frame_gt_ids) - len(matches)
+        num_fp += len(frame_pred_ids) - len(matches)
+
+    rows, cols = linear_sum_assignment(-id_overlap)
+    idtp = int(id_overlap[rows, cols].sum())
+
+    mota = 1 - (num_fn + num_fp + num_switches) / max(num_gt, 1)
+    idf1 = 2 * idtp / max(num_gt + num_pred, 1)
+    return {
+        "mota": mota,
+        "idf1": idf1,
+        "id_switches": num_switches,
+        "idtp": idtp,
+        "false_positives": num_fp,
+        "false_negatives": num_fn,
+        "matches": num_matches,
+        "num_gt": num_gt,
+        "num_pred": num_pred,
+        "num_gt_ids": len(gt_ids),
+        "num_pred_ids": len(pred_ids),
+    }
+
+
+def track_detections(
+    detections: Sequence[Detections],
+    cuts: list[int] | None = None,
+    frame_stride: int = 1,
+    reid_index: str = "brute_force",
+    det_thresh: float = 0.7,
+    box_disp_thresh: float = 0.3,
+    cos_sim_thresh: float = 0.5,
+    min_hits: int = 1,
+    max_box_age: int | None = None,
+    max_age: int | None = None,
+) -> tuple[dict[str, FaceAnnotation], float]:
+    """Tracks cached detections with ``FaceTracker.track``, so the results
+    are those of detect_faces.py with the same parameters. ``cuts`` and
+    ``frame_stride`` must be those the detections were computed with."""
+    face_tracker = FaceTracker(
+        det_thresh=det_thresh,
+        box_disp_thresh=box_disp_thresh,
+        cos_sim_thresh=cos_sim_thresh,
+        quiet=True,
+        min_hits=min_hits,
+        max_box_age=max_box_age,
+        max_age=max_age,
+        reid_index=reid_index,
+        frame_stride=frame_stride,
+    )
+    start = time.perf_counter()
+    face_anns = face_tracker.track(detections, cuts)
+    elapsed = time.perf_counter() - start
+    return face_anns, elapsed
+
+
+# Videos shared with the sweep workers, keyed by their detection parameters
+# and set once per worker process
+_sweep_videos = {}
+
+
+def _init_sweep_worker(
+    videos: dict[tuple, list[tuple[list[Detections], list[int], Any]]]
+) -> None:
+    global _sweep_videos
+    _sweep_videos = videos
+
+
+def _detect_key(params: dict[str, Any]) -> tuple:
+    return (params.get("frame_stride", 1), params.get("static_thresh"))
+
+
+def _run_sweep_point(
+    params: dict[str, float], iou_thresh: float, options: dict[str, Any]
+) -> dict[str, float]:
+    track_params = {
+        key: value for key, value in params.items() if key in TRACK_PARAMS
+    }
+    frame_stride = params.get("frame_stride", 1)
+    totals = {}
+    num_frames = 0
+    track_time = 0.0
+    for detections, cuts, gt_anns in _sweep_videos[_detect_key(params)]:
+        pred_anns, elapsed = track_detections(
+            detections,
+            cuts,
+            frame_stride=frame_stride,
+            **options,
+            **track_params,
+        )
+        scores = evaluate_tracks(
+            pred_anns, gt_anns, iou_thresh, num_frames=len(detections)
+        )
+        for key, value in scores.items():
+            totals[key] = totals.get(key, 0) + value
+        num_frames += len(detections)
+        track_time += elapsed
+
+    num_gt = max(totals["num_gt"], 1)
+    result = dict(params)
+    result["mota"] = 1 - (
+        totals["false_negatives"]
+        + totals["false_positives"]
+        + totals["id_switches"]
+    ) / num_gt
+    result["idf1"] = 2 * totals["idtp"] / max(
+        totals["num_gt"] + totals["num_pred"], 1
+    )
+    result["id_switches"] = totals["id_switches"]
+    result["track_fps"] = num_frames / max(track_time, 1e-9)
+    return result
+
+
+def sweep(
+    videos: dict[
+        tuple,
+        list[tuple[list[Detections], list[int], dict[str, FaceAnnotation]]],
+    ],
+    grid: dict[str, Sequence[float]],
+    detect_fps: dict[tuple, float] | None = None,
+    iou_thresh: float = 0.5,
+    workers: int | None = None,
+    reid_index: str = "brute_force",
+) -> list[dict[str, float]]:
+    """Runs the tracking stage for every point of a parameter grid.
+
+    ``videos`` maps each ``(frame_stride, static_thresh)`` pair of the grid
+    to the detections, scene cuts and ground truth of every video, computed
+    once with those options and shared by all the grid points, which are
+    evaluated in parallel worker processes. If ``detect_fps`` maps the same
+    pairs to the detection throughput, the end-to-end throughput of each
+    configuration is also reported.
+    """
+    for key in grid:
+        if key not in DETECT_PARAMS and key not in TRACK_PARAMS:
+            raise ValueError(
+                f"Unknown sweep parameter: {key} "
+                f"({DETECT_PARAMS + TRACK_PARAMS})"
+            )
+    options = {"reid_index": reid_index}
+    keys = list(grid)
+    points = [
+        dict(zip(keys, values))
+        for values in itertools.product(*(grid[key] for key in keys))
+    ]
+    for point in points:
+        if _detect_key(point) not in videos:
+            raise ValueError(
+                f"No detections for frame_stride={_detect_key(point)[0]}, "
+                f"static_thresh={_detect_key(point)[1]}"
+            )
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_sweep_worker,
+        initargs=(videos,),
+    ) as executor:
+        results = list(
+            executor.map(
+                _run_sweep_point,
+                points,
+                itertools.repeat(iou_thresh),
+                itertools.repeat(options),
+            )
+        )
+
+    for result in results:
+        if detect_fps is not None:
+            result["fps"] = 1 / (
+                1 / detect_fps[_detect_key(result)] + 1 / result["track_fps"]
+            )
+        else:
+            result["fps"] = result["track_fps"]
+    return results
+
+
+def pareto_front(
+    results: list[dict[str, float]],
+    accuracy_key: str = "idf1",
+    speed_key: str = "fps",
+) -> list[dict[str, float]]:
+    """Returns the configurations not dominated in speed and accuracy, from
+    fastest to slowest."""
+    ordered = sorted(
+        results, key=lambda x: (-x[speed_key], -x[accuracy_key])
+    )
+    front = []
+    best_accuracy = -np.inf
+    for result in ordered:
+        if result[accuracy_key] > best_accuracy:
+            front.append(result)
+            best_accuracy = result[accuracy_key]
+    return front
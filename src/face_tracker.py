@@ -1,34 +1,188 @@
-from typing import Any
+import copy
+from enum import Enum
+from pathlib import Path
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator
 
-from insightface.app import FaceAnalysis
 import numpy as np
 from tqdm import tqdm
 
-from .video import Video
+from .detection_cache import DetectionCache
+from .detections import Detections
+from .similarity_index import create_index
+from .tiling import TileDetector
+from .video import LiveStream, SceneDetector, Video, read_frames
 
-__all__ = ["FaceTracker"]
+if TYPE_CHECKING:
+    from insightface.app import FaceAnalysis
+
+__all__ = [
+    "Detections",
+    "FaceMatcher",
+    "FaceTracker",
+    "FrameSampler",
+    "TrackState",
+]
 
 FaceAnnotation = dict[str, dict[str, Any]]
 
+# Candidate detector input sizes for the adaptive mode
+DET_SIZES = (320, 480, 640, 960, 1280)
+
+
+class TrackState(Enum):
+    TENTATIVE = "tentative"
+    ACTIVE = "active"
+    LOST = "lost"
+    ARCHIVED = "archived"
+
 
 class FaceEmbeddings:
-    """Utility class to store face embeddings"""
+    """Utility class to store face embeddings and the state of each track.
+
+    Tracks start as tentative and become active after ``min_hits``
+    detections. A track not seen for more than ``max_box_age`` frames is lost
+    and no longer used for spatial matching (tentative tracks are dropped
+    instead), and a track not seen for more than ``max_age`` frames is
+    archived: only its mean embedding is kept, in a separate similarity index
+    used for re-identification (see ``similarity_index.py``). ``FaceMatcher``
+    only annotates tracks once they are active. By default, every track is
+    active and none expires, as before tracks had states.
+    """
+
+    def __init__(
+        self,
+        min_hits: int = 1,
+        max_box_age: int | None = None,
+        max_age: int | None = None,
+        reid_index: str = "brute_force",
+    ) -> None:
+        self.min_hits = min_hits
+        self.max_box_age = max_box_age
+        self.max_age = max_age
 
-    def __init__(self) -> None:
-        self.face_embeddings = dict()
+        self.emb_sum = dict()
+        self.num_embs = dict()
         self.last_bbox = dict()
+        self.last_frame = dict()
+        self.state = dict()
+
+        self.reid_index = create_index(reid_index)
+        self.archived_norms = dict()
+        self.archived_counts = dict()
+        # Size of the embeddings, once one was added
+        self.dim = None
 
     def __len__(self) -> int:
-        return len(self.face_embeddings)
+        return len(self.emb_sum) + len(self.reid_index)
 
-    def add(self, face_id: str, bbox: np.ndarray, emb: np.ndarray) -> None:
-        self.face_embeddings.setdefault(face_id, []).append(emb)
+    def add(
+        self,
+        face_id: str,
+        bbox: np.ndarray,
+        emb: np.ndarray,
+        frame_idx: int = 0,
+    ) -> None:
+        if face_id in self.reid_index:
+            self._restore(face_id)
+        self.dim = emb.shape[-1]
+        if face_id in self.emb_sum:
+            self.emb_sum[face_id] = self.emb_sum[face_id] + emb
+            self.num_embs[face_id] += 1
+        else:
+            self.emb_sum[face_id] = emb.astype(np.float32)
+            self.num_embs[face_id] = 1
         self.last_bbox[face_id] = bbox
+        self.last_frame[face_id] = frame_idx
+        if self.num_embs[face_id] >= self.min_hits:
+            self.state[face_id] = TrackState.ACTIVE
+        else:
+            self.state[face_id] = TrackState.TENTATIVE
 
-    def get_embedding(self, face_id: str) -> np.ndarray:
-        if face_id not in self.face_embeddings:
+    def get_state(self, face_id: str) -> TrackState:
+        if face_id in self.reid_index:
+            return TrackState.ARCHIVED
+        if face_id not in self.state:
             raise RuntimeError(f"Face ID not found: {face_id}")
-        return np.mean(np.stack(self.face_embeddings[face_id]), axis=0)
+        return self.state[face_id]
+
+    def update_states(self, frame_idx: int) -> list[str]:
+        """Updates the states of the tracks not seen since ``frame_idx``, and
+        returns the IDs of the dropped tentative tracks"""
+        if self.max_age is None and self.max_box_age is None:
+            return []
+        dropped = []
+        for face_id in list(self.last_frame):
+            age = frame_idx - self.last_frame[face_id]
+            expired = self.max_age is not None and age > self.max_age
+            lost = self.max_box_age is not None and age > self.max_box_age
+            tentative = self.state[face_id] == TrackState.TENTATIVE
+            if tentative and (expired or lost):
+                self._remove(face_id)
+                dropped.append(face_id)
+            elif expired:
+                self._archive(face_id)
+            elif lost:
+                self.state[face_id] = TrackState.LOST
+        return dropped
+
+    def lose_all(self) -> list[str]:
+        """Stops the spatial matching of all the tracks, e.g., after a scene
+        cut, where boxes of consecutive frames are unrelated. Lost tracks can
+        still be re-identified by their embeddings. Returns the IDs of the
+        dropped tentative tracks."""
+        dropped = []
+        for face_id, state in list(self.state.items()):
+            if state == TrackState.TENTATIVE:
+                self._remove(face_id)
+                dropped.append(face_id)
+            else:
+                self.state[face_id] = TrackState.LOST
+        return dropped
+
+    def _remove(self, face_id: str) -> None:
+        del self.emb_sum[face_id]
+        del self.num_embs[face_id]
+        del self.last_bbox[face_id]
+        del self.last_frame[face_id]
+        del self.state[face_id]
+
+    def _archive(self, face_id: str) -> None:
+        mean_emb = self.emb_sum[face_id] / self.num_embs[face_id]
+        self.reid_index.add(face_id, mean_emb)
+        self.archived_norms[face_id] = float(np.linalg.norm(mean_emb))
+        self.archived_counts[face_id] = self.num_embs[face_id]
+        self._remove(face_id)
+
+    def _restore(self, face_id: str) -> None:
+        count = self.archived_counts.pop(face_id)
+        self.emb_sum[face_id] = self.get_embedding(face_id) * count
+        self.num_embs[face_id] = count
+        del self.archived_norms[face_id]
+        self.reid_index.remove(face_id)
+
+    def get_embedding(self, face_id: str) -> np.ndarray:
+        if face_id in self.emb_sum:
+            return self.emb_sum[face_id] / self.num_embs[face_id]
+        if face_id in self.reid_index:
+            return self.reid_index.get(face_id) * self.archived_norms[face_id]
+        raise RuntimeError(f"Face ID not found: {face_id}")
+
+    def get_centroids(self) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """Returns the mean embedding and the number of embeddings of every
+        live and archived track"""
+        face_ids = list(self.emb_sum) + list(self.archived_counts)
+        if len(face_ids) == 0:
+            embs = np.empty((0, self.dim or 0), dtype=np.float32)
+            return [], embs, np.empty((0,), int)
+        embs = np.stack([self.get_embedding(face_id) for face_id in face_ids])
+        counts = np.array(
+            [
+                self.num_embs.get(face_id) or self.archived_counts[face_id]
+                for face_id in face_ids
+            ]
+        )
+        return face_ids, embs, counts
 
     def get_cos_sim(self, face_id: str, emb: np.ndarray) -> float:
         ref_emb = self.get_embedding(face_id)
@@ -37,29 +191,188 @@ class FaceEmbeddings:
         magnitude_ref_emb = np.linalg.norm(ref_emb)
         return 1 - dot_product / (magnitude_emb * magnitude_ref_emb)
 
-    def get_closest_face(self, emb: np.ndarray) -> tuple[str, float]:
-        ref_emb = np.stack(
-            [self.get_embedding(face_id) for face_id in self.face_embeddings]
-        )
-        dot_product = np.matmul(ref_emb, emb)
+    def get_closest_face(self, emb: np.ndarray) -> tuple[str | None, float]:
+        face_id, min_dist = None, np.inf
         magnitude_emb = np.linalg.norm(emb)
-        magnitude_ref_emb = np.linalg.norm(ref_emb, axis=1)
-        cos_sim = 1 - dot_product / (magnitude_emb * magnitude_ref_emb)
-        idx_min = int(np.argmin(cos_sim))
-        face_id = list(self.face_embeddings.keys())[idx_min]
-        return face_id, cos_sim[idx_min]
 
-    def get_closest_box(self, bbox: np.ndarray) -> tuple[str, float]:
+        if len(self.emb_sum) > 0:
+            # The mean embedding and the sum have the same direction
+            ref_emb = np.stack(list(self.emb_sum.values()))
+            dot_product = np.matmul(ref_emb, emb)
+            magnitude_ref_emb = np.linalg.norm(ref_emb, axis=1)
+            cos_sim = 1 - dot_product / (magnitude_emb * magnitude_ref_emb)
+            idx_min = int(np.argmin(cos_sim))
+            face_id = list(self.emb_sum.keys())[idx_min]
+            min_dist = cos_sim[idx_min]
+
+        archived_ids, cos_sim = self.reid_index.search(emb, k=1)
+        if len(archived_ids) > 0 and cos_sim[0] < min_dist:
+            face_id = archived_ids[0]
+            min_dist = cos_sim[0]
+
+        return face_id, min_dist
+
+    def get_closest_box(self, bbox: np.ndarray) -> tuple[str | None, float]:
+        face_ids = [
+            face_id
+            for face_id, state in self.state.items()
+            if state in (TrackState.TENTATIVE, TrackState.ACTIVE)
+        ]
+        if len(face_ids) == 0:
+            return None, np.inf
         center = (bbox[:2] + bbox[2:]) / 2
-        ref_boxes = np.stack([box for box in self.last_bbox.values()])
+        ref_boxes = np.stack([self.last_bbox[face_id] for face_id in face_ids])
         ref_centers = (ref_boxes[:, :2] + ref_boxes[:, 2:]) / 2
         distances = np.linalg.norm(center[None, :] - ref_centers, axis=1)
         idx_min = int(np.argmin(distances))
-        face_id = list(self.last_bbox.keys())[idx_min]
+        face_id = face_ids[idx_min]
         min_dist = distances[idx_min] / max(bbox[[2, 3]] - bbox[[0, 1]])
         return face_id, min_dist
 
 
+class FaceMatcher:
+    """Assigns face IDs to the detections of consecutive frames.
+
+    If ``keep_annotations`` is False, the annotations of each frame are only
+    returned by ``update``, so that memory does not grow on endless streams.
+    """
+
+    def __init__(
+        self,
+        det_thresh: float = 0.7,
+        box_disp_thresh: float = 0.3,
+        cos_sim_thresh: float = 0.5,
+        min_hits: int = 1,
+        max_box_age: int | None = None,
+        max_age: int | None = None,
+        reid_index: str = "brute_force",
+        keep_annotations: bool = True,
+    ) -> None:
+        self.det_thresh = det_thresh
+        self.box_disp_thresh = box_disp_thresh
+        self.cos_sim_thresh = cos_sim_thresh
+        self.keep_annotations = keep_annotations
+
+        self.face_anns = {}
+        # Annotations of the tentative tracks, only added to ``face_anns``
+        # when they become active
+        self.pending_anns = {}
+        self.num_faces = 0
+        self.face_emb = FaceEmbeddings(
+            min_hits=min_hits,
+            max_box_age=max_box_age,
+            max_age=max_age,
+            reid_index=reid_index,
+        )
+
+    def _get_box_size(self, bbox: list[int]) -> float:
+        x1, y1, x2, y2 = bbox
+        return (x2 - x1) * (y2 - y1)
+
+    def _match(self, bbox: np.ndarray, emb: np.ndarray) -> str | None:
+        box_class, box_dist = self.face_emb.get_closest_box(bbox)
+        if (
+            box_dist < self.box_disp_thresh
+            and self.face_emb.get_cos_sim(box_class, emb)
+            < self.cos_sim_thresh * 3
+        ):
+            return box_class
+
+        face_class, emb_dist = self.face_emb.get_closest_face(emb)
+        if emb_dist < self.cos_sim_thresh:
+            return face_class
+
+        return None
+
+    def update(
+        self, frame_idx: int, detections: Detections, scene_cut: bool = False
+    ) -> dict[str, dict[str, Any]]:
+        dropped = self.face_emb.update_states(frame_idx)
+        if scene_cut:
+            dropped += self.face_emb.lose_all()
+        for face_id in dropped:
+            self.pending_anns.pop(face_id, None)
+        frame_anns = {}
+        for bbox, prob, landmarks, emb in zip(*detections):
+            if prob < self.det_thresh:
+                continue
+            face_dict = {
+                "bbox": bbox.tolist(),
+                "prob": float(prob),
+                "landmarks": landmarks.tolist(),
+            }
+
+            final_class = self._match(bbox, emb)
+            if final_class is None:
+                final_class = str(self.num_faces)
+                self.num_faces += 1
+
+            if final_class in frame_anns:
+                # Duplicated face in the frame
+                # Take the largest bbox
+                curr_box_size = self._get_box_size(
+                    frame_anns[final_class]["bbox"]
+                )
+                new_box_size = self._get_box_size(face_dict["bbox"])
+                if new_box_size > curr_box_size:
+                    frame_anns[final_class] = face_dict
+            else:
+                frame_anns[final_class] = face_dict
+
+            self.face_emb.add(final_class, bbox, emb, frame_idx)
+
+        if self.keep_annotations:
+            frame_key = str(frame_idx)
+            for face_class, face_dict in frame_anns.items():
+                state = self.face_emb.get_state(face_class)
+                if state == TrackState.TENTATIVE:
+                    face_anns = self.pending_anns.setdefault(face_class, {})
+                else:
+                    face_anns = self.face_anns.setdefault(face_class, {})
+                    face_anns.update(self.pending_anns.pop(face_class, {}))
+                face_anns[frame_key] = face_dict
+        return frame_anns
+
+
+class FrameSampler:
+    """Decides which frames of a video run the models.
+
+    Frames off the ``frame_stride`` are skipped, and their detections are
+    empty. Frames flagged as static by a ``SceneDetector`` reuse the
+    detections of the last processed frame, as long as no frame changed since
+    then. Scene cuts are appended to ``cuts``.
+    """
+
+    DETECT = "detect"
+    SKIP = "skip"
+    REUSE = "reuse"
+
+    def __init__(
+        self, frame_stride: int = 1, cuts: list[int] | None = None
+    ) -> None:
+        self.frame_stride = frame_stride
+        self.cuts = [] if cuts is None else cuts
+        self.num_reused = 0
+        self.frame_idx = 0
+        # Whether a frame changed since the last processed frame
+        self.changed = True
+
+    def __call__(self, scene_info: tuple[bool, bool] = (False, False)) -> str:
+        frame_idx = self.frame_idx
+        self.frame_idx += 1
+        is_cut, is_static = scene_info
+        if is_cut:
+            self.cuts.append(frame_idx)
+        self.changed = self.changed or not is_static
+        if frame_idx % self.frame_stride != 0:
+            return self.SKIP
+        if not self.changed:
+            self.num_reused += 1
+            return self.REUSE
+        self.changed = False
+        return self.DETECT
+
+
 class FaceTracker:
     def __init__(
         self,
@@ -68,85 +381,504 @@ class FaceTracker:
         cos_sim_thresh: float = 0.5,
         max_frames: int | None = None,
         quiet: bool = False,
+        model_name: str = "buffalo_l",
+        det_size: tuple[int, int] | str = (640, 640),
+        cache_dir: str | Path | None = None,
+        min_det_face_size: int = 24,
+        probe_frames: int = 8,
+        min_hits: int = 1,
+        max_box_age: int | None = None,
+        max_age: int | None = None,
+        reid_index: str = "brute_force",
+        frame_stride: int = 1,
+        cut_thresh: float | None = None,
+        static_thresh: float | None = None,
+        tile_size: int | None = None,
+        tile_overlap: float = 0.2,
+        tile_flagged: bool = False,
+        server: str | Path | None = None,
+        queue_size: int = 128,
     ) -> None:
+        # Client of a running inference server, which replaces the local
+        # models (see ``InferenceServer``), or None to run them locally
+        self.client = None
+        if server is not None:
+            from .server import InferenceClient
+
+            self.client = InferenceClient.connect(server)
+        if self.client is not None:
+            # Detections come from the models of the server, and so does the
+            # cache key
+            info = self.client.info
+            model_name = info["model_name"]
+            det_size = info["det_size"]
+            tile_size = info["tile_size"]
+            tile_overlap = info["tile_overlap"]
+            tile_flagged = info["tile_flagged"]
+
         self.det_thresh = det_thresh
         self.box_disp_thresh = box_disp_thresh
         self.cos_sim_thresh = cos_sim_thresh
         self.max_frames = max_frames
         self.quiet = quiet
+        self.model_name = model_name
+        self.min_det_face_size = min_det_face_size
+        self.probe_frames = probe_frames
+        self.min_hits = min_hits
+        self.max_box_age = max_box_age
+        self.max_age = max_age
+        self.reid_index = reid_index
+        # Only run the models on one of every ``frame_stride`` frames
+        self.frame_stride = frame_stride
+        # Max number of decoded frames waiting to be processed
+        self.queue_size = queue_size
+        # Scene detection thresholds, see ``SceneDetector``
+        self.cut_thresh = cut_thresh
+        self.static_thresh = static_thresh
+        # Detection in tiles of large frames, see ``TileDetector``
+        self.tiler = None
+        if tile_size is not None and self.client is None:
+            self.tiler = TileDetector(tile_size, tile_overlap, tile_flagged)
+
+        if isinstance(det_size, str) and det_size != "auto":
+            raise ValueError(f"Invalid detector size: {det_size}")
+        self.adaptive = det_size == "auto"
+        self.det_size = (640, 640) if self.adaptive else tuple(det_size)
+
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = DetectionCache(
+                cache_dir,
+                model_name,
+                det_size,
+                stride=frame_stride if frame_stride > 1 else None,
+                cut=cut_thresh,
+                static=static_thresh,
+                tile=tile_size,
+                overlap=None if tile_size is None else tile_overlap,
+                flagged=(tile_size is not None and tile_flagged) or None,
+            )
+
+        self._app = None
+        self._det_models = {}
+        # Embeddings of the tracks of the last processed video
+        self.last_face_emb = None
+        # Scene cuts of the last processed video, updated in place while it
+        # is decoded, and number of static frames that reused detections
+        self.last_cuts = []
+        self.last_num_reused = 0
+
+    def fork(self) -> "FaceTracker":
+        """Copy that shares the models and the cache, but not the state of
+        the last processed video, to track several videos at once in
+        threads. Models must be loaded before, or each copy loads its own."""
+        forked = copy.copy(self)
+        if self.client is not None:
+            # Requests of a connection are served in order
+            from .server import InferenceClient
 
-        self.app = FaceAnalysis(
-            allowed_modules=["detection", "recognition"],
-            providers=["CUDAExecutionProvider"],
+            forked.client = InferenceClient(self.client.socket_path)
+        forked.last_face_emb = None
+        forked.last_cuts = []
+        forked.last_num_reused = 0
+        return forked
+
+    @property
+    def app(self) -> "FaceAnalysis":
+        # Models, and insightface itself, are loaded on first use, so tracking
+        # from cached detections does not pay the initialization cost
+        if self._app is None:
+            from insightface.app import FaceAnalysis
+
+            self._app = FaceAnalysis(
+                name=self.model_name,
+                allowed_modules=["detection", "recognition"],
+                providers=["CUDAExecutionProvider"],
+            )
+            self._app.prepare(ctx_id=0, det_size=self.det_size)
+            self._det_models[self.det_size] = self._app.det_model
+        return self._app
+
+    def set_det_size(self, det_size: tuple[int, int]) -> None:
+        det_size = tuple(det_size)
+        app = self.app
+        if det_size not in self._det_models:
+            # Shallow copies share the ONNX session, so each detector input
+            # size is prepared once and switching between them is free
+            det_model = copy.copy(app.det_model)
+            det_model.prepare(ctx_id=0, input_size=det_size)
+            self._det_models[det_size] = det_model
+        app.det_model = app.models["detection"] = self._det_models[det_size]
+        self.det_size = det_size
+
+    def select_det_size(self, filename: str) -> tuple[int, int]:
+        """Chooses the smallest detector input size that keeps the smallest
+        face of a few sampled frames above ``min_det_face_size`` pixels."""
+        video = Video(filename, max_frames=self.max_frames)
+        num_frames = video.num_frames
+        frame_side = max(video.width, video.heigh)
+        video.stream.release()
+        indices = np.linspace(
+            0, max(num_frames - 1, 0), self.probe_frames
+        ).astype(int)
+        frames = read_frames(filename, np.unique(indices))
+
+        self.set_det_size((DET_SIZES[-1], DET_SIZES[-1]))
+        face_sides = []
+        for frame in frames:
+            detections = self.detect(frame)
+            valid = detections.prob >= self.det_thresh
+            bbox = detections.bbox[valid]
+            face_sides.extend(
+                np.minimum(bbox[:, 2] - bbox[:, 0], bbox[:, 3] - bbox[:, 1])
+            )
+        if len(face_sides) == 0:
+            return DET_SIZES[0], DET_SIZES[0]
+
+        min_face_side = max(float(min(face_sides)), 1.0)
+        required_size = self.min_det_face_size * frame_side / min_face_side
+        for size in DET_SIZES:
+            if size >= required_size:
+                return size, size
+        return DET_SIZES[-1], DET_SIZES[-1]
+
+    def detect_faces(
+        self, image: np.ndarray, input_size: tuple[int, int] | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the bounding boxes with their scores (N, 5) and the
+        landmarks (N, 5, 2) of the faces in an image"""
+        return self.app.det_model.detect(
+            image, input_size=input_size, max_num=0, metric="default"
         )
-        self.app.prepare(ctx_id=0, det_size=(640, 640))
 
-    def _get_box_size(self, bbox: list[int]) -> float:
-        x1, y1, x2, y2 = bbox
-        return (x2 - x1) * (y2 - y1)
+    def align_faces(
+        self, frame: np.ndarray, landmarks: np.ndarray
+    ) -> list[np.ndarray]:
+        """Crops of the faces of a frame aligned for the recognition model"""
+        from insightface.utils import face_align
+
+        rec_model = self.app.models["recognition"]
+        return [
+            face_align.norm_crop(
+                frame, landmark=kps, image_size=rec_model.input_size[0]
+            )
+            for kps in landmarks
+        ]
+
+    def embed(self, crops: list[np.ndarray]) -> np.ndarray:
+        if len(crops) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        return self.app.models["recognition"].get_feat(crops)
+
+    def recognize(self, frame: np.ndarray, landmarks: np.ndarray) -> np.ndarray:
+        """Computes the embeddings of all the faces of a frame in one batch"""
+        if len(landmarks) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        return self.embed(self.align_faces(frame, landmarks))
 
-    def __call__(self, filename: str) -> dict[str, FaceAnnotation]:
-        face_anns = {}
-        face_emb = FaceEmbeddings()
-        with Video(filename, max_frames=self.max_frames) as video:
-            for frame_idx in tqdm(
+    def find_faces(self, frame: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Same as ``detect_faces``, adding the faces found in tiles"""
+        bboxes, landmarks = self.detect_faces(frame)
+        if self.tiler is not None:
+            bboxes, landmarks = self.tiler(
+                self.detect_faces, frame, bboxes, landmarks
+            )
+        return bboxes, landmarks
+
+    def detect(self, frame: np.ndarray) -> Detections:
+        if self.client is not None:
+            return self.client.detect(frame)
+        bboxes, landmarks = self.find_faces(frame)
+        return Detections(
+            bbox=bboxes[:, :4],
+            prob=bboxes[:, 4],
+            landmarks=landmarks.reshape(-1, 10),
+            embedding=self.recognize(frame, landmarks),
+        )
+
+    def detect_batch(self, frames: list[np.ndarray]) -> list[Detections]:
+        """Same as ``detect`` on several frames, but the faces of all of them
+        are embedded in one batch of the recognition model"""
+        faces = [self.find_faces(frame) for frame in frames]
+        crops = []
+        for frame, (_, landmarks) in zip(frames, faces):
+            crops.extend(self.align_faces(frame, landmarks))
+        embeddings = self.embed(crops)
+
+        detections = []
+        start = 0
+        for bboxes, landmarks in faces:
+            end = start + len(bboxes)
+            detections.append(
+                Detections(
+                    bbox=bboxes[:, :4],
+                    prob=bboxes[:, 4],
+                    landmarks=landmarks.reshape(-1, 10),
+                    embedding=(
+                        embeddings[start:end]
+                        if end > start
+                        else np.empty((0, 0), dtype=np.float32)
+                    ),
+                )
+            )
+            start = end
+        return detections
+
+    def create_scene_detector(self) -> SceneDetector | None:
+        if self.cut_thresh is None and self.static_thresh is None:
+            return None
+        return SceneDetector(self.cut_thresh, self.static_thresh)
+
+    def create_sampler(self) -> FrameSampler:
+        self.last_cuts.clear()
+        self.last_num_reused = 0
+        return FrameSampler(self.frame_stride, self.last_cuts)
+
+    def detect_frames(
+        self, filename: str
+    ) -> Iterator[tuple[np.ndarray, Detections]]:
+        """Yields every decoded frame of a video with its detections"""
+        if self.adaptive:
+            self.set_det_size(self.select_det_size(filename))
+        sampler = self.create_sampler()
+        last_detections = Detections.empty()
+        with Video(
+            filename,
+            queue_size=self.queue_size,
+            max_frames=self.max_frames,
+            scene_detector=self.create_scene_detector(),
+        ) as video:
+            for _ in tqdm(
                 range(video.num_frames),
                 desc="Processing video",
                 leave=False,
                 disable=self.quiet,
                 dynamic_ncols=True,
             ):
+                # Skipped frames must still be decoded
                 frame = video.read()
-                faces = self.app.get(frame)
-                for face_idx, face in enumerate(faces):
-                    if face.det_score < self.det_thresh:
-                        continue
-                    face_dict = {
-                        "bbox": face.bbox.tolist(),
-                        "prob": float(face.det_score),
-                        "landmarks": face.kps.flatten().tolist(),
-                    }
-
-                    if len(face_emb) == 0:
-                        final_class = str(face_idx)
-                        face_anns[final_class] = {str(frame_idx): face_dict}
-                    else:
-                        final_class = None
-                        box_class, box_dist = face_emb.get_closest_box(
-                            face.bbox
-                        )
-                        if (
-                            box_dist < self.box_disp_thresh
-                            and face_emb.get_cos_sim(box_class, face.embedding)
-                            < self.cos_sim_thresh * 3
-                        ):
-                            final_class = box_class
-
-                        if final_class is None:
-                            face_class, emb_dist = face_emb.get_closest_face(
-                                face.embedding
-                            )
-                            if emb_dist < self.cos_sim_thresh:
-                                final_class = face_class
-
-                        if final_class is None:
-                            final_class = str(len(face_anns))
-
-                        if final_class not in face_anns:
-                            face_anns[final_class] = {}
-
-                        frame_key = str(frame_idx)
-                        if frame_key in face_anns[final_class]:
-                            # Duplicated face in the frame
-                            # Take the largest bbox
-                            curr_box = face_anns[final_class][frame_key]["bbox"]
-                            curr_box_size = self._get_box_size(curr_box)
-                            new_box_size = self._get_box_size(face_dict["bbox"])
-                            if new_box_size > curr_box_size:
-                                face_anns[final_class][frame_key] = face_dict
-                        else:
-                            face_anns[final_class][frame_key] = face_dict
-
-                    face_emb.add(final_class, face.bbox, face.embedding)
-
-        return face_anns
+                action = sampler(video.scene_info)
+                if action == FrameSampler.SKIP:
+                    yield frame, Detections.empty()
+                elif action == FrameSampler.REUSE:
+                    yield frame, last_detections
+                else:
+                    last_detections = self.detect(frame)
+                    yield frame, last_detections
+        self.last_num_reused = sampler.num_reused
+
+    def detect_video(self, filename: str) -> Iterator[Detections]:
+        if self.client is not None:
+            # The server decodes the video, so frames are not sent to it
+            self.last_cuts.clear()
+            self.last_num_reused = yield from self.client.detect_video(
+                filename,
+                self.last_cuts,
+                max_frames=self.max_frames,
+                frame_stride=self.frame_stride,
+                cut_thresh=self.cut_thresh,
+                static_thresh=self.static_thresh,
+            )
+            return
+        for _, detections in self.detect_frames(filename):
+            yield detections
+
+    def _load_cache(
+        self, filename: str
+    ) -> tuple[list[Detections], float] | None:
+        if self.cache is None:
+            return None
+        cached = self.cache.load(filename, self.max_frames)
+        if cached is None:
+            return None
+        detections, meta = cached
+        self.last_cuts[:] = meta.get("cuts", [])
+        self.last_num_reused = meta.get("num_reused", 0)
+        return detections, meta["detect_time"]
+
+    def _save_cache(
+        self, filename: str, detections: list[Detections], detect_time: float
+    ) -> None:
+        if self.cache is None:
+            return
+        self.cache.save(
+            filename,
+            detections,
+            max_frames=self.max_frames,
+            detect_time=detect_time,
+            input_size=self.det_size,
+            cuts=self.last_cuts,
+            num_reused=self.last_num_reused,
+        )
+
+    def get_detections(
+        self,
+        filename: str,
+        detect_video: Callable[[str], Iterator[Detections]] | None = None,
+    ) -> tuple[list[Detections], float]:
+        """Returns the detections of every frame and the time it took to
+        compute them, reading them from the cache when available.
+        ``detect_video`` replaces the default detection loop (e.g., with a
+        ``FacePipeline``)."""
+        if detect_video is None:
+            detect_video = self.detect_video
+        cached = self._load_cache(filename)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        detections = list(detect_video(filename))
+        detect_time = time.perf_counter() - start
+        self._save_cache(filename, detections, detect_time)
+        return detections, detect_time
+
+    def get_frames(
+        self, filename: str
+    ) -> Iterator[tuple[np.ndarray, Detections]]:
+        """Same as ``detect_frames``, but reads the detections from the cache
+        when available, so only the video is decoded, and fills the cache
+        otherwise."""
+        cached = self._load_cache(filename)
+        if cached is not None:
+            detections, _ = cached
+            with Video(
+                filename,
+                queue_size=self.queue_size,
+                max_frames=len(detections),
+            ) as video:
+                for frame_detections in tqdm(
+                    detections,
+                    desc="Processing video",
+                    leave=False,
+                    disable=self.quiet,
+                    dynamic_ncols=True,
+                ):
+                    yield video.read(), frame_detections
+            return
+
+        frames = self.detect_frames(filename)
+        detections = []
+        detect_time = 0.0
+        while True:
+            # Only measure the detection, not the work of the caller
+            start = time.perf_counter()
+            item = next(frames, None)
+            detect_time += time.perf_counter() - start
+            if item is None:
+                break
+            detections.append(item[1])
+            yield item
+        self._save_cache(filename, detections, detect_time)
+
+    def create_matcher(self, keep_annotations: bool = True) -> FaceMatcher:
+        return FaceMatcher(
+            det_thresh=self.det_thresh,
+            box_disp_thresh=self.box_disp_thresh,
+            cos_sim_thresh=self.cos_sim_thresh,
+            min_hits=self.min_hits,
+            max_box_age=self.max_box_age,
+            max_age=self.max_age,
+            reid_index=self.reid_index,
+            keep_annotations=keep_annotations,
+        )
+
+    def track(
+        self, detections: Iterable[Detections], cuts: list[int] | None = None
+    ) -> dict[str, FaceAnnotation]:
+        """Tracks the faces of the detections of every frame. ``cuts`` are the
+        sorted frames that start a new shot, and may grow while
+        ``detections`` is consumed."""
+        return self.track_frames(((None, x) for x in detections), cuts)
+
+    def track_frames(
+        self,
+        frames: Iterable[tuple[np.ndarray | None, Detections]],
+        cuts: list[int] | None = None,
+        sink: Callable[[int, np.ndarray, dict[str, Any]], None] | None = None,
+    ) -> dict[str, FaceAnnotation]:
+        """Same as ``track``, for (frame, detections) pairs. ``sink`` is
+        called with the index, the frame and the annotations of every tracked
+        frame while the frame is still in memory. Face IDs are final once
+        assigned, so the sink can write results that need the pixels (e.g.,
+        crops) without decoding the video again."""
+        cuts = [] if cuts is None else cuts
+        matcher = self.create_matcher()
+        next_cut = 0
+        scene_cut = False
+        for frame_idx, (frame, frame_detections) in enumerate(frames):
+            # Cuts in skipped frames apply to the next processed frame
+            while next_cut < len(cuts) and cuts[next_cut] <= frame_idx:
+                scene_cut = True
+                next_cut += 1
+            if frame_idx % self.frame_stride != 0:
+                continue
+            frame_anns = matcher.update(frame_idx, frame_detections, scene_cut)
+            scene_cut = False
+            if sink is not None:
+                sink(frame_idx, frame, frame_anns)
+        self.last_face_emb = matcher.face_emb
+        return matcher.face_anns
+
+    def stream(
+        self,
+        source: int | str | Iterable[np.ndarray],
+        callback: Callable[[dict[str, Any]], None] | None = None,
+        queue_size: int = 4,
+        loop: bool = False,
+        fps: float | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """Tracks faces on a live source, see ``LiveStream``.
+
+        Yields, and optionally passes to ``callback``, a dict per processed
+        frame with its index in the source, the annotations of its confirmed
+        faces (see ``min_hits``), the latency from capture to the end of
+        tracking, in seconds, and the number of frames dropped so far.
+        """
+        matcher = self.create_matcher(keep_annotations=False)
+        self.last_face_emb = matcher.face_emb
+        with LiveStream(
+            source,
+            queue_size=queue_size,
+            loop=loop,
+            max_frames=self.max_frames,
+            fps=fps,
+        ) as live_stream:
+            for frame_idx, timestamp, frame in live_stream:
+                faces = matcher.update(frame_idx, self.detect(frame))
+                # Faces of tentative tracks may be false detections, and are
+                # only reported once their track is confirmed
+                face_emb = matcher.face_emb
+                faces = {
+                    face_id: face
+                    for face_id, face in faces.items()
+                    if face_emb.get_state(face_id) == TrackState.ACTIVE
+                }
+                result = {
+                    "frame": frame_idx,
+                    "faces": faces,
+                    "latency": time.monotonic() - timestamp,
+                    "dropped": live_stream.num_dropped,
+                }
+                if callback is not None:
+                    callback(result)
+                yield result
+
+    def __call__(
+        self,
+        filename: str,
+        detect_video: Callable[[str], Iterator[Detections]] | None = None,
+        sink: Callable[[int, np.ndarray, dict[str, Any]], None] | None = None,
+    ) -> dict[str, FaceAnnotation]:
+        """Tracks the faces of a video. With ``sink``, see ``track_frames``,
+        frames are decoded by the tracker itself and ``detect_video`` is
+        ignored."""
+        if sink is not None:
+            return self.track_frames(
+                self.get_frames(filename), self.last_cuts, sink
+            )
+        if detect_video is None:
+            detect_video = self.detect_video
+        if self.cache is None:
+            return self.track(detect_video(filename), self.last_cuts)
+        detections, _ = self.get_detections(filename, detect_video)
+        return self.track(detections, self.last_cuts)
@@ -1,23 +1,226 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import fnmatch
+import json
+import os
 from pathlib import Path
-from typing import Sequence
+import re
+from typing import Callable, Iterator, NamedTuple, Sequence
 
+__all__ = ["find", "iter_files"]
 
-def find(
+FILE_LIST_CACHE_VERSION = 1
+
+
+class _DirListing(NamedTuple):
+    mtime_ns: int
+    dirs: list[str]
+    # (name, size, mtime) of each file. Size and mtime are -1 if not read
+    files: list[tuple[str, int, float]]
+
+
+def _scan_dir(path: str, with_stat: bool) -> _DirListing:
+    # Read the mtime first, so that entries added during the scan invalidate
+    # the cached listing
+    mtime_ns = os.stat(path).st_mtime_ns
+    dirs = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # DirEntry caches the file type, so this needs no stat call on
+            # most file systems
+            if entry.is_dir():
+                dirs.append(entry.name)
+            elif entry.is_file():
+                if with_stat:
+                    stat = entry.stat()
+                    files.append((entry.name, stat.st_size, stat.st_mtime))
+                else:
+                    files.append((entry.name, -1, -1))
+    return _DirListing(mtime_ns, dirs, files)
+
+
+def _compile_globs(
+    globs: str | Sequence[str] | None,
+) -> list[tuple[re.Pattern, bool]]:
+    if globs is None:
+        return []
+    if isinstance(globs, str):
+        globs = [globs]
+    # Globs without a separator match the name, others the relative path
+    return [
+        (re.compile(fnmatch.translate(glob)), "/" not in glob) for glob in globs
+    ]
+
+
+def _matches(globs: list[tuple[re.Pattern, bool]], rel_path: str) -> bool:
+    name = rel_path.rsplit("/", 1)[-1]
+    return any(
+        glob.match(name if match_name else rel_path) is not None
+        for glob, match_name in globs
+    )
+
+
+def _load_file_list_cache(path: Path) -> dict[str, _DirListing]:
+    if not path.exists():
+        return {}
+    with open(path, "r") as cache_file:
+        data = json.load(cache_file)
+    if data.get("version") != FILE_LIST_CACHE_VERSION:
+        return {}
+    return {
+        dir_path: _DirListing(
+            listing["mtime_ns"],
+            listing["dirs"],
+            [tuple(file) for file in listing["files"]],
+        )
+        for dir_path, listing in data["dirs"].items()
+    }
+
+
+def _save_file_list_cache(
+    path: Path, listings: dict[str, _DirListing]
+) -> None:
+    data = {
+        "version": FILE_LIST_CACHE_VERSION,
+        "dirs": {
+            dir_path: listing._asdict()
+            for dir_path, listing in listings.items()
+        },
+    }
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as cache_file:
+        json.dump(data, cache_file)
+    os.replace(tmp_path, path)
+
+
+def _walk(
+    list_dir: Callable[[str], _DirListing],
+    recursive: bool,
+    exclude: list[tuple[re.Pattern, bool]],
+    workers: int,
+) -> Iterator[tuple[str, _DirListing]]:
+    """Yields the relative path and listing of each directory, as soon as it
+    is listed."""
+
+    def subdirs(rel_dir: str, listing: _DirListing) -> list[str]:
+        if not recursive:
+            return []
+        rel_paths = (
+            name if rel_dir == "" else f"{rel_dir}/{name}"
+            for name in listing.dirs
+        )
+        return [
+            rel_path
+            for rel_path in rel_paths
+            if not _matches(exclude, rel_path)
+        ]
+
+    if workers <= 1:
+        dirs = [""]
+        for rel_dir in dirs:
+            listing = list_dir(rel_dir)
+            dirs.extend(subdirs(rel_dir, listing))
+            yield rel_dir, listing
+        return
+
+    executor = ThreadPoolExecutor(workers)
+    try:
+        futures = {executor.submit(list_dir, ""): ""}
+        while len(futures) > 0:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir = futures.pop(future)
+                listing = future.result()
+                for rel_path in subdirs(rel_dir, listing):
+                    futures[executor.submit(list_dir, rel_path)] = rel_path
+                yield rel_dir, listing
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_files(
     path: Path,
     pattern: str | Sequence[str] | None = None,
     recursive: bool = False,
-) -> list[Path]:
+    include: str | Sequence[str] | None = None,
+    exclude: str | Sequence[str] | None = None,
+    min_size: int | None = None,
+    max_size: int | None = None,
+    newer_than: float | None = None,
+    older_than: float | None = None,
+    workers: int = 1,
+    cache_path: Path | None = None,
+) -> Iterator[Path]:
+    """Yields the files inside ``path`` as soon as they are found.
+
+    ``pattern`` is one or more file extensions, matched case-insensitively.
+    ``include`` and ``exclude`` are globs matched against the file name or,
+    if they contain a '/', against the path relative to ``path``; excluded
+    directories are not traversed. Sizes are in bytes and times are
+    timestamps of the last modification. With ``workers`` > 1, directories
+    are listed in parallel threads and files are yielded in no particular
+    order.
+
+    If ``cache_path`` is set, the listing of every directory is stored in
+    that file and reused by later calls while the modification time of the
+    directory does not change, so unchanged directories are not listed
+    again. Files modified in place keep their cached size and mtime.
+    """
+    path = Path(path)
     if isinstance(pattern, str):
         pattern = [pattern]
+    suffixes = None if pattern is None else {x.lower() for x in pattern}
+    include = _compile_globs(include)
+    exclude = _compile_globs(exclude)
+    with_stat = cache_path is not None or any(
+        x is not None for x in (min_size, max_size, newer_than, older_than)
+    )
+
+    cache = {}
+    if cache_path is not None:
+        cache_path = Path(cache_path)
+        cache = _load_file_list_cache(cache_path)
+    listings = {}
 
-    file_list = []
-    dir_list = [path]
-    for dir in dir_list:
-        for file in dir.iterdir():
-            if file.is_dir() and recursive:
-                dir_list.append(file)
-            if pattern is not None and file.suffix not in pattern:
+    def list_dir(rel_dir: str) -> _DirListing:
+        dir_path = os.path.abspath(os.path.join(path, rel_dir))
+        listing = cache.get(dir_path)
+        if (
+            listing is None
+            or os.stat(dir_path).st_mtime_ns != listing.mtime_ns
+        ):
+            listing = _scan_dir(dir_path, with_stat)
+        listings[dir_path] = listing
+        return listing
+
+    for rel_dir, listing in _walk(list_dir, recursive, exclude, workers):
+        for name, size, mtime in listing.files:
+            suffix = os.path.splitext(name)[1].lower()
+            if suffixes is not None and suffix not in suffixes:
+                continue
+            rel_path = name if rel_dir == "" else f"{rel_dir}/{name}"
+            if len(include) > 0 and not _matches(include, rel_path):
+                continue
+            if _matches(exclude, rel_path):
+                continue
+            if min_size is not None and size < min_size:
+                continue
+            if max_size is not None and size > max_size:
                 continue
-            file_list.append(file)
+            if newer_than is not None and mtime < newer_than:
+                continue
+            if older_than is not None and mtime > older_than:
+                continue
+            yield path / rel_path
+
+    # Only save complete traversals
+    if cache_path is not None:
+        _save_file_list_cache(cache_path, {**cache, **listings})
 
-    return file_list
+
+def find(
+    path: Path,
+    pattern: str | Sequence[str] | None = None,
+    recursive: bool = False,
+) -> list[Path]:
+    return list(iter_files(path, pattern, recursive))
@@ -0,0 +1,472 @@
+import functools
+import heapq
+import multiprocessing as mp
+import queue
+import threading
+import time
+import traceback
+from typing import Any, Callable, Iterable, Iterator
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from .detections import Detections
+from .face_tracker import FaceAnnotation, FaceTracker, FrameSampler
+from .tiling import TileDetector
+from .video import SharedFrame, SharedFramePool, Video, read_shared_frames
+
+__all__ = ["PIPELINE_MODES", "FacePipeline", "Pipeline", "Stage"]
+
+PIPELINE_MODES = ("thread", "process")
+
+
+class Stage:
+    """Step of a pipeline.
+
+    ``factory`` is called once by each worker to build the function applied to
+    every item, so that workers can hold their own models or buffers. In
+    process mode, it must be picklable (e.g., a module-level function or a
+    ``functools.partial`` of one).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], Callable[[Any], Any]],
+        workers: int = 1,
+        queue_size: int = 8,
+    ) -> None:
+        self.name = name
+        self.factory = factory
+        self.workers = workers
+        self.queue_size = queue_size
+
+
+class _StageError:
+    def __init__(self, stage: str, message: str) -> None:
+        self.stage = stage
+        self.message = message
+
+
+def _run_worker(
+    stage: Stage,
+    in_queue: Any,
+    out_queue: Any,
+    finished: Any,
+    lock: Any,
+    busy_time: Any,
+) -> None:
+    func = None
+    while True:
+        item = in_queue.get()
+        if item is None:
+            # Let the other workers of the stage see the end of the stream,
+            # and forward it once all of them have finished
+            with lock:
+                finished.value += 1
+                is_last = finished.value == stage.workers
+            if is_last:
+                out_queue.put(None)
+            else:
+                in_queue.put(None)
+            return
+
+        idx, value = item
+        if not isinstance(value, _StageError):
+            start = time.perf_counter()
+            try:
+                if func is None:
+                    func = stage.factory()
+                value = func(value)
+            except Exception:
+                value = _StageError(stage.name, traceback.format_exc())
+            with lock:
+                busy_time.value += time.perf_counter() - start
+        out_queue.put((idx, value))
+
+
+class _Counter:
+    def __init__(self, value: float = 0) -> None:
+        self.value = value
+
+
+class Pipeline:
+    """Runs a sequence of stages connected by bounded queues.
+
+    Each stage runs in its own pool of threads or processes, so all stages
+    process different items at the same time and throughput approaches that
+    of the slowest stage. Results are yielded in the same order as the input
+    items, even if stages with several workers complete them out of order.
+    """
+
+    def __init__(self, stages: list[Stage], mode: str = "thread") -> None:
+        if mode not in PIPELINE_MODES:
+            raise ValueError(
+                f"Unknown pipeline mode: {mode} ({PIPELINE_MODES})"
+            )
+        self.stages = stages
+        self.mode = mode
+        self.stats = {}
+
+    def _feed(
+        self, items: Iterable[Any], in_queue: Any, error: list[BaseException]
+    ) -> None:
+        try:
+            for idx, item in enumerate(items):
+                in_queue.put((idx, item))
+        except BaseException as e:
+            error.append(e)
+        in_queue.put(None)
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        if self.mode == "thread":
+            make_queue = queue.Queue
+            make_worker = threading.Thread
+            make_lock = threading.Lock
+            make_counter = _Counter
+        else:
+            ctx = mp.get_context("spawn")
+            make_queue = ctx.Queue
+            make_worker = ctx.Process
+            make_lock = ctx.Lock
+            make_counter = functools.partial(ctx.Value, "d")
+
+        queues = [make_queue(maxsize=self.stages[0].queue_size)]
+        workers = []
+        busy_times = []
+        # Keep the shared objects alive until spawned workers unpickle them
+        sync_objects = []
+        for stage_idx, stage in enumerate(self.stages):
+            is_last = stage_idx == len(self.stages) - 1
+            next_stage = stage if is_last else self.stages[stage_idx + 1]
+            queues.append(make_queue(maxsize=next_stage.queue_size))
+            finished = make_counter(0)
+            busy_time = make_counter(0.0)
+            busy_times.append(busy_time)
+            lock = make_lock()
+            sync_objects.append((finished, lock))
+            for _ in range(stage.workers):
+                workers.append(
+                    make_worker(
+                        target=_run_worker,
+                        args=(
+                            stage,
+                            queues[stage_idx],
+                            queues[stage_idx + 1],
+                            finished,
+                            lock,
+                            busy_time,
+                        ),
+                        daemon=True,
+                    )
+                )
+        for worker in workers:
+            worker.start()
+
+        feed_error = []
+        feeder = threading.Thread(
+            target=self._feed,
+            args=(items, queues[0], feed_error),
+            daemon=True,
+        )
+        start = time.perf_counter()
+        feeder.start()
+
+        # Reorder the results by their input index
+        pending = []
+        next_idx = 0
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is None:
+                    break
+                idx, value = item
+                if isinstance(value, _StageError):
+                    raise RuntimeError(
+                        f"Pipeline stage '{value.stage}' failed:\n"
+                        f"{value.message}"
+                    )
+                heapq.heappush(pending, (idx, value))
+                while len(pending) > 0 and pending[0][0] == next_idx:
+                    yield heapq.heappop(pending)[1]
+                    next_idx += 1
+        finally:
+            if self.mode == "process":
+                for worker in workers:
+                    if worker.is_alive():
+                        worker.terminate()
+
+        feeder.join()
+        for worker in workers:
+            worker.join()
+        if len(feed_error) > 0:
+            raise feed_error[0]
+
+        elapsed = time.perf_counter() - start
+        self.stats = {
+            "items": next_idx,
+            "elapsed": elapsed,
+            "stages": {
+                stage.name: busy_time.value
+                for stage, busy_time in zip(self.stages, busy_times)
+            },
+        }
+
+
+def _letterbox(
+    frame: np.ndarray, input_size: tuple[int, int]
+) -> tuple[np.ndarray, float]:
+    # Same resize as the insightface detector, so results do not change
+    input_w, input_h = input_size
+    im_ratio = frame.shape[0] / frame.shape[1]
+    if im_ratio > input_h / input_w:
+        new_h = input_h
+        new_w = int(new_h / im_ratio)
+    else:
+        new_w = input_w
+        new_h = int(new_w * im_ratio)
+    scale = new_h / frame.shape[0]
+    det_img = np.zeros((input_h, input_w, 3), dtype=np.uint8)
+    det_img[:new_h, :new_w] = cv2.resize(frame, (new_w, new_h))
+    return det_img, scale
+
+
+def _get_face_tracker(
+    face_tracker: FaceTracker | None, model_name: str, det_size: tuple[int, int]
+) -> FaceTracker:
+    # In process mode, each worker loads its own models
+    if face_tracker is None:
+        face_tracker = FaceTracker(model_name=model_name, det_size=det_size)
+    return face_tracker
+
+
+def _get_frame(
+    frame: np.ndarray | SharedFrame, pool: SharedFramePool | None
+) -> np.ndarray:
+    return frame if pool is None else pool.get(frame)
+
+
+def _make_preprocess(
+    det_size: tuple[int, int], pool: SharedFramePool | None = None
+) -> Callable:
+    def preprocess(
+        frame: np.ndarray | SharedFrame,
+    ) -> tuple[np.ndarray | SharedFrame, np.ndarray, float]:
+        det_img, scale = _letterbox(_get_frame(frame, pool), det_size)
+        return frame, det_img, scale
+
+    return preprocess
+
+
+def _make_detect(
+    face_tracker: FaceTracker | None,
+    model_name: str,
+    det_size: tuple[int, int],
+    tiler: TileDetector | None = None,
+    pool: SharedFramePool | None = None,
+) -> Callable:
+    face_tracker = _get_face_tracker(face_tracker, model_name, det_size)
+
+    def detect(
+        item: tuple[np.ndarray, np.ndarray, float]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        frame, det_img, scale = item
+        bboxes, landmarks = face_tracker.detect_faces(
+            det_img, input_size=det_size
+        )
+        bboxes = np.concatenate([bboxes[:, :4] / scale, bboxes[:, 4:]], axis=1)
+        landmarks = landmarks / scale
+        if tiler is not None:
+            bboxes, landmarks = tiler(
+                face_tracker.detect_faces,
+                _get_frame(frame, pool),
+                bboxes,
+                landmarks,
+            )
+        return frame, bboxes, landmarks
+
+    return detect
+
+
+def _make_recognize(
+    face_tracker: FaceTracker | None,
+    model_name: str,
+    det_size: tuple[int, int],
+    pool: SharedFramePool | None = None,
+) -> Callable:
+    face_tracker = _get_face_tracker(face_tracker, model_name, det_size)
+
+    def recognize(
+        item: tuple[np.ndarray | SharedFrame, np.ndarray, np.ndarray]
+    ) -> Detections:
+        frame, bboxes, landmarks = item
+        embedding = face_tracker.recognize(_get_frame(frame, pool), landmarks)
+        if pool is not None:
+            # Last stage that reads the frame
+            pool.release(frame)
+        return Detections(
+            bbox=bboxes[:, :4],
+            prob=bboxes[:, 4],
+            landmarks=landmarks.reshape(-1, 10),
+            embedding=embedding,
+        )
+
+    return recognize
+
+
+class FacePipeline:
+    """Runs a FaceTracker as a pipeline of overlapped stages.
+
+    Frames are decoded by ``Video``, resized for the detector (preprocess),
+    passed through the face detector (detect) and aligned and embedded in
+    one batch per frame (recognize), each stage with its own workers.
+    Tracking and writing the results run in the calling thread on the
+    detections reordered by frame, while the next frames are in flight. In
+    process mode, frames are decoded into a ``SharedFramePool`` and workers
+    only exchange slot references instead of pickling whole frames.
+    """
+
+    STAGES = ("preprocess", "detect", "recognize")
+
+    def __init__(
+        self,
+        face_tracker: FaceTracker,
+        mode: str = "thread",
+        workers: dict[str, int] | None = None,
+        queue_size: int = 8,
+    ) -> None:
+        workers = {} if workers is None else workers
+        for stage in workers:
+            if stage not in self.STAGES:
+                raise ValueError(f"Unknown stage: {stage} ({self.STAGES})")
+        self.face_tracker = face_tracker
+        self.mode = mode
+        self.workers = workers
+        self.queue_size = queue_size
+        self.stats = {}
+
+    def _build(
+        self, det_size: tuple[int, int], pool: SharedFramePool | None = None
+    ) -> Pipeline:
+        face_tracker = self.face_tracker if self.mode == "thread" else None
+        model_name = self.face_tracker.model_name
+        factories = {
+            "preprocess": functools.partial(_make_preprocess, det_size, pool),
+            "detect": functools.partial(
+                _make_detect,
+                face_tracker,
+                model_name,
+                det_size,
+                self.face_tracker.tiler,
+                pool,
+            ),
+            "recognize": functools.partial(
+                _make_recognize, face_tracker, model_name, det_size, pool
+            ),
+        }
+        stages = [
+            Stage(
+                name,
+                factories[name],
+                workers=self.workers.get(name, 1),
+                queue_size=self.queue_size,
+            )
+            for name in self.STAGES
+        ]
+        return Pipeline(stages, self.mode)
+
+    def _progress(self, frames: Iterable[Any], num_frames: int) -> tqdm:
+        return tqdm(
+            frames,
+            total=num_frames,
+            desc="Processing video",
+            leave=False,
+            disable=self.face_tracker.quiet,
+            dynamic_ncols=True,
+        )
+
+    def _run(
+        self,
+        pipeline: Pipeline,
+        frames: Iterable[Any],
+        pool: SharedFramePool | None = None,
+    ) -> Iterator[Detections]:
+        # Frames skipped by the frame stride and static frames bypass the
+        # pipeline. Scenes are detected in the feeder, which also decodes
+        sampler = self.face_tracker.create_sampler()
+        scene_detector = self.face_tracker.create_scene_detector()
+        actions = []
+
+        def sample(frames: Iterable[Any]) -> Iterator[Any]:
+            for frame in frames:
+                scene_info = (False, False)
+                if scene_detector is not None:
+                    scene_info = scene_detector(_get_frame(frame, pool))
+                action = sampler(scene_info)
+                actions.append(action)
+                if action == FrameSampler.DETECT:
+                    yield frame
+                elif pool is not None:
+                    pool.release(frame)
+
+        frame_idx = 0
+        last_detections = Detections.empty()
+
+        def bypassed() -> Iterator[Detections]:
+            nonlocal frame_idx
+            while (
+                frame_idx < len(actions)
+                and actions[frame_idx] != FrameSampler.DETECT
+            ):
+                if actions[frame_idx] == FrameSampler.REUSE:
+                    yield last_detections
+                else:
+                    yield Detections.empty()
+                frame_idx += 1
+
+        for detections in pipeline.run(sample(frames)):
+            # The action of every frame up to this one is already known
+            yield from bypassed()
+            last_detections = detections
+            yield detections
+            frame_idx += 1
+        yield from bypassed()
+        self.face_tracker.last_num_reused = sampler.num_reused
+
+    def detect_video(self, filename: str) -> Iterator[Detections]:
+        face_tracker = self.face_tracker
+        if face_tracker.adaptive:
+            face_tracker.set_det_size(face_tracker.select_det_size(filename))
+
+        if self.mode == "thread":
+            pipeline = self._build(face_tracker.det_size)
+            with Video(filename, max_frames=face_tracker.max_frames) as video:
+                frames = (video.read() for _ in range(video.num_frames))
+                frames = self._progress(frames, video.num_frames)
+                yield from self._run(pipeline, frames)
+            self.stats = {**pipeline.stats, "frames": video.num_frames}
+            return
+
+        video = Video(filename, max_frames=face_tracker.max_frames)
+        video.stream.release()
+        # Enough slots for every frame waiting in a queue or being processed
+        num_slots = sum(
+            self.queue_size + self.workers.get(name, 1) for name in self.STAGES
+        )
+        pool = SharedFramePool(
+            num_slots,
+            (video.heigh, video.width, 3),
+            ctx=mp.get_context("spawn"),
+        )
+        try:
+            pipeline = self._build(face_tracker.det_size, pool)
+            frames = read_shared_frames(filename, pool, video.num_frames)
+            frames = self._progress(frames, video.num_frames)
+            yield from self._run(pipeline, frames, pool)
+        finally:
+            pool.close()
+        self.stats = {**pipeline.stats, "frames": video.num_frames}
+
+    def __call__(self, filename: str) -> dict[str, FaceAnnotation]:
+        return self.face_tracker(filename, detect_video=self.detect_video)
@@ -0,0 +1,164 @@
+from typing import Any
+
+import numpy as np
+
+__all__ = [
+    "interpolate_gaps",
+    "is_annotation",
+    "postprocess_annotations",
+    "postprocess_track",
+    "smooth_segments",
+]
+
+# Annotation keys of each frame, and their sizes
+TRACK_KEYS = {"bbox": 4, "landmarks": 10, "prob": 1}
+SMOOTH_KEYS = ("bbox", "landmarks")
+
+
+def is_annotation(data: Any) -> bool:
+    """Whether loaded JSON data is an annotation file of detect_faces.py, and
+    not another JSON file of the dataset (e.g., identities or selections)"""
+    return isinstance(data, dict) and all(
+        isinstance(face_anns, dict)
+        and len(face_anns) > 0
+        and all(
+            isinstance(x, dict) and "bbox" in x and "prob" in x
+            for x in face_anns.values()
+        )
+        for face_anns in data.values()
+    )
+
+
+def _track_to_array(
+    face_anns: dict[str, dict[str, Any]],
+) -> tuple[np.ndarray, np.ndarray]:
+    frame_idxs = np.array(sorted(int(x) for x in face_anns), dtype=np.int64)
+    values = np.array(
+        [
+            np.concatenate(
+                [np.ravel(face_anns[str(idx)][key]) for key in TRACK_KEYS]
+            )
+            for idx in frame_idxs
+        ],
+        dtype=np.float64,
+    ).reshape(len(frame_idxs), sum(TRACK_KEYS.values()))
+    return frame_idxs, values
+
+
+def _array_to_track(
+    frame_idxs: np.ndarray, values: np.ndarray, interpolated: np.ndarray
+) -> dict[str, dict[str, Any]]:
+    face_anns = dict()
+    columns = np.cumsum([0, *TRACK_KEYS.values()])
+    for frame_idx, row, is_interpolated in zip(
+        frame_idxs.tolist(), values, interpolated.tolist()
+    ):
+        frame_anns = {
+            key: row[start:end].tolist()
+            for key, start, end in zip(TRACK_KEYS, columns[:-1], columns[1:])
+        }
+        frame_anns["prob"] = frame_anns["prob"][0]
+        if is_interpolated:
+            frame_anns["interpolated"] = True
+        face_anns[str(frame_idx)] = frame_anns
+    return face_anns
+
+
+def interpolate_gaps(
+    frame_idxs: np.ndarray, values: np.ndarray, max_gap: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Linearly interpolates the (T, D) values of a track in the gaps of up to
+    ``max_gap`` missing frames. Returns the new frame indices and values, and
+    a mask of the interpolated frames."""
+    gaps = np.diff(frame_idxs) - 1
+    fill = (gaps > 0) & (gaps <= max_gap)
+    interpolated = np.zeros(len(frame_idxs), dtype=bool)
+    if not fill.any():
+        return frame_idxs, values, interpolated
+
+    lengths = gaps[fill]
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    new_idxs = np.repeat(frame_idxs[:-1][fill], lengths) + offsets + 1
+    right = np.searchsorted(frame_idxs, new_idxs)
+    left = right - 1
+    weight = (new_idxs - frame_idxs[left]) / (
+        frame_idxs[right] - frame_idxs[left]
+    )
+    new_values = values[left] + weight[:, None] * (values[right] - values[left])
+
+    order = np.argsort(np.concatenate([frame_idxs, new_idxs]), kind="stable")
+    return (
+        np.concatenate([frame_idxs, new_idxs])[order],
+        np.concatenate([values, new_values])[order],
+        np.concatenate([interpolated, np.ones(len(new_idxs), dtype=bool)])[
+            order
+        ],
+    )
+
+
+def smooth_segments(
+    frame_idxs: np.ndarray, values: np.ndarray, window: int, polyorder: int = 2
+) -> np.ndarray:
+    """Applies a Savitzky-Golay filter to the (T, D) values of each run of
+    consecutive frames of a track. Runs shorter than ``window`` use the
+    largest window that fits, and are kept as is if it is too short for
+    ``polyorder``."""
+    # scipy.signal takes about a second to import
+    from scipy.signal import savgol_filter
+
+    values = values.copy()
+    breaks = np.flatnonzero(np.diff(frame_idxs) > 1) + 1
+    for start, end in zip(
+        np.concatenate([[0], breaks]), np.concatenate([breaks, [len(values)]])
+    ):
+        # The window of the filter must be odd
+        segment_window = min(window, end - start)
+        segment_window -= segment_window % 2 == 0
+        if segment_window <= polyorder:
+            continue
+        values[start:end] = savgol_filter(
+            values[start:end], segment_window, polyorder, axis=0, mode="interp"
+        )
+    return values
+
+
+def postprocess_track(
+    face_anns: dict[str, dict[str, Any]],
+    max_gap: int = 0,
+    window: int | None = None,
+    polyorder: int = 2,
+) -> dict[str, dict[str, Any]]:
+    """Fills the short gaps of a track and smooths its boxes and landmarks.
+    Interpolated frames are flagged with ``"interpolated": True``."""
+    if len(face_anns) == 0:
+        return face_anns
+    frame_idxs, values = _track_to_array(face_anns)
+    frame_idxs, values, interpolated = interpolate_gaps(
+        frame_idxs, values, max_gap
+    )
+    if window is not None:
+        num_smooth = sum(TRACK_KEYS[key] for key in SMOOTH_KEYS)
+        values[:, :num_smooth] = smooth_segments(
+            frame_idxs, values[:, :num_smooth], window, polyorder
+        )
+    new_anns = _array_to_track(frame_idxs, values, interpolated)
+    # Keep other keys of the detected frames (e.g., quality scores)
+    for frame_idx, frame_anns in face_anns.items():
+        for key, value in frame_anns.items():
+            if key not in TRACK_KEYS:
+                new_anns[frame_idx].setdefault(key, value)
+    return new_anns
+
+
+def postprocess_annotations(
+    anns: dict[str, dict[str, dict[str, Any]]],
+    max_gap: int = 0,
+    window: int | None = None,
+    polyorder: int = 2,
+) -> dict[str, dict[str, dict[str, Any]]]:
+    return {
+        face_id: postprocess_track(face_anns, max_gap, window, polyorder)
+        for face_id, face_anns in anns.items()
+    }
@@ -0,0 +1,201 @@
+import fcntl
+import json
+import os
+from pathlib import Path
+import threading
+from typing import Any, Iterable
+
+import numpy as np
+from tqdm import tqdm
+
+from .face_tracker import FaceTracker
+from .video import Video, read_frames
+
+__all__ = ["ProbeIndex", "VideoProber", "probe_indices"]
+
+PROBE_INDEX_VERSION = 1
+
+
+def probe_indices(
+    num_frames: int,
+    fps: float,
+    probe_fps: float | None = 1.0,
+    num_samples: int | None = None,
+) -> np.ndarray:
+    """Frames sampled by a probe: ``num_samples`` evenly spaced frames if it
+    is set, or ``probe_fps`` frames per second of video otherwise."""
+    if num_frames <= 0:
+        return np.empty((0,), dtype=np.int64)
+    if num_samples is not None:
+        indices = np.linspace(0, num_frames - 1, num_samples)
+        return np.unique(indices.astype(np.int64))
+    step = max(int(round(fps / probe_fps)), 1) if fps > 0 else 1
+    return np.arange(0, num_frames, step, dtype=np.int64)
+
+
+class ProbeIndex:
+    """JSON file with the probe results of each video.
+
+    Entries are keyed by the absolute path of the video and are only valid
+    while its size, modification time and the probe parameters do not
+    change, so videos are never probed twice. ``save`` merges the entries
+    written by other processes in the meantime, holding a lock file next to
+    the index so that nodes sharing it do not overwrite each other.
+    """
+
+    def __init__(self, path: Path | None, params: dict[str, Any]) -> None:
+        self.path = None if path is None else Path(path)
+        self.params = params
+        self.entries = self._load()
+        self.num_new = 0
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        if self.path is None or not self.path.exists():
+            return {}
+        with open(self.path, "r") as index_file:
+            data = json.load(index_file)
+        if data.get("version") != PROBE_INDEX_VERSION:
+            return {}
+        return data["videos"]
+
+    @staticmethod
+    def _key(video_path: Path) -> tuple[str, int, int]:
+        stat = os.stat(video_path)
+        return os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns
+
+    def get(self, video_path: Path) -> dict[str, Any] | None:
+        key, size, mtime_ns = self._key(video_path)
+        entry = self.entries.get(key)
+        if (
+            entry is None
+            or entry["size"] != size
+            or entry["mtime_ns"] != mtime_ns
+            or entry["params"] != self.params
+        ):
+            return None
+        return entry
+
+    def set(self, video_path: Path, result: dict[str, Any]) -> dict[str, Any]:
+        key, size, mtime_ns = self._key(video_path)
+        entry = {
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "params": self.params,
+            **result,
+        }
+        with self._lock:
+            self.entries[key] = entry
+            self.num_new += 1
+        return entry
+
+    def save(self) -> None:
+        if self.path is None or self.num_new == 0:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = self.path.with_name(f"{self.path.name}.lock")
+        with self._lock, open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.entries = {**self._load(), **self.entries}
+            data = {"version": PROBE_INDEX_VERSION, "videos": self.entries}
+            tmp_path = self.path.with_name(
+                f"{self.path.name}.{os.getpid()}.tmp"
+            )
+            with open(tmp_path, "w") as index_file:
+                json.dump(data, index_file)
+            os.replace(tmp_path, self.path)
+            self.num_new = 0
+
+
+class VideoProber:
+    """Estimates the face density of videos from a few sampled frames.
+
+    Only the face detector runs on the sampled frames, which are read by
+    seeking. The density is the mean number of faces per sampled frame.
+    Videos with a density not above ``min_density`` are skipped by
+    ``prioritize``, and the rest are sorted by descending density, so the
+    full pass starts with the videos with more faces. Results are stored in
+    a ``ProbeIndex`` at ``index_path``, saved every ``save_every`` probes.
+    """
+
+    def __init__(
+        self,
+        face_tracker: FaceTracker,
+        probe_fps: float | None = 1.0,
+        num_samples: int | None = None,
+        min_density: float = 0.0,
+        index_path: Path | None = None,
+        save_every: int = 100,
+    ) -> None:
+        self.face_tracker = face_tracker
+        self.probe_fps = probe_fps
+        self.num_samples = num_samples
+        self.min_density = min_density
+        self.save_every = save_every
+        params = {
+            "probe_fps": probe_fps,
+            "num_samples": num_samples,
+            "max_frames": face_tracker.max_frames,
+            "det_thresh": face_tracker.det_thresh,
+            "model": face_tracker.model_name,
+        }
+        self.index = ProbeIndex(index_path, params)
+
+    def _probe(self, video_path: Path) -> dict[str, Any]:
+        max_frames = self.face_tracker.max_frames
+        video = Video(str(video_path), max_frames=max_frames)
+        num_frames = video.num_frames
+        fps = video.fps
+        video.stream.release()
+        indices = probe_indices(
+            num_frames, fps, self.probe_fps, self.num_samples
+        )
+        det_thresh = self.face_tracker.det_thresh
+        num_faces = []
+        for frame in read_frames(str(video_path), indices):
+            if self.face_tracker.client is not None:
+                # Do not load the models next to those of the server
+                scores = self.face_tracker.detect(frame).prob
+            else:
+                bboxes, _ = self.face_tracker.detect_faces(frame)
+                scores = bboxes[:, 4]
+            num_faces.append(int(np.sum(scores >= det_thresh)))
+        return {
+            "num_frames": num_frames,
+            "num_samples": len(num_faces),
+            "face_frames": sum(x > 0 for x in num_faces),
+            "density": float(np.mean(num_faces)) if num_faces else 0.0,
+        }
+
+    def probe(self, video_path: Path) -> dict[str, Any]:
+        entry = self.index.get(video_path)
+        if entry is None:
+            entry = self.index.set(video_path, self._probe(video_path))
+            if self.index.num_new >= self.save_every:
+                self.index.save()
+        return entry
+
+    def has_faces(self, video_path: Path) -> bool:
+        return self.probe(video_path)["density"] > self.min_density
+
+    def prioritize(
+        self, video_paths: Iterable[Path], quiet: bool = False
+    ) -> list[Path]:
+        densities = {}
+        try:
+            for video_path in tqdm(
+                video_paths,
+                desc="Probing videos",
+                leave=False,
+                disable=quiet,
+                dynamic_ncols=True,
+            ):
+                densities[video_path] = self.probe(video_path)["density"]
+        finally:
+            self.index.save()
+        keep = [
+            video_path
+            for video_path, density in densities.items()
+            if density > self.min_density
+        ]
+        return sorted(keep, key=lambda x: densities[x], reverse=True)
@@ -0,0 +1,192 @@
+import heapq
+from typing import Any
+
+import cv2
+import numpy as np
+
+__all__ = [
+    "QUALITY_WEIGHTS",
+    "CropSelector",
+    "face_quality",
+    "frontalness",
+    "select_frames",
+    "sharpness",
+    "size_score",
+]
+
+# Weights of each score in the face quality
+QUALITY_WEIGHTS = {"prob": 1.0, "size": 1.0, "frontal": 1.0, "sharpness": 1.0}
+
+
+def size_score(bboxes: np.ndarray, ref_size: float = 112) -> np.ndarray:
+    """Scores (N,) boxes by their side relative to the input size of the
+    recognition model, capped at 1."""
+    bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+    side = np.sqrt(
+        np.clip(bboxes[:, 2] - bboxes[:, 0], 0, None)
+        * np.clip(bboxes[:, 3] - bboxes[:, 1], 0, None)
+    )
+    return np.minimum(side / ref_size, 1)
+
+
+def frontalness(landmarks: np.ndarray) -> np.ndarray:
+    """Scores how frontal the pose of (N, 10) faces is, from 1 (frontal) to 0,
+    using the position of the nose relative to the eyes and the mouth."""
+    kps = np.asarray(landmarks, dtype=np.float32).reshape(-1, 5, 2)
+    eyes = kps[:, :2].mean(axis=1)
+    nose = kps[:, 2]
+    mouth = kps[:, 3:].mean(axis=1)
+    eye_dist = np.linalg.norm(kps[:, 1] - kps[:, 0], axis=1)
+
+    # Yaw: horizontal offset of the nose from the face axis
+    axis_x = (eyes[:, 0] + mouth[:, 0]) / 2
+    yaw = np.abs(nose[:, 0] - axis_x) / np.maximum(eye_dist, 1e-6)
+    # Pitch: relative height of the nose between the eyes and the mouth
+    face_h = mouth[:, 1] - eyes[:, 1]
+    pitch = (nose[:, 1] - eyes[:, 1]) / np.where(
+        np.abs(face_h) < 1e-6, 1e-6, face_h
+    )
+    yaw_score = 1 - np.minimum(yaw / 0.5, 1)
+    pitch_score = 1 - np.minimum(np.abs(pitch - 0.55) / 0.45, 1)
+    return yaw_score * pitch_score
+
+
+def sharpness(
+    image: np.ndarray, bboxes: np.ndarray, size: int = 64, ref_var: float = 100
+) -> np.ndarray:
+    """Scores the sharpness of (N, 4) face boxes of an image as the variance of
+    the Laplacian of each face resized to ``size``, mapped to [0, 1)."""
+    bboxes = np.asarray(bboxes).reshape(-1, 4)
+    if len(bboxes) == 0:
+        return np.empty((0,), dtype=np.float32)
+    gray = image
+    if image.ndim == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    boxes = np.round(bboxes).astype(int)
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, w)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, h)
+    faces = np.zeros((len(boxes), size, size), dtype=np.float32)
+    for face, (x1, y1, x2, y2) in zip(faces, boxes):
+        if x2 > x1 and y2 > y1:
+            face[:] = cv2.resize(
+                gray[y1:y2, x1:x2], (size, size), interpolation=cv2.INTER_AREA
+            )
+    laplacian = (
+        faces[:, :-2, 1:-1]
+        + faces[:, 2:, 1:-1]
+        + faces[:, 1:-1, :-2]
+        + faces[:, 1:-1, 2:]
+        - 4 * faces[:, 1:-1, 1:-1]
+    )
+    variance = laplacian.reshape(len(faces), -1).var(axis=1)
+    return variance / (variance + ref_var)
+
+
+def face_quality(
+    image: np.ndarray,
+    bboxes: np.ndarray,
+    probs: np.ndarray,
+    landmarks: np.ndarray,
+    weights: dict[str, float] | None = None,
+) -> np.ndarray:
+    """Scores the quality of all the faces of an image at once, as the
+    weighted mean of the detector probability, the box size, the
+    frontalness of the pose and the sharpness."""
+    weights = QUALITY_WEIGHTS if weights is None else weights
+    scores = {
+        "prob": np.asarray(probs, dtype=np.float32).reshape(-1),
+        "size": size_score(bboxes),
+        "frontal": frontalness(landmarks),
+        "sharpness": sharpness(image, bboxes),
+    }
+    total = sum(weights.get(name, 0) * score for name, score in scores.items())
+    return total / max(sum(weights.values()), 1e-12)
+
+
+def select_frames(
+    frame_idxs: np.ndarray,
+    scores: np.ndarray,
+    top_k: int | None = None,
+    every_n: int | None = None,
+) -> np.ndarray:
+    """Selects the frames of a track to crop: the best frame of every window
+    of ``every_n`` frames, which spreads the crops over the track, and then
+    the ``top_k`` best of them. Returns the selected frames sorted."""
+    frame_idxs = np.asarray(frame_idxs)
+    scores = np.asarray(scores)
+    selected = np.arange(len(frame_idxs))
+    if every_n is not None:
+        windows = frame_idxs // every_n
+        # Sort by window and by descending score, keep the first of each
+        order = np.lexsort((frame_idxs, -scores, windows))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = windows[order][1:] != windows[order][:-1]
+        selected = order[first]
+    if top_k is not None and len(selected) > top_k:
+        # Ties are broken in favour of the earliest frames
+        order = np.lexsort((frame_idxs[selected], -scores[selected]))
+        selected = selected[order[:top_k]]
+    return np.sort(frame_idxs[selected])
+
+
+class CropSelector:
+    """Streaming version of ``select_frames``.
+
+    Crops are added while the video is decoded. Only the best crop of the
+    current window and the ``top_k`` best crops of each track are kept in
+    memory. Crops that can no longer be discarded are returned by ``add``
+    (when ``top_k`` is None) or by ``flush`` at the end of the video.
+    """
+
+    def __init__(
+        self, top_k: int | None = None, every_n: int | None = None
+    ) -> None:
+        self.top_k = top_k
+        self.every_n = every_n
+        # face_id -> (window, score, frame_idx, crop)
+        self.windows = dict()
+        # face_id -> min-heap of (score, -frame_idx, crop)
+        self.best = dict()
+
+    def _push(
+        self, face_id: str, score: float, frame_idx: int, crop: Any
+    ) -> list[tuple[str, int, Any]]:
+        if self.top_k is None:
+            return [(face_id, frame_idx, crop)]
+        heap = self.best.setdefault(face_id, [])
+        item = (score, -frame_idx, crop)
+        if len(heap) < self.top_k:
+            heapq.heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+        return []
+
+    def add(
+        self, face_id: str, frame_idx: int, score: float, crop: Any
+    ) -> list[tuple[str, int, Any]]:
+        if self.every_n is None:
+            return self._push(face_id, score, frame_idx, crop)
+
+        window = frame_idx // self.every_n
+        current = self.windows.get(face_id)
+        if current is None or current[0] != window:
+            self.windows[face_id] = (window, score, frame_idx, crop)
+            if current is not None:
+                return self._push(face_id, *current[1:])
+        elif score > current[1]:
+            self.windows[face_id] = (window, score, frame_idx, crop)
+        return []
+
+    def flush(self) -> list[tuple[str, int, Any]]:
+        ready = []
+        for face_id, (_, score, frame_idx, crop) in self.windows.items():
+            ready.extend(self._push(face_id, score, frame_idx, crop))
+        self.windows = dict()
+        for face_id, heap in self.best.items():
+            ready.extend(
+                (face_id, -neg_frame_idx, crop)
+                for _, neg_frame_idx, crop in heap
+            )
+        self.best = dict()
+        return ready
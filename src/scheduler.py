@@ -0,0 +1,279 @@
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+import os
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from .video import Video
+
+__all__ = [
+    "MemoryScheduler",
+    "VideoJob",
+    "available_memory",
+    "current_rss",
+    "default_budget",
+    "parse_size",
+]
+
+_SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(value: str) -> int:
+    """Parses a number of bytes with an optional K, M, G or T suffix (powers
+    of 1024), e.g., '16G' or '512M'"""
+    value = value.strip().upper().removesuffix("B").removesuffix("I")
+    unit = value[-1:] if value[-1:] in _SIZE_UNITS else ""
+    return int(float(value[: len(value) - len(unit)]) * _SIZE_UNITS[unit])
+
+
+def current_rss() -> int | None:
+    """Resident memory of this process in bytes, or None if it cannot be read
+    (e.g., there is no /proc file system)"""
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf(
+                "SC_PAGE_SIZE"
+            )
+    except (OSError, ValueError):
+        return None
+
+
+def available_memory() -> int | None:
+    """Memory available to new processes in bytes, from /proc/meminfo"""
+    try:
+        with open("/proc/meminfo", "r") as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def default_budget(fraction: float = 0.8) -> int | None:
+    """``fraction`` of the memory that this process can use: its resident
+    memory plus the memory available in the system"""
+    available = available_memory()
+    if available is None:
+        return None
+    return (current_rss() or 0) + int(fraction * available)
+
+
+class VideoJob(NamedTuple):
+    path: Path
+    width: int
+    height: int
+    num_frames: int
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.width * self.height * 3
+
+    @classmethod
+    def from_path(cls, path: Path) -> "VideoJob":
+        # Only the container metadata is read, no frame is decoded
+        video = Video(str(path))
+        job = cls(Path(path), video.width, video.heigh, video.num_frames)
+        video.stream.release()
+        return job
+
+
+class _Running:
+    def __init__(self, job: VideoJob, queue_size: int, estimate: int) -> None:
+        self.job = job
+        self.queue_size = queue_size
+        self.estimate = estimate
+        # Max ratio between the measured and estimated memory of the running
+        # jobs while this one was running
+        self.peak_ratio = 0.0
+
+
+class MemoryScheduler:
+    """Runs video jobs in up to ``max_jobs`` threads without exceeding a
+    memory ``budget`` (bytes of resident memory of the whole process).
+
+    The memory of a video is estimated from its container metadata: its
+    decode queue and a few frames being processed, plus the detections and
+    annotations that grow with its number of frames (``bytes_per_frame``).
+    The decode queue of each video holds up to ``queue_bytes`` of frames (so
+    4K videos get shorter queues), and is shrunk to ``min_queue_size`` when
+    that lets a video run next to the others. A job is only started if the
+    estimates of all the running jobs fit in the budget together with the
+    memory measured before any job started, and the current resident memory
+    plus its estimate does too. A video that does not fit even alone runs
+    alone.
+
+    The resident memory is sampled every ``poll_interval`` seconds, and
+    estimates are multiplied by a correction factor per resolution, learned
+    from the peak ratio between the measured and estimated memory of the
+    finished jobs: it grows at once to the ratio of underestimated jobs, and
+    decreases towards the ratio of overestimated ones as an exponential
+    moving average (``smoothing``). Resolutions that did not run yet use the
+    largest correction, and at least 1.
+    """
+
+    # Frames alive outside of the decode queue (current frame, detector
+    # input, tiles, crops...)
+    WORKING_FRAMES = 8
+
+    def __init__(
+        self,
+        budget: int | None,
+        max_jobs: int,
+        queue_bytes: int = 256 * 2**20,
+        min_queue_size: int = 4,
+        max_queue_size: int = 128,
+        bytes_per_frame: int = 8 * 2**10,
+        poll_interval: float = 0.2,
+        smoothing: float = 0.3,
+        lookahead: int | None = None,
+    ) -> None:
+        self.budget = budget
+        self.max_jobs = max_jobs
+        self.queue_bytes = queue_bytes
+        self.min_queue_size = min_queue_size
+        self.max_queue_size = max_queue_size
+        self.bytes_per_frame = bytes_per_frame
+        self.poll_interval = poll_interval
+        self.smoothing = smoothing
+        # Number of pending videos that can be started before the first one
+        # when it does not fit in the remaining budget
+        self.lookahead = 2 * max_jobs if lookahead is None else lookahead
+        # Correction factors of the estimates, by (width, height)
+        self.corrections = {}
+        self.base_rss = None
+        self.peak_rss = None
+        self.num_oversized = 0
+        self._num_overtaken = 0
+
+    def queue_size(self, job: VideoJob) -> int:
+        size = self.queue_bytes // max(job.frame_bytes, 1)
+        return int(min(max(size, self.min_queue_size), self.max_queue_size))
+
+    def correction(self, job: VideoJob) -> float:
+        default = max(self.corrections.values(), default=1.0)
+        return self.corrections.get((job.width, job.height), max(default, 1.0))
+
+    def estimate(self, job: VideoJob, queue_size: int) -> int:
+        frames = job.frame_bytes * (queue_size + self.WORKING_FRAMES)
+        growth = job.num_frames * self.bytes_per_frame
+        return int((frames + growth) * self.correction(job))
+
+    def _fits(self, estimate: int, running: Iterable[_Running]) -> bool:
+        if self.budget is None:
+            return True
+        reserved = sum(x.estimate for x in running)
+        if (self.base_rss or 0) + reserved + estimate > self.budget:
+            return False
+        rss = current_rss()
+        return rss is None or rss + estimate <= self.budget
+
+    def _admit(
+        self, pending: deque[VideoJob], running: dict[Future, _Running]
+    ) -> _Running | None:
+        """Removes and returns the first pending job that fits in the budget,
+        with the largest queue that fits. Jobs only overtake the first one up
+        to ``lookahead`` times, so large videos are not postponed forever."""
+        if self._num_overtaken >= self.lookahead:
+            candidates = list(pending)[:1]
+        else:
+            candidates = list(pending)
+        for i, job in enumerate(candidates):
+            for queue_size in dict.fromkeys(
+                (self.queue_size(job), self.min_queue_size)
+            ):
+                estimate = self.estimate(job, queue_size)
+                if self._fits(estimate, running.values()):
+                    del pending[i]
+                    self._num_overtaken = (
+                        0 if i == 0 else self._num_overtaken + 1
+                    )
+                    return _Running(job, queue_size, estimate)
+        if len(running) == 0 and len(pending) > 0:
+            # Too large for the budget, even alone
+            job = pending.popleft()
+            self._num_overtaken = 0
+            self.num_oversized += 1
+            estimate = self.estimate(job, self.min_queue_size)
+            return _Running(job, self.min_queue_size, estimate)
+        return None
+
+    def _sample(self, running: dict[Future, _Running]) -> None:
+        rss = current_rss()
+        if rss is None:
+            return
+        self.peak_rss = max(self.peak_rss or 0, rss)
+        if len(running) == 0:
+            self.base_rss = rss
+            return
+        estimate = sum(x.estimate for x in running.values())
+        ratio = max(rss - (self.base_rss or 0), 0) / max(estimate, 1)
+        for x in running.values():
+            x.peak_ratio = max(x.peak_ratio, ratio)
+
+    def _update_correction(self, finished: _Running) -> None:
+        if finished.peak_ratio <= 0:
+            return
+        job = finished.job
+        correction = self.correction(job)
+        # Ratios are relative to the corrected estimates
+        measured = finished.peak_ratio * correction
+        if measured > correction:
+            # Underestimates can exceed the budget, so they are fixed at once
+            correction = measured
+        else:
+            correction += self.smoothing * (measured - correction)
+        correction = min(max(correction, 0.25), 8.0)
+        self.corrections[job.width, job.height] = correction
+
+    def map(
+        self,
+        fn: Callable[[Path, int], None],
+        video_paths: Iterable[Path],
+    ) -> Iterator[Path]:
+        """Calls ``fn(video_path, queue_size)`` for every video in threads,
+        and yields each video path when its call finishes. Exceptions of the
+        calls are raised once the running calls finish."""
+        video_paths = iter(video_paths)
+        pending = deque()
+        running = {}
+        self._sample(running)
+        exhausted = False
+        with ThreadPoolExecutor(self.max_jobs) as executor:
+            while True:
+                while not exhausted and len(pending) < self.lookahead:
+                    video_path = next(video_paths, None)
+                    if video_path is None:
+                        exhausted = True
+                    else:
+                        pending.append(VideoJob.from_path(video_path))
+                while len(running) < self.max_jobs:
+                    admitted = self._admit(pending, running)
+                    if admitted is None:
+                        break
+                    future = executor.submit(
+                        fn, admitted.job.path, admitted.queue_size
+                    )
+                    running[future] = admitted
+                if len(running) == 0:
+                    break
+
+                done, _ = wait(
+                    running,
+                    timeout=self.poll_interval,
+                    return_when=FIRST_COMPLETED,
+                )
+                self._sample(running)
+                for future in done:
+                    finished = running.pop(future)
+                    self._update_correction(finished)
+                    if future.exception() is not None:
+                        # Let the running jobs finish, without starting more
+                        wait(running)
+                        raise future.exception()
+                    yield finished.job.path
@@ -0,0 +1,455 @@
+import collections
+from concurrent.futures import Future
+import io
+import json
+import os
+from pathlib import Path
+import queue
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+import time
+import traceback
+from typing import Any, BinaryIO, Generator
+
+import numpy as np
+
+from .detections import Detections
+from .face_tracker import FaceTracker, FrameSampler
+from .video import SceneDetector, Video
+
+__all__ = [
+    "DEFAULT_SOCKET",
+    "InferenceClient",
+    "InferenceServer",
+    "check_socket_dir",
+    "recv_message",
+    "send_message",
+]
+
+
+def _default_socket() -> str:
+    # A directory that only the current user can write to, so that no other
+    # user can bind the socket first
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "vft.sock")
+    socket_dir = os.path.join(tempfile.gettempdir(), f"vft-{os.getuid()}")
+    return os.path.join(socket_dir, "server.sock")
+
+
+DEFAULT_SOCKET = _default_socket()
+
+_HEADER = struct.Struct("!Q")
+
+
+def check_socket_dir(socket_path: str | Path, create: bool = False) -> None:
+    """Raises PermissionError unless the directory of ``socket_path`` is owned
+    by the current user and not accessible by others. With ``create``, the
+    directory is created if needed."""
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if create:
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    info = os.lstat(socket_dir)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(
+            f"Socket directory {socket_dir} is not owned by the current user"
+        )
+    if info.st_mode & 0o022:
+        raise PermissionError(
+            f"Socket directory {socket_dir} is writable by other users"
+        )
+
+
+def _encode(obj: Any, arrays: list[np.ndarray]) -> Any:
+    """Replaces the arrays of ``obj`` by their index in ``arrays``, so that
+    the rest is JSON serializable"""
+    if isinstance(obj, np.ndarray):
+        arrays.append(obj)
+        return {"__array__": len(arrays) - 1}
+    if isinstance(obj, Detections):
+        return {"__detections__": [_encode(x, arrays) for x in obj]}
+    if isinstance(obj, (list, tuple)):
+        return [_encode(x, arrays) for x in obj]
+    if isinstance(obj, dict):
+        return {key: _encode(value, arrays) for key, value in obj.items()}
+    return obj
+
+
+def _decode(obj: Any, arrays: list[np.ndarray]) -> Any:
+    if isinstance(obj, list):
+        return [_decode(x, arrays) for x in obj]
+    if isinstance(obj, dict):
+        if "__array__" in obj:
+            return arrays[obj["__array__"]]
+        if "__detections__" in obj:
+            return Detections(*_decode(obj["__detections__"], arrays))
+        return {key: _decode(value, arrays) for key, value in obj.items()}
+    return obj
+
+
+def send_message(stream: BinaryIO | socket.socket, obj: Any) -> None:
+    """Writes a message made of JSON values, arrays and ``Detections``: a JSON
+    header followed by the arrays in ``np.save`` format, each prefixed by its
+    length. Tuples are received as lists."""
+    arrays = []
+    header = json.dumps(
+        {"message": _encode(obj, arrays), "arrays": len(arrays)}
+    ).encode()
+    chunks = [_HEADER.pack(len(header)), header]
+    for array in arrays:
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        data = buffer.getbuffer()
+        chunks += [_HEADER.pack(len(data)), data]
+    if isinstance(stream, socket.socket):
+        stream.sendall(b"".join(chunks))
+    else:
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.flush()
+
+
+def _read_chunk(stream: BinaryIO) -> bytes:
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise EOFError("Connection closed")
+    (size,) = _HEADER.unpack(header)
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError("Connection closed")
+    return data
+
+
+def recv_message(stream: BinaryIO) -> Any:
+    """Reads a message written by ``send_message``. Raises EOFError when the
+    other end closed the connection."""
+    header = json.loads(_read_chunk(stream))
+    arrays = [
+        np.load(io.BytesIO(_read_chunk(stream)), allow_pickle=False)
+        for _ in range(header["arrays"])
+    ]
+    return _decode(header["message"], arrays)
+
+
+class _Batcher(threading.Thread):
+    """Owner of the models of a server.
+
+    Frames submitted by all clients are queued, and up to ``max_batch`` of
+    them, waiting at most ``max_wait`` seconds for the batch to fill, run
+    together in ``FaceTracker.detect_batch``.
+    """
+
+    def __init__(
+        self, face_tracker: FaceTracker, max_batch: int, max_wait: float
+    ) -> None:
+        super().__init__(daemon=True)
+        self.face_tracker = face_tracker
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.num_batches = 0
+        self.num_frames = 0
+
+    def submit(self, frame: np.ndarray) -> Future:
+        future = Future()
+        self.queue.put((frame, future))
+        return future
+
+    def stop(self) -> None:
+        self.queue.put(None)
+
+    def next_batch(self) -> list[tuple[np.ndarray, Future]] | None:
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = (
+                    self.queue.get(timeout=timeout)
+                    if timeout > 0
+                    else self.queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self) -> None:
+        while (batch := self.next_batch()) is not None:
+            frames = [frame for frame, _ in batch]
+            try:
+                detections = self.face_tracker.detect_batch(frames)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), frame_detections in zip(batch, detections):
+                future.set_result(frame_detections)
+            self.num_batches += 1
+            self.num_frames += len(batch)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Serves the requests of one client, one at a time"""
+
+    server: "InferenceServer"
+
+    def handle(self) -> None:
+        while True:
+            try:
+                request = recv_message(self.rfile)
+            except EOFError:
+                return
+            kind, *args = request
+            try:
+                if kind == "info":
+                    send_message(self.wfile, ("ok", self.server.info))
+                elif kind == "detect":
+                    futures = [self.server.batcher.submit(x) for x in args[0]]
+                    results = [future.result() for future in futures]
+                    send_message(self.wfile, ("ok", results))
+                elif kind == "video":
+                    self.stream_video(*args)
+                else:
+                    raise ValueError(f"Unknown request: {kind}")
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception:
+                send_message(self.wfile, ("error", traceback.format_exc()))
+
+    def stream_video(self, filename: str, options: dict[str, Any]) -> None:
+        """Sends the detections of every frame of a video, and whether it is
+        a scene cut, as soon as they are ready, followed by the number of
+        reused frames. Frames of the video are submitted ahead of the
+        results, so that they are batched with each other and with the frames
+        of other clients."""
+        scene_detector = None
+        if (
+            options["cut_thresh"] is not None
+            or options["static_thresh"] is not None
+        ):
+            scene_detector = SceneDetector(
+                options["cut_thresh"], options["static_thresh"]
+            )
+        sampler = FrameSampler(options["frame_stride"])
+        batcher = self.server.batcher
+        max_pending = 2 * batcher.max_batch
+        empty = Future()
+        empty.set_result(Detections.empty())
+        last = empty
+        # (future of the detections, is cut) of the frames not sent yet
+        pending = collections.deque()
+
+        def send_first() -> None:
+            future, is_cut = pending.popleft()
+            send_message(self.wfile, ("ok", (future.result(), is_cut)))
+
+        with Video(
+            filename,
+            max_frames=options["max_frames"],
+            scene_detector=scene_detector,
+        ) as video:
+            for _ in range(video.num_frames):
+                frame = video.read()
+                action = sampler(video.scene_info)
+                if action == FrameSampler.SKIP:
+                    future = empty
+                elif action == FrameSampler.REUSE:
+                    future = last
+                else:
+                    future = last = batcher.submit(frame)
+                pending.append((future, video.scene_info[0]))
+                while pending and (
+                    len(pending) > max_pending or pending[0][0].done()
+                ):
+                    send_first()
+        while pending:
+            send_first()
+        send_message(self.wfile, ("done", sampler.num_reused))
+
+
+class InferenceServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    """Long-lived local server that keeps the models of a ``FaceTracker``
+    loaded and warmed up.
+
+    Clients connect to a Unix socket, only accessible by the current user,
+    and send frames or paths of videos, which are decoded by the server.
+    Each client is served by its own thread, but all frames go through a
+    single queue, where they are grouped in batches of up to ``max_batch``
+    frames that arrive within ``max_wait`` seconds of each other. The faces
+    of each batch are embedded in a single run of the recognition model.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        face_tracker: FaceTracker,
+        socket_path: str | Path = DEFAULT_SOCKET,
+        max_batch: int = 16,
+        max_wait: float = 0.005,
+    ) -> None:
+        self.socket_path = str(socket_path)
+        check_socket_dir(self.socket_path, create=True)
+        if InferenceClient.connect(self.socket_path) is not None:
+            raise RuntimeError(
+                f"A server is already running at {self.socket_path}"
+            )
+        if os.path.exists(self.socket_path):
+            # Left by a server that did not shut down cleanly
+            os.unlink(self.socket_path)
+        tiler = face_tracker.tiler
+        self.info = {
+            "model_name": face_tracker.model_name,
+            "det_size": face_tracker.det_size,
+            "tile_size": None if tiler is None else tiler.tile_size,
+            "tile_overlap": 0.2 if tiler is None else tiler.overlap,
+            "tile_flagged": tiler is not None and tiler.only_flagged,
+        }
+        self.warmup(face_tracker)
+        self.batcher = _Batcher(face_tracker, max_batch, max_wait)
+        self.batcher.start()
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(self.socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+
+    @staticmethod
+    def warmup(face_tracker: FaceTracker) -> None:
+        """Loads the models and runs them once, so that the first requests
+        do not pay for the initialization of the ONNX sessions"""
+        height, width = face_tracker.det_size[1], face_tracker.det_size[0]
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        face_tracker.detect(frame)
+        landmarks = np.array(
+            [[38, 52], [74, 52], [56, 72], [42, 92], [70, 92]],
+            dtype=np.float32,
+        )
+        face_tracker.recognize(frame, landmarks[None])
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.batcher.stop()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class InferenceClient:
+    """Client of an ``InferenceServer``. Use ``connect`` to fall back to
+    local models when no server is running."""
+
+    def __init__(self, socket_path: str | Path = DEFAULT_SOCKET) -> None:
+        self.socket_path = str(socket_path)
+        # Only trust servers run by the current user
+        check_socket_dir(self.socket_path)
+        if os.stat(self.socket_path).st_uid != os.getuid():
+            raise PermissionError(
+                f"Socket {self.socket_path} is not owned by the current user"
+            )
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(self.socket_path)
+            self.check_peer()
+        except OSError:
+            self.sock.close()
+            raise
+        self.rfile = self.sock.makefile("rb")
+        self.info = self.request("info")
+        self.info["det_size"] = tuple(self.info["det_size"])
+
+    def check_peer(self) -> None:
+        """Raises PermissionError if the server process is run by another
+        user, where the platform tells it (Linux)"""
+        if not hasattr(socket, "SO_PEERCRED"):
+            return
+        creds = struct.Struct("3i")
+        data = self.sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, creds.size
+        )
+        _, uid, _ = creds.unpack(data)
+        if uid != os.getuid():
+            raise PermissionError(
+                f"Server at {self.socket_path} is run by another user"
+            )
+
+    @classmethod
+    def connect(
+        cls, socket_path: str | Path = DEFAULT_SOCKET
+    ) -> "InferenceClient | None":
+        """Returns a client of the server at ``socket_path``, or None if it is
+        not running or not trusted"""
+        try:
+            return cls(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError, PermissionError):
+            return None
+
+    def _recv(self) -> tuple[str, Any]:
+        status, result = recv_message(self.rfile)
+        if status == "error":
+            raise RuntimeError(f"Inference server error:\n{result}")
+        return status, result
+
+    def request(self, *request: Any) -> Any:
+        send_message(self.sock, request)
+        return self._recv()[1]
+
+    def detect(self, frame: np.ndarray) -> Detections:
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames: list[np.ndarray]) -> list[Detections]:
+        return self.request("detect", frames)
+
+    def detect_video(
+        self,
+        filename: str | Path,
+        cuts: list[int] | None = None,
+        max_frames: int | None = None,
+        frame_stride: int = 1,
+        cut_thresh: float | None = None,
+        static_thresh: float | None = None,
+    ) -> Generator[Detections, None, int]:
+        """Yields the detections of every frame of a video decoded by the
+        server. Scene cuts are appended to ``cuts`` as they are found, and the
+        number of static frames that reused detections is returned when it is
+        exhausted."""
+        options = {
+            "max_frames": max_frames,
+            "frame_stride": frame_stride,
+            "cut_thresh": cut_thresh,
+            "static_thresh": static_thresh,
+        }
+        # The server may not share the working directory of the client
+        send_message(self.sock, ("video", os.path.abspath(filename), options))
+        frame_idx = 0
+        while True:
+            status, result = self._recv()
+            if status == "done":
+                return result
+            detections, is_cut = result
+            if is_cut and cuts is not None:
+                cuts.append(frame_idx)
+            frame_idx += 1
+            yield detections
+
+    def close(self) -> None:
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self) -> "InferenceClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
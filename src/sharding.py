@@ -0,0 +1,223 @@
+import hashlib
+import os
+from pathlib import Path
+import socket
+import threading
+import time
+from typing import Iterable, Iterator
+import uuid
+
+__all__ = [
+    "WorkDir",
+    "distribute",
+    "item_key",
+    "parse_shard",
+    "shard_of",
+    "split_shard",
+]
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parses a shard given as 'i/N', with 0 <= i < N"""
+    index, _, num_shards = value.partition("/")
+    index, num_shards = int(index), int(num_shards)
+    if not 0 <= index < num_shards:
+        raise ValueError(f"Invalid shard: {value} (expected i/N, 0 <= i < N)")
+    return index, num_shards
+
+
+def _digest(key: str) -> bytes:
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    """Assigns a key to a shard. Unlike hash(), the result is the same on
+    every node and run."""
+    return int.from_bytes(_digest(key), "big") % num_shards
+
+
+class WorkDir:
+    """Shared directory where nodes claim work items with lock files.
+
+    A node claims an item by creating its lock file, which only succeeds on
+    one node, and renames it to a done file when finished. Items whose lock
+    is older than ``claim_timeout`` seconds are considered abandoned (e.g.,
+    the node was killed) and can be claimed again. While a node is alive, a
+    heartbeat thread refreshes the locks of its claims every quarter of the
+    timeout, so long items are not claimed twice. Each lock holds the token
+    of its owner, and a node never completes or releases a claim that was
+    taken over by another node.
+    """
+
+    def __init__(self, path: Path, claim_timeout: float | None = None) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.claim_timeout = claim_timeout
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        # Keys claimed by this node and not completed or released yet
+        self._claimed = set()
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    def _lock_path(self, key: str) -> Path:
+        return self.path / f"{_digest(key).hex()}.lock"
+
+    def _done_path(self, key: str) -> Path:
+        return self.path / f"{_digest(key).hex()}.done"
+
+    def is_done(self, key: str) -> bool:
+        return self._done_path(key).exists()
+
+    def owns(self, key: str) -> bool:
+        """Whether the lock of ``key`` exists and was written by this node"""
+        try:
+            with open(self._lock_path(key), "r") as lock_file:
+                return lock_file.readline().rstrip("\n") == self.owner
+        except FileNotFoundError:
+            return False
+
+    def _steal(self, lock_path: Path) -> bool:
+        if self.claim_timeout is None:
+            return False
+        try:
+            age = time.time() - lock_path.stat().st_mtime
+        except FileNotFoundError:
+            return True
+        if age < self.claim_timeout:
+            return False
+        # Only one node can rename the abandoned lock, and it removes it
+        stale_path = lock_path.with_suffix(f".stale.{self.owner}")
+        try:
+            os.rename(lock_path, stale_path)
+        except FileNotFoundError:
+            return False
+        stale_path.unlink(missing_ok=True)
+        return True
+
+    def _refresh(self) -> None:
+        interval = self.claim_timeout / 4
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                keys = list(self._claimed)
+            for key in keys:
+                if not self.owns(key):
+                    continue
+                try:
+                    os.utime(self._lock_path(key))
+                except FileNotFoundError:
+                    pass
+
+    def claim(self, key: str) -> bool:
+        if self.is_done(key):
+            return False
+        lock_path = self._lock_path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._steal(lock_path):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as lock_file:
+                lock_file.write(f"{self.owner}\n{key}\n")
+            # Another node may have finished it since the first check
+            if self.is_done(key):
+                lock_path.unlink()
+                return False
+            with self._lock:
+                self._claimed.add(key)
+                if self.claim_timeout is not None and self._heartbeat is None:
+                    self._heartbeat = threading.Thread(
+                        target=self._refresh, daemon=True
+                    )
+                    self._heartbeat.start()
+            return True
+        return False
+
+    def complete(self, key: str) -> None:
+        """Marks a claimed item as done, unless its claim was lost"""
+        with self._lock:
+            self._claimed.discard(key)
+        if not self.owns(key):
+            return
+        try:
+            os.replace(self._lock_path(key), self._done_path(key))
+        except FileNotFoundError:
+            pass
+
+    def release(self, key: str) -> None:
+        """Removes the claim of an item, unless it was lost"""
+        with self._lock:
+            self._claimed.discard(key)
+        if self.owns(key):
+            self._lock_path(key).unlink(missing_ok=True)
+
+
+def item_key(path: Path, root: Path) -> str:
+    return Path(path).relative_to(root).as_posix()
+
+
+def split_shard(
+    paths: Iterable[Path], root: Path, shard: tuple[int, int]
+) -> tuple[list[Path], list[Path]]:
+    """Splits paths into those of ``shard`` and those of the other shards"""
+    own, others = [], []
+    for path in paths:
+        if shard_of(item_key(path, root), shard[1]) == shard[0]:
+            own.append(path)
+        else:
+            others.append(path)
+    return own, others
+
+
+def distribute(
+    paths: Iterable[Path],
+    root: Path,
+    shard: tuple[int, int] | None = None,
+    work_dir: WorkDir | None = None,
+    complete: bool = True,
+) -> Iterator[Path]:
+    """Yields the paths that this node must process.
+
+    Items are keyed by their path relative to ``root``, so nodes can mount
+    the dataset in different locations. With ``shard`` = (i, N), only the
+    items of shard i are processed. With ``work_dir``, each item is claimed
+    before it is yielded and marked as done when the next one is requested,
+    or released if the caller stops with an error; if both are set, the
+    node first processes its shard and then takes unclaimed items from the
+    other shards, so faster nodes do more work. With ``complete`` False,
+    claimed items are neither marked as done nor released, and the caller
+    must do it (e.g., to process several items at once).
+    """
+    if shard is None and work_dir is None:
+        yield from paths
+        return
+
+    def process(path: Path, key: str) -> Iterator[Path]:
+        if work_dir is None:
+            yield path
+            return
+        if not work_dir.claim(key):
+            return
+        if not complete:
+            yield path
+            return
+        try:
+            yield path
+        except GeneratorExit:
+            work_dir.release(key)
+            raise
+        work_dir.complete(key)
+
+    others = []
+    for path in paths:
+        key = item_key(path, root)
+        if shard is not None and shard_of(key, shard[1]) != shard[0]:
+            others.append((path, key))
+            continue
+        yield from process(path, key)
+
+    if work_dir is not None:
+        for path, key in others:
+            yield from process(path, key)
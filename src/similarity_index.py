@@ -0,0 +1,171 @@
+import numpy as np
+
+__all__ = ["INDEX_TYPES", "BruteForceIndex", "HNSWIndex", "create_index"]
+
+INDEX_TYPES = ("brute_force", "hnsw")
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class BruteForceIndex:
+    """Exact cosine distance search over a matrix of normalized vectors.
+
+    Rows are stored contiguously and removed rows are filled with the last
+    one, so searching is a single matrix-vector product.
+    """
+
+    def __init__(self, dim: int | None = None, capacity: int = 64) -> None:
+        self.keys = []
+        self.rows = dict()
+        self.capacity = capacity
+        self.vectors = None if dim is None else self._allocate(dim, capacity)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def _allocate(self, dim: int, capacity: int) -> np.ndarray:
+        return np.zeros((capacity, dim), dtype=np.float32)
+
+    def add(self, key: str, vector: np.ndarray) -> None:
+        vector = _normalize(vector)
+        if self.vectors is None:
+            self.vectors = self._allocate(len(vector), self.capacity)
+        if key in self.rows:
+            self.vectors[self.rows[key]] = vector
+            return
+
+        row = len(self.keys)
+        if row == len(self.vectors):
+            vectors = self._allocate(self.vectors.shape[1], 2 * row)
+            vectors[:row] = self.vectors
+            self.vectors = vectors
+        self.vectors[row] = vector
+        self.keys.append(key)
+        self.rows[key] = row
+
+    def get(self, key: str) -> np.ndarray:
+        return self.vectors[self.rows[key]]
+
+    def remove(self, key: str) -> None:
+        row = self.rows.pop(key)
+        last_row = len(self.keys) - 1
+        last_key = self.keys.pop()
+        if last_row != row:
+            self.vectors[row] = self.vectors[last_row]
+            self.keys[row] = last_key
+            self.rows[last_key] = row
+
+    def search(
+        self, vector: np.ndarray, k: int = 1
+    ) -> tuple[list[str], np.ndarray]:
+        if len(self.keys) == 0:
+            return [], np.empty((0,), dtype=np.float32)
+        k = min(k, len(self.keys))
+        distances = 1 - self.vectors[: len(self.keys)] @ _normalize(vector)
+        if k == 1:
+            indices = np.argmin(distances)[None]
+        else:
+            indices = np.argpartition(distances, k - 1)[:k]
+            indices = indices[np.argsort(distances[indices])]
+        return [self.keys[idx] for idx in indices], distances[indices]
+
+
+class HNSWIndex:
+    """Approximate cosine distance search with a HNSW graph (hnswlib).
+
+    Updating a key replaces its vector in the graph and removed keys are
+    marked as deleted, so their slots are reused by later insertions.
+    """
+
+    def __init__(
+        self,
+        dim: int | None = None,
+        capacity: int = 1024,
+        ef_construction: int = 200,
+        M: int = 16,
+        ef: int = 64,
+    ) -> None:
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError(
+                "hnswlib is required for the HNSW index: "
+                "pip install video-face-tracking[ann]"
+            ) from e
+        self._hnswlib = hnswlib
+        self.capacity = capacity
+        self.ef_construction = ef_construction
+        self.M = M
+        self.ef = ef
+
+        self.labels = dict()
+        self.keys = dict()
+        self.next_label = 0
+        self.index = None if dim is None else self._create(dim)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.labels
+
+    def _create(self, dim: int) -> object:
+        index = self._hnswlib.Index(space="cosine", dim=dim)
+        index.init_index(
+            max_elements=self.capacity,
+            ef_construction=self.ef_construction,
+            M=self.M,
+            allow_replace_deleted=True,
+        )
+        index.set_ef(self.ef)
+        return index
+
+    def add(self, key: str, vector: np.ndarray) -> None:
+        vector = _normalize(vector)
+        if self.index is None:
+            self.index = self._create(len(vector))
+
+        if key in self.labels:
+            self.index.add_items(vector[None], [self.labels[key]])
+            return
+
+        if self.index.get_current_count() >= self.index.get_max_elements():
+            self.index.resize_index(2 * self.index.get_max_elements())
+        label = self.next_label
+        self.next_label += 1
+        self.index.add_items(vector[None], [label], replace_deleted=True)
+        self.labels[key] = label
+        self.keys[label] = key
+
+    def get(self, key: str) -> np.ndarray:
+        return np.asarray(self.index.get_items([self.labels[key]]))[0]
+
+    def remove(self, key: str) -> None:
+        label = self.labels.pop(key)
+        del self.keys[label]
+        self.index.mark_deleted(label)
+
+    def search(
+        self, vector: np.ndarray, k: int = 1
+    ) -> tuple[list[str], np.ndarray]:
+        if len(self.labels) == 0:
+            return [], np.empty((0,), dtype=np.float32)
+        k = min(k, len(self.labels))
+        labels, distances = self.index.knn_query(_normalize(vector)[None], k=k)
+        return [self.keys[label] for label in labels[0]], distances[0]
+
+
+def create_index(
+    index_type: str = "brute_force", **kwargs
+) -> BruteForceIndex | HNSWIndex:
+    if index_type == "brute_force":
+        return BruteForceIndex(**kwargs)
+    if index_type == "hnsw":
+        return HNSWIndex(**kwargs)
+    raise ValueError(f"Unknown index type: {index_type} ({INDEX_TYPES})")
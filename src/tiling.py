@@ -0,0 +1,158 @@
+from typing import Callable
+
+import numpy as np
+
+__all__ = ["TileDetector", "box_iou_matrix", "nms", "tile_grid"]
+
+
+def tile_grid(
+    height: int, width: int, tile_size: int, overlap: float = 0.2
+) -> np.ndarray:
+    """Returns the (T, 4) boxes of square tiles of ``tile_size`` pixels that
+    cover an image, overlapping at least ``overlap`` times the tile size.
+    Tiles are clipped to the image if it is smaller than a tile."""
+    step = max(int(tile_size * (1 - overlap)), 1)
+
+    def starts(length: int) -> np.ndarray:
+        if length <= tile_size:
+            return np.zeros(1, dtype=np.int64)
+        num_tiles = int(np.ceil((length - tile_size) / step)) + 1
+        return np.linspace(0, length - tile_size, num_tiles).round().astype(
+            np.int64
+        )
+
+    ys, xs = np.meshgrid(starts(height), starts(width), indexing="ij")
+    x1, y1 = xs.ravel(), ys.ravel()
+    return np.stack(
+        (
+            x1,
+            y1,
+            np.minimum(x1 + tile_size, width),
+            np.minimum(y1 + tile_size, height),
+        ),
+        axis=1,
+    )
+
+
+def box_iou_matrix(boxes: np.ndarray) -> np.ndarray:
+    """IoU between every pair of (N, 4) boxes"""
+    x1, y1, x2, y2 = (boxes[:, i] for i in range(4))
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    inter_w = np.clip(
+        np.minimum(x2[:, None], x2[None]) - np.maximum(x1[:, None], x1[None]),
+        0,
+        None,
+    )
+    inter_h = np.clip(
+        np.minimum(y2[:, None], y2[None]) - np.maximum(y1[:, None], y1[None]),
+        0,
+        None,
+    )
+    inter = inter_w * inter_h
+    return inter / np.maximum(areas[:, None] + areas[None] - inter, 1e-6)
+
+
+def nms(bboxes: np.ndarray, iou_thresh: float = 0.4) -> np.ndarray:
+    """Non-maximum suppression of (N, 5) boxes with scores. The IoU of all
+    pairs is computed at once, and the greedy pass only masks rows of it.
+    Returns the indices of the kept boxes, by descending score."""
+    order = np.argsort(-bboxes[:, 4], kind="stable")
+    iou = box_iou_matrix(bboxes[order, :4])
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1 :] &= iou[i, i + 1 :] <= iou_thresh
+    return order[keep]
+
+
+class TileDetector:
+    """Finds small faces in large images by detecting them in tiles.
+
+    A full-frame (coarse) detection, which finds the large faces, is merged
+    with the detections of overlapping tiles of ``tile_size`` pixels, run at
+    their native resolution. Faces cut by the border of a tile are dropped,
+    since the overlap keeps them whole in a neighbouring tile, and duplicates
+    are removed with NMS. With ``only_flagged``, only the tiles that overlap
+    a coarse detection are run, which suits frames where faces are grouped
+    (e.g., a crowd) at a fraction of the cost.
+    """
+
+    def __init__(
+        self,
+        tile_size: int = 640,
+        overlap: float = 0.2,
+        only_flagged: bool = False,
+        iou_thresh: float = 0.4,
+        border_margin: float = 2.0,
+    ) -> None:
+        if tile_size % 32 != 0:
+            raise ValueError(f"Tile size must be a multiple of 32: {tile_size}")
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.only_flagged = only_flagged
+        self.iou_thresh = iou_thresh
+        self.border_margin = border_margin
+
+    def get_tiles(
+        self, image: np.ndarray, coarse_bboxes: np.ndarray
+    ) -> np.ndarray:
+        height, width = image.shape[:2]
+        if max(height, width) <= self.tile_size:
+            return np.empty((0, 4), dtype=np.int64)
+        tiles = tile_grid(height, width, self.tile_size, self.overlap)
+        if self.only_flagged:
+            boxes = coarse_bboxes[:, :4]
+            flagged = (
+                (tiles[:, None, 0] < boxes[None, :, 2])
+                & (tiles[:, None, 2] > boxes[None, :, 0])
+                & (tiles[:, None, 1] < boxes[None, :, 3])
+                & (tiles[:, None, 3] > boxes[None, :, 1])
+            ).any(axis=1)
+            tiles = tiles[flagged]
+        return tiles
+
+    def __call__(
+        self,
+        detect_faces: Callable[..., tuple[np.ndarray, np.ndarray]],
+        image: np.ndarray,
+        coarse_bboxes: np.ndarray,
+        coarse_landmarks: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Adds the faces found in the tiles of ``image`` by ``detect_faces``
+        (see ``FaceTracker.detect_faces``) to the coarse (N, 5) boxes and
+        (N, 5, 2) landmarks."""
+        tiles = self.get_tiles(image, coarse_bboxes)
+        if len(tiles) == 0:
+            return coarse_bboxes, coarse_landmarks
+        height, width = image.shape[:2]
+        margin = self.border_margin
+
+        all_bboxes = [coarse_bboxes.reshape(-1, 5)]
+        all_landmarks = [coarse_landmarks.reshape(-1, 5, 2)]
+        for x1, y1, x2, y2 in tiles.tolist():
+            # Tiles clipped to the image are padded, not resized
+            bboxes, landmarks = detect_faces(
+                image[y1:y2, x1:x2], input_size=(self.tile_size, self.tile_size)
+            )
+            if len(bboxes) == 0:
+                continue
+            # Drop faces cut by inner borders of the tile
+            cut = np.zeros(len(bboxes), dtype=bool)
+            if x1 > 0:
+                cut |= bboxes[:, 0] < margin
+            if y1 > 0:
+                cut |= bboxes[:, 1] < margin
+            if x2 < width:
+                cut |= bboxes[:, 2] > x2 - x1 - margin
+            if y2 < height:
+                cut |= bboxes[:, 3] > y2 - y1 - margin
+            offset = np.array([x1, y1], dtype=np.float32)
+            bboxes = bboxes[~cut].copy()
+            bboxes[:, :4] += np.tile(offset, 2)
+            all_bboxes.append(bboxes)
+            all_landmarks.append(landmarks[~cut].reshape(-1, 5, 2) + offset)
+
+        bboxes = np.concatenate(all_bboxes).astype(np.float32)
+        landmarks = np.concatenate(all_landmarks).astype(np.float32)
+        keep = nms(bboxes, self.iou_thresh)
+        return bboxes[keep], landmarks[keep]
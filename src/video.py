@@ -1,15 +1,86 @@
-from typing import Callable, Sequence
+from collections import deque
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+from threading import Condition, Thread
+import time
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Sequence
 
 import cv2
 from imutils.video import FileVideoStream
 import numpy as np
 
 
-__all__ = ["VIDEO_FORMATS", "Video", "play_video"]
+__all__ = [
+    "VIDEO_FORMATS",
+    "LiveStream",
+    "SceneDetector",
+    "SharedFrame",
+    "SharedFramePool",
+    "Video",
+    "play_video",
+    "grab_frames",
+    "read_frames",
+    "read_shared_frames",
+]
 
 VIDEO_FORMATS = (".mp4", ".mov", ".avi", ".wmv", ".webm", ".flv")
 
 
+class SceneDetector:
+    """Detects shot cuts and static frames on downscaled grayscale frames.
+
+    A frame is a cut when its intensity histogram differs from the one of the
+    previous frame by more than ``cut_thresh`` (half the L1 distance, from 0
+    to 1). A frame is static when its mean absolute difference with the last
+    frame that was not static is below ``static_thresh`` (relative to 255),
+    so slow changes accumulate instead of being ignored. Either test is
+    disabled when its threshold is None.
+    """
+
+    def __init__(
+        self,
+        cut_thresh: float | None = 0.4,
+        static_thresh: float | None = None,
+        size: int = 64,
+        bins: int = 32,
+    ) -> None:
+        self.cut_thresh = cut_thresh
+        self.static_thresh = static_thresh
+        self.size = size
+        self.bins = bins
+        self.prev_hist = None
+        self.ref_frame = None
+
+    def __call__(self, frame: np.ndarray) -> tuple[bool, bool]:
+        """Returns whether the frame is a cut and whether it is static"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(
+            gray, (self.size, self.size), interpolation=cv2.INTER_AREA
+        )
+        hist = np.bincount(
+            small.ravel().astype(np.int32) * self.bins // 256,
+            minlength=self.bins,
+        ) / small.size
+
+        is_cut = False
+        if self.cut_thresh is not None and self.prev_hist is not None:
+            is_cut = np.abs(hist - self.prev_hist).sum() / 2 > self.cut_thresh
+        self.prev_hist = hist
+
+        is_static = False
+        small = small.astype(np.int16)
+        if (
+            self.static_thresh is not None
+            and self.ref_frame is not None
+            and not is_cut
+        ):
+            diff = np.abs(small - self.ref_frame).mean() / 255
+            is_static = diff < self.static_thresh
+        if not is_static:
+            self.ref_frame = small
+        return bool(is_cut), bool(is_static)
+
+
 class Video(FileVideoStream):
     def __init__(
         self,
@@ -17,7 +88,14 @@ class Video(FileVideoStream):
         transform: Callable | None = None,
         queue_size: int = 128,
         max_frames: int | None = None,
+        scene_detector: SceneDetector | None = None,
     ) -> None:
+        self.scene_detector = scene_detector
+        # Result of the scene detector for the last read frame
+        self.scene_info = (False, False)
+        if scene_detector is not None:
+            # Run it in the decoding thread, together with the transform
+            transform = self._with_scene_info(transform, scene_detector)
         super().__init__(path, transform, queue_size)
 
         frame_count = int(self.stream.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -28,6 +106,28 @@ class Video(FileVideoStream):
         self.width = int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.fps = int(self.stream.get(cv2.CAP_PROP_FPS))
 
+    @staticmethod
+    def _with_scene_info(
+        transform: Callable | None, scene_detector: SceneDetector
+    ) -> Callable:
+        def transform_frame(
+            frame: np.ndarray | None,
+        ) -> tuple[np.ndarray | None, tuple[bool, bool]]:
+            if frame is None:
+                return frame, (False, False)
+            scene_info = scene_detector(frame)
+            if transform is not None:
+                frame = transform(frame)
+            return frame, scene_info
+
+        return transform_frame
+
+    def read(self) -> np.ndarray:
+        frame = super().read()
+        if self.scene_detector is not None:
+            frame, self.scene_info = frame
+        return frame
+
     def __enter__(self) -> "Video":
         self.start()
         return self
@@ -36,6 +136,264 @@ class Video(FileVideoStream):
         self.stop()
 
 
+class LiveStream:
+    """Reads frames from a live source in a background thread.
+
+    The source can be a camera index, a path or URL readable by OpenCV (video
+    files, RTSP streams, named pipes...), an open ``cv2.VideoCapture`` or any
+    iterable of frames. Frames are buffered in a bounded queue: when the
+    consumer falls behind, the oldest frames are dropped instead of
+    accumulating latency. Iterating over the stream yields tuples with the
+    frame index in the source, the capture timestamp (``time.monotonic``)
+    and the frame. If ``fps`` is set, frames are read at that rate, which
+    makes a (looping) file behave like a live source.
+    """
+
+    def __init__(
+        self,
+        source: int | str | cv2.VideoCapture | Iterable[np.ndarray],
+        queue_size: int = 4,
+        loop: bool = False,
+        max_frames: int | None = None,
+        fps: float | None = None,
+    ) -> None:
+        if isinstance(source, (int, str)):
+            source = cv2.VideoCapture(source)
+            if not source.isOpened():
+                raise RuntimeError(f"Could not open video source: {source}")
+        self.source = source
+        self.loop = loop
+        self.max_frames = max_frames
+        self.fps = fps
+
+        self.queue = deque(maxlen=queue_size)
+        self.condition = Condition()
+        self.stopped = False
+        self.finished = False
+        self.num_frames = 0
+        self.num_dropped = 0
+        self.thread = Thread(target=self._update, daemon=True)
+
+    def _read_frames(self) -> Iterator[np.ndarray]:
+        if not isinstance(self.source, cv2.VideoCapture):
+            yield from self.source
+            return
+
+        while True:
+            grabbed, frame = self.source.read()
+            if grabbed:
+                yield frame
+            elif self.loop and self.num_frames > 0:
+                self.source.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            else:
+                return
+
+    def _update(self) -> None:
+        start = time.monotonic()
+        for frame in self._read_frames():
+            if self.stopped or self.num_frames == self.max_frames:
+                break
+            if self.fps is not None:
+                delay = start + self.num_frames / self.fps - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            item = (self.num_frames, time.monotonic(), frame)
+            with self.condition:
+                if len(self.queue) == self.queue.maxlen:
+                    self.num_dropped += 1
+                self.queue.append(item)
+                self.condition.notify()
+            self.num_frames += 1
+
+        with self.condition:
+            self.finished = True
+            self.condition.notify()
+
+    def start(self) -> "LiveStream":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.thread.join()
+        if isinstance(self.source, cv2.VideoCapture):
+            self.source.release()
+
+    def __enter__(self) -> "LiveStream":
+        return self.start()
+
+    def __exit__(self, *args, **kwargs) -> None:
+        self.stop()
+
+    def __iter__(self) -> Iterator[tuple[int, float, np.ndarray]]:
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: len(self.queue) > 0 or self.finished
+                )
+                if len(self.queue) == 0:
+                    return
+                item = self.queue.popleft()
+            yield item
+
+
+class SharedFrame(NamedTuple):
+    """Reference to a frame stored in a ``SharedFramePool``"""
+
+    slot: int
+    shape: tuple[int, ...]
+
+
+class SharedFramePool:
+    """Fixed pool of frame slots in shared memory.
+
+    Frames are written once into a free slot and processes exchange only
+    ``SharedFrame`` references (slot index and shape), so frames are never
+    pickled. Each slot holds a frame of up to ``max_shape``. ``put`` blocks
+    while all slots are in use, until a consumer calls ``release``, which
+    bounds the memory used by the frames in flight. The pool can be passed to
+    worker processes as an argument when they are started; only the process
+    that created it unlinks the shared memory on ``close``.
+    """
+
+    def __init__(
+        self,
+        num_slots: int,
+        max_shape: tuple[int, ...],
+        dtype: Any = np.uint8,
+        ctx: Any = None,
+    ) -> None:
+        ctx = mp.get_context() if ctx is None else ctx
+        self.num_slots = num_slots
+        self.max_shape = tuple(max_shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_size = int(np.prod(self.max_shape)) * self.dtype.itemsize
+        self.shm = SharedMemory(create=True, size=num_slots * self.slot_size)
+        self.owner = True
+        self.free_slots = ctx.Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.shm = SharedMemory(name=state["shm"])
+        self.owner = False
+
+    def _view(self, slot: int, shape: tuple[int, ...]) -> np.ndarray:
+        return np.ndarray(
+            shape,
+            dtype=self.dtype,
+            buffer=self.shm.buf,
+            offset=slot * self.slot_size,
+        )
+
+    def _acquire(self, shape: tuple[int, ...]) -> int:
+        if np.prod(shape) * self.dtype.itemsize > self.slot_size:
+            raise ValueError(
+                f"Frame of shape {shape} does not fit in a slot of shape "
+                f"{self.max_shape}"
+            )
+        return self.free_slots.get()
+
+    def put(self, frame: np.ndarray) -> SharedFrame:
+        slot = self._acquire(frame.shape)
+        self._view(slot, frame.shape)[:] = frame
+        return SharedFrame(slot, frame.shape)
+
+    def read(self, stream: cv2.VideoCapture) -> SharedFrame | None:
+        """Decodes the next frame of ``stream`` directly into a free slot.
+        Returns None when the stream ends."""
+        shape = self.max_shape
+        slot = self._acquire(shape)
+        grabbed, frame = stream.read(self._view(slot, shape))
+        if not grabbed:
+            self.free_slots.put(slot)
+            return None
+        if frame.shape != shape:
+            # The frame is not the expected size and OpenCV reallocated it
+            self._view(slot, frame.shape)[:] = frame
+        return SharedFrame(slot, frame.shape)
+
+    def get(self, frame: SharedFrame) -> np.ndarray:
+        """Returns a view of the frame, valid until it is released"""
+        return self._view(frame.slot, frame.shape)
+
+    def release(self, frame: SharedFrame) -> None:
+        self.free_slots.put(frame.slot)
+
+    def close(self) -> None:
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self) -> "SharedFramePool":
+        return self
+
+    def __exit__(self, *args, **kwargs) -> None:
+        self.close()
+
+
+def read_shared_frames(
+    path: str, pool: SharedFramePool, max_frames: int | None = None
+) -> Iterator[SharedFrame]:
+    """Decodes a video into the slots of ``pool``"""
+    stream = cv2.VideoCapture(path)
+    num_frames = 0
+    try:
+        while num_frames != max_frames:
+            frame = pool.read(stream)
+            if frame is None:
+                break
+            yield frame
+            num_frames += 1
+    finally:
+        stream.release()
+
+
+def read_frames(path: str, indices: Sequence[int]) -> list[np.ndarray]:
+    """Reads the given frames by seeking, without decoding the whole video"""
+    stream = cv2.VideoCapture(path)
+    frames = []
+    try:
+        for frame_idx in sorted(indices):
+            stream.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            grabbed, frame = stream.read()
+            if not grabbed:
+                break
+            frames.append(frame)
+    finally:
+        stream.release()
+    return frames
+
+
+def grab_frames(
+    path: str, indices: Sequence[int]
+) -> Iterator[tuple[int, np.ndarray]]:
+    """Reads the video sequentially, but only retrieves and converts the given
+    frames. Unlike ``read_frames``, frames are exact even when seeking is not
+    reliable, and it is faster when frames are close to each other."""
+    stream = cv2.VideoCapture(path)
+    frame_idx = 0
+    try:
+        for target_idx in sorted(set(indices)):
+            while frame_idx < target_idx:
+                if not stream.grab():
+                    return
+                frame_idx += 1
+            grabbed, frame = stream.read()
+            if not grabbed:
+                return
+            frame_idx += 1
+            yield target_idx, frame
+    finally:
+        stream.release()
+
+
 def play_video(
     frames: Sequence[np.ndarray],
     fps: float = 30,